@@ -0,0 +1,237 @@
+# api/async_views.py
+"""
+Асинхронные версии самых частых публичных чтений каталога (/api/async/...).
+
+Предназначены для запуска под ASGI (uvicorn): пока запрос ждет SQLite,
+воркер обслуживает другие запросы. Формат ответов совпадает с синхронными
+endpoint'ами, поэтому фронтенд переключается сменой префикса.
+
+Это обычные Django-представления без DRF, поэтому троттлинг DRF
+(DEFAULT_THROTTLE_CLASSES) применяется явно декоратором throttled, а параметры
+запроса разбираются тем же кодом, что и в синхронных viewset'ах: фильтры
+товаров и брендов, ?fields=/?omit=, ?detail=lean, ?limit= у категорий.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Q
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import NotFound, Throttled
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import documents, home
+from .cards import aserialize_product_cards, prepare_product_list
+from .db_routing import replica_read
+from .models import Banner, Brand, Category, Product, ProductDocument
+from .pagination import StandardResultsSetPagination
+from .serializers import (
+    BannerSerializer, BrandSerializer, CategorySerializer, ProductDetailSerializer,
+    ProductLeanDetailSerializer, parse_field_selection
+)
+from .views import BrandViewSet, apply_product_filters
+
+FRAGMENT_TIMEOUT = 60 * 5
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, safe=False, encoder=DjangoJSONEncoder,
+                        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+async def paginate(request, queryset):
+    """Страница в формате StandardResultsSetPagination: (items, meta) или (None, ответ 404)"""
+    pagination = StandardResultsSetPagination
+    try:
+        page_size = min(int(request.GET.get(pagination.page_size_query_param, pagination.page_size)),
+                        pagination.max_page_size)
+        if page_size < 1:
+            raise ValueError
+    except ValueError:
+        page_size = pagination.page_size
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 0
+
+    count = await queryset.acount()
+    pages = max(1, -(-count // page_size))
+    if page < 1 or page > pages:
+        return None, json_response({'detail': 'Invalid page.'}, status=404)
+
+    offset = (page - 1) * page_size
+    items = [obj async for obj in queryset[offset:offset + page_size]]
+
+    url = request.build_absolute_uri()
+    previous = None
+    if page > 1:
+        previous = remove_query_param(url, 'page') if page == 2 else replace_query_param(url, 'page', page - 1)
+    meta = {
+        'count': count,
+        'next': replace_query_param(url, 'page', page + 1) if page < pages else None,
+        'previous': previous,
+    }
+    return items, meta
+
+
+def drf_request(request):
+    """Request DRF с аутентификацией по DEFAULT_AUTHENTICATION_CLASSES"""
+    return Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+
+
+def _throttle_error(request):
+    """Как APIView.check_throttles: исключение Throttled или None"""
+    request = drf_request(request)
+    durations = [
+        throttle.wait() for throttle in (cls() for cls in api_settings.DEFAULT_THROTTLE_CLASSES)
+        if not throttle.allow_request(request, None)
+    ]
+    if not durations:
+        return None
+    return Throttled(max((duration for duration in durations if duration is not None), default=None))
+
+
+def throttled(view_func):
+    """Троттлинг DRF для async-представления; аутентификация и кэш - в потоке"""
+    @functools.wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        exc = await sync_to_async(_throttle_error)(request)
+        if exc is not None:
+            response = json_response({'detail': str(exc.detail)}, status=exc.status_code)
+            if exc.wait:
+                response['Retry-After'] = '%d' % exc.wait
+            return response
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def _filtered_products(request):
+    return prepare_product_list(apply_product_filters(Request(request), Product.objects.all()),
+                                parse_field_selection(request))
+
+
+@require_GET
+@throttled
+@replica_read
+async def product_list(request):
+    # фильтры разрешают теги и категорию запросами к БД - выполняем их в потоке
+    queryset = await sync_to_async(_filtered_products)(request)
+    items, meta = await paginate(request, queryset)
+    if items is None:
+        return meta
+    meta['results'] = await aserialize_product_cards(items, {'request': request})
+    return json_response(meta)
+
+
+def _live_product_detail(slug, request):
+    # как ProductViewSet.get_serializer_class / get_queryset
+    serializer_class = ProductLeanDetailSerializer if request.GET.get('detail') == 'lean' else ProductDetailSerializer
+    queryset = Product.objects.filter(slug=slug)
+    if request.GET:
+        queryset = serializer_class.setup_eager_loading(queryset, serializer_class.requested_fields(request))
+    else:
+        queryset = serializer_class.setup_eager_loading(queryset)
+    product = queryset.first()
+    if product is None:
+        return None
+    data = serializer_class(product, context={'request': request}).data
+    if not request.GET:
+        documents.schedule_rebuild([product.pk])
+    return data
+
+
+@require_GET
+@throttled
+@replica_read
+async def product_detail(request, slug):
+    # предсобранный документ - только полная карточка без параметров, как в ProductViewSet.retrieve
+    if not request.GET:
+        row = await ProductDocument.objects.filter(product__slug=slug).values('data', 'is_stale').afirst()
+        if row is not None and not row['is_stale']:
+            return json_response(documents.absolutize_urls(row['data'], request))
+
+    data = await sync_to_async(_live_product_detail)(slug, request)
+    if data is None:
+        return json_response({'detail': 'No Product matches the given query.'}, status=404)
+    return json_response(data)
+
+
+def _category_tree(request):
+    # как CategoryViewSet.get_queryset: products_count только если попадет в ответ, ?limit=
+    request = Request(request)
+    categories = Category.objects.filter(parent=None).order_by('order', 'name')
+    if 'products_count' in CategorySerializer.requested_fields(request):
+        categories = categories.annotate(direct_products_count=Count('products', distinct=True))
+    limit = request.query_params.get('limit')
+    if limit:
+        try:
+            categories = categories[:int(limit)]
+        except (ValueError, TypeError):
+            pass
+    # пагинация по умолчанию из REST_FRAMEWORK
+    paginator = PageNumberPagination()
+    page = paginator.paginate_queryset(categories, request)
+    data = CategorySerializer(page, many=True, context={'request': request}).data
+    return paginator.get_paginated_response(data).data
+
+
+@require_GET
+@throttled
+@replica_read
+async def category_tree(request):
+    key = f'async:categories:{request.build_absolute_uri()}'
+    data = await cache.aget(key)
+    if data is None:
+        # дерево сериализуется рекурсивно с запросами на каждом уровне
+        try:
+            data = await sync_to_async(_category_tree)(request)
+        except NotFound as exc:
+            return json_response({'detail': str(exc.detail)}, status=404)
+        await cache.aset(key, data, FRAGMENT_TIMEOUT)
+    return json_response(data)
+
+
+def _brand_queryset(request):
+    """Бренды с фильтрами BrandViewSet (?search=, ?category=, ?has_products=, price_*,
+    ?has_available=, ?ordering=); без ?ordering= - по имени, для стабильной пагинации"""
+    request = Request(request)
+    queryset = Brand.objects.order_by('name')
+    for backend in BrandViewSet.filter_backends:
+        queryset = backend().filter_queryset(request, queryset, BrandViewSet)
+    return queryset
+
+
+@require_GET
+@throttled
+@replica_read
+async def brand_list(request):
+    items, meta = await paginate(request, _brand_queryset(request))
+    if items is None:
+        return meta
+    meta['results'] = BrandSerializer(items, many=True, context={'request': request}).data
+    return json_response(meta)
+
+
+@require_GET
+@throttled
+@replica_read
+async def banner_list(request):
+    key = f'async:banners:{request.build_absolute_uri("/")}'
+    data = await cache.aget(key)
+    if data is None:
+        banners = [b async for b in Banner.objects.filter(is_active=True).order_by('order')]
+        data = BannerSerializer(banners, many=True, context={'request': request}).data
+        await cache.aset(key, data, FRAGMENT_TIMEOUT)
+    return json_response(data)
+
+
+@require_GET
+@throttled
+@replica_read
+async def home_page(request):
+    return json_response(await home.aget_home(request))
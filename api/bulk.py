@@ -0,0 +1,193 @@
+# api/bulk.py
+"""
+Массовые изменения товаров в обход сигналов.
+
+bulk_create, bulk_update, update_rows и raw_delete не вызывают сигналы api/signals.py,
+поэтому производные данные (документы карточек, фрагменты главной, фасеты
+характеристик, поисковый индекс) обновляются явно через products_changed и
+categories_changed - одним вызовом на пачку вместо обработчика на каждую строку.
+
+sync_features, sync_tag_groups и sync_images приводят связи одного товара к
+присланному списку по разнице: совпавшие строки не трогаются (id сохраняются),
+остальное - один bulk_update, один bulk_create и один DELETE на связь.
+"""
+from django.db import connection
+
+from . import documents, facets, home, search
+from .models import Image, ProductFeature, ProductTagGroup
+
+
+def raw_delete(queryset):
+    """DELETE одним запросом: без выборки объектов, каскада Collector и сигналов.
+
+    Подходит только для таблиц, на которые никто не ссылается (или ссылки
+    удалены заранее). Возвращает число удаленных строк.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def update_rows(objs, fields):
+    """bulk_update для больших пачек: один UPDATE ... WHERE id = %s через executemany.
+
+    QuerySet.bulk_update строит CASE WHEN на каждый объект и поле, и на тысячах
+    строк сборка SQL обходится дороже самой записи. auto_now не применяется.
+    """
+    if not objs:
+        return
+    meta = type(objs[0])._meta
+    quote = connection.ops.quote_name
+    columns = [meta.get_field(name) for name in fields]
+    assignments = ', '.join(f'{quote(field.column)} = %s' for field in columns)
+    sql = f'UPDATE {quote(meta.db_table)} SET {assignments} WHERE {quote(meta.pk.column)} = %s'
+    params = [
+        [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in columns] + [obj.pk]
+        for obj in objs
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def products_changed(product_ids, rebuild_documents=True):
+    """Документы, поисковый индекс и товары главной после коммита текущей транзакции.
+
+    rebuild_documents=False - документы только помечаются устаревшими (см. documents.mark_stale).
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    documents.mark_stale(product_ids, rebuild_documents)
+    search.refresh_products(product_ids)
+    search.record_changes('product', product_ids)
+    home.invalidate('products')
+
+
+def categories_changed(category_ids, counts_changed=False, rebuild_documents=True):
+    """Фасеты характеристик категорий; counts_changed - менялся состав категорий
+    (создание или перенос товаров), от него зависят products_count в документах"""
+    category_ids = {pk for pk in category_ids if pk}
+    facets.refresh_feature_facets(category_ids)
+    if counts_changed and category_ids:
+        for category_id in category_ids:
+            documents.mark_category_id_stale(category_id, rebuild_documents)
+        home.invalidate('categories')
+
+
+def relations_changed(product, features=False, images=False):
+    """Связи товара изменены через sync_* (как product_relation_changed в сигналах)"""
+    documents.mark_stale([product.pk])
+    if features:
+        facets.refresh_feature_facets([product.category_id])
+    if images:
+        home.invalidate('products')
+
+
+def sync_features(product, items):
+    """items - [{'feature_id', 'value_id'}]. Возвращает True, если что-то изменилось."""
+    incoming = list(dict.fromkeys(
+        (int(item['feature_id']), int(item['value_id']))
+        for item in items if item.get('feature_id') and item.get('value_id')
+    ))
+    existing = list(ProductFeature.objects.filter(product=product).only('id', 'feature_id', 'value_id'))
+
+    # точные совпадения остаются как есть
+    unmatched = []
+    pairs = set(incoming)
+    for row in existing:
+        if (row.feature_id, row.value_id) in pairs:
+            pairs.discard((row.feature_id, row.value_id))
+        else:
+            unmatched.append(row)
+    missing = [pair for pair in incoming if pair in pairs]
+
+    # сменилось значение характеристики - обновляем строку, а не пересоздаем
+    spare = {}
+    for row in unmatched:
+        spare.setdefault(row.feature_id, []).append(row)
+    updated, created = [], []
+    for feature_id, value_id in missing:
+        if spare.get(feature_id):
+            row = spare[feature_id].pop()
+            row.value_id = value_id
+            updated.append(row)
+        else:
+            created.append(ProductFeature(product=product, feature_id=feature_id, value_id=value_id))
+    deleted = [row.pk for rows in spare.values() for row in rows]
+
+    if updated:
+        ProductFeature.objects.bulk_update(updated, ['value'])
+    if created:
+        ProductFeature.objects.bulk_create(created)
+    if deleted:
+        raw_delete(ProductFeature.objects.filter(pk__in=deleted))
+    return bool(updated or created or deleted)
+
+
+def sync_tag_groups(product, items):
+    """items - [{'group_name_id', 'tag_ids'}]. Группы сопоставляются по group_name_id."""
+    through = ProductTagGroup.tags.through
+    incoming = [
+        (int(item['group_name_id']), list(dict.fromkeys(int(tag_id) for tag_id in item.get('tag_ids') or [])))
+        for item in items if item.get('group_name_id')
+    ]
+    groups = list(ProductTagGroup.objects.filter(product=product).only('id', 'group_name_id'))
+    links = {}
+    for link_id, group_id, tag_id in through.objects.filter(
+        producttaggroup__product=product
+    ).values_list('id', 'producttaggroup_id', 'tag_id'):
+        links.setdefault(group_id, {})[tag_id] = link_id
+
+    spare = {}
+    for group in groups:
+        spare.setdefault(group.group_name_id, []).append(group)
+    new_groups, new_links, deleted_links = [], [], []
+    for group_name_id, tag_ids in incoming:
+        if spare.get(group_name_id):
+            group = spare[group_name_id].pop(0)
+            current = links.get(group.pk, {})
+            new_links += [through(producttaggroup_id=group.pk, tag_id=tag_id)
+                          for tag_id in tag_ids if tag_id not in current]
+            deleted_links += [link_id for tag_id, link_id in current.items() if tag_id not in tag_ids]
+        else:
+            new_groups.append((ProductTagGroup(product=product, group_name_id=group_name_id), tag_ids))
+    deleted_groups = [group.pk for rest in spare.values() for group in rest]
+    for group_id in deleted_groups:
+        deleted_links += links.get(group_id, {}).values()
+
+    if deleted_links:
+        raw_delete(through.objects.filter(pk__in=deleted_links))
+    if deleted_groups:
+        raw_delete(ProductTagGroup.objects.filter(pk__in=deleted_groups))
+    if new_groups:
+        ProductTagGroup.objects.bulk_create([group for group, _ in new_groups])
+        new_links += [through(producttaggroup_id=group.pk, tag_id=tag_id)
+                      for group, tag_ids in new_groups for tag_id in tag_ids]
+    if new_links:
+        through.objects.bulk_create(new_links)
+    return bool(new_groups or new_links or deleted_links or deleted_groups)
+
+
+def sync_images(product, items):
+    """items - [{'id', 'is_main', 'order', '_delete'}]: порядок, главное изображение, удаление.
+    Изображения других товаров и несуществующие id пропускаются."""
+    items = [item for item in items if item.get('id')]
+    images = Image.objects.filter(product=product, pk__in=[item['id'] for item in items]).in_bulk()
+    updated, deleted = {}, []
+    for item in items:
+        image = images.get(int(item['id']))
+        if image is None:
+            continue
+        if item.get('_delete'):
+            deleted.append(image.pk)
+            continue
+        for field in ('is_main', 'order'):
+            if field in item and getattr(image, field) != item[field]:
+                setattr(image, field, item[field])
+                updated[image.pk] = image
+    for pk in deleted:
+        updated.pop(pk, None)
+
+    if updated:
+        Image.objects.bulk_update(list(updated.values()), ['is_main', 'order'])
+    if deleted:
+        raw_delete(Image.objects.filter(pk__in=deleted))
+    return bool(updated or deleted)
@@ -0,0 +1,107 @@
+# api/cards.py
+"""
+Кэш карточек товаров для списков (вывод ProductListSerializer).
+
+Ключ карточки - id товара плюс штамп версии, который собирается прямо в
+запросе страницы: updated_at товара, названия бренда и категории и главное
+изображение (подзапрос). Любое изменение этих данных дает новый ключ, поэтому
+явная инвалидация не нужна, а устаревшие записи просто вытесняются по TTL.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat
+from django.db.models import aprefetch_related_objects, prefetch_related_objects
+
+from .models import Image
+from .serializers import ProductListSerializer, apply_field_selection
+
+CARD_CACHE_PREFIX = 'product_card'
+
+
+def with_card_stamp(queryset):
+    """Добавить к queryset все, что нужно для штампа версии, и убрать prefetch изображений"""
+    main_image = Image.objects.filter(product=OuterRef('pk')).order_by('-is_main', 'order', 'pk').annotate(
+        stamp=Concat(
+            Cast('pk', CharField()), Value(':'),
+            Cast('is_main', CharField()), Value(':'),
+            Cast('order', CharField()), Value(':'),
+            'image',
+            output_field=CharField(),
+        )
+    ).values('stamp')[:1]
+    return queryset.select_related('category', 'brand').prefetch_related(None).annotate(
+        main_image_stamp=Subquery(main_image)
+    )
+
+
+def prepare_product_list(queryset, selection):
+    """Queryset для списка товаров: со штампом карточек или, при ?fields=/?omit=,
+    только с join'ами и prefetch'ами запрошенных полей (без кэша карточек)"""
+    if selection is None:
+        return with_card_stamp(queryset)
+    fields = apply_field_selection(ProductListSerializer.Meta.fields, selection)
+    return ProductListSerializer.setup_eager_loading(queryset, fields)
+
+
+def card_key(product, url_prefix):
+    brand_name = product.brand.name if product.brand_id else ''
+    stamp = '|'.join([
+        url_prefix,
+        product.updated_at.isoformat() if product.updated_at else '',
+        brand_name,
+        product.category.name,
+        product.main_image_stamp or '',
+    ])
+    digest = hashlib.md5(stamp.encode('utf-8')).hexdigest()
+    return f'{CARD_CACHE_PREFIX}:{product.pk}:{digest}'
+
+
+def _card_keys(products, context):
+    request = context.get('request')
+    url_prefix = request.build_absolute_uri('/') if request else ''
+    return {product.pk: card_key(product, url_prefix) for product in products}
+
+
+def serialize_product_cards(products, context):
+    """Сериализовать товары списка: попадания берутся из кэша (get_many),
+    промахи сериализуются одним проходом с одним prefetch изображений"""
+    products = list(products)
+    if not products or not hasattr(products[0], 'main_image_stamp'):
+        return ProductListSerializer(products, many=True, context=context).data
+
+    keys = _card_keys(products, context)
+    cards = cache.get_many(list(keys.values()))
+
+    misses = [product for product in products if keys[product.pk] not in cards]
+    if misses:
+        prefetch_related_objects(misses, 'images')
+        data = ProductListSerializer(misses, many=True, context=context).data
+        fresh = {keys[product.pk]: dict(row) for product, row in zip(misses, data)}
+        cache.set_many(fresh, getattr(settings, 'PRODUCT_CARD_CACHE_TIMEOUT', 60 * 60))
+        cards.update(fresh)
+
+    return [cards[keys[product.pk]] for product in products]
+
+
+async def aserialize_product_cards(products, context):
+    """Асинхронный вариант serialize_product_cards (products - уже загруженный список
+    из prepare_product_list)"""
+    if not products:
+        return []
+    if not hasattr(products[0], 'main_image_stamp'):
+        return ProductListSerializer(products, many=True, context=context).data
+    keys = _card_keys(products, context)
+    cards = await cache.aget_many(list(keys.values()))
+
+    misses = [product for product in products if keys[product.pk] not in cards]
+    if misses:
+        await aprefetch_related_objects(misses, 'images')
+        data = ProductListSerializer(misses, many=True, context=context).data
+        fresh = {keys[product.pk]: dict(row) for product, row in zip(misses, data)}
+        await cache.aset_many(fresh, getattr(settings, 'PRODUCT_CARD_CACHE_TIMEOUT', 60 * 60))
+        cards.update(fresh)
+
+    return [cards[keys[product.pk]] for product in products]
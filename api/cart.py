@@ -0,0 +1,93 @@
+# api/cart.py
+"""
+Серверный расчет корзины.
+
+Цена, название и артикул позиций берутся из каталога, а не от клиента.
+Все товары корзины разрешаются одним запросом, суммы считаются в Decimal.
+"""
+from decimal import Decimal
+
+from .models import Product, OrderItem
+
+MAX_CART_LINES = 100
+MAX_LINE_QUANTITY = 999
+
+
+def quote_cart(items):
+    """Рассчитать корзину.
+
+    items - список словарей {'product': id, 'quantity': n}; повторяющиеся
+    товары объединяются. Возвращает позиции со снимком цены, названия и SKU,
+    итоги и список ошибок (товар не найден, нет в наличии, нет цены).
+    """
+    quantities = {}
+    for item in items:
+        quantities[item['product']] = quantities.get(item['product'], 0) + item['quantity']
+
+    products = Product.objects.only(
+        'pk', 'slug', 'name', 'price', 'is_available', 'internal_sku', 'manufacturer_sku'
+    ).in_bulk(list(quantities))
+
+    lines, errors = [], []
+    total = Decimal('0.00')
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is None:
+            errors.append({'product': product_id, 'code': 'not_found', 'message': 'Товар не найден'})
+            continue
+        if not product.is_available:
+            errors.append({'product': product_id, 'code': 'unavailable', 'message': 'Товара нет в наличии'})
+            continue
+        if product.price is None:
+            errors.append({'product': product_id, 'code': 'no_price', 'message': 'Цена товара не указана'})
+            continue
+        if quantity > MAX_LINE_QUANTITY:
+            errors.append({'product': product_id, 'code': 'quantity',
+                           'message': f'Не более {MAX_LINE_QUANTITY} шт. одного товара'})
+            continue
+        subtotal = product.price * quantity
+        total += subtotal
+        lines.append({
+            'product': product.pk,
+            'slug': product.slug,
+            'product_name': product.name,
+            'product_sku': product.internal_sku or product.manufacturer_sku or '',
+            'price': product.price,
+            'quantity': quantity,
+            'subtotal': subtotal,
+        })
+
+    return {
+        'items': lines,
+        'errors': errors,
+        'total': total,
+        'total_quantity': sum(line['quantity'] for line in lines),
+        'is_valid': not errors,
+    }
+
+
+def order_items_from_quote(order, quote):
+    """Несохраненные OrderItem для bulk_create по рассчитанной корзине"""
+    return [
+        OrderItem(
+            order=order,
+            product_id=line['product'],
+            product_name=line['product_name'],
+            product_sku=line['product_sku'],
+            price=line['price'],
+            quantity=line['quantity'],
+        )
+        for line in quote['items']
+    ]
+
+
+def quote_to_json(quote):
+    """Денежные суммы строками, как в DecimalField сериализаторов"""
+    return {
+        **quote,
+        'items': [
+            {**line, 'price': str(line['price']), 'subtotal': str(line['subtotal'])}
+            for line in quote['items']
+        ],
+        'total': str(quote['total']),
+    }
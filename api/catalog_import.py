@@ -0,0 +1,430 @@
+# api/catalog_import.py
+"""
+Массовый импорт товаров из CSV или XLSX (прайс-листы поставщиков).
+
+Формат совпадает с выгрузкой api/export.py: колонки internal_sku, slug, name,
+category (slug категории), brand (название), price, is_available,
+manufacturer_sku, description, features ("Цвет: Черный; Память: 8 ГБ") и
+tags ("Группа: тег 1, тег 2; Другая группа: тег"). Остальные колонки
+(id, images, даты) игнорируются.
+
+Товар ищется по internal_sku, без него - по slug; не найденный товар
+создается. Пустая ячейка не меняет поле существующего товара, а колонки
+features и tags, если они есть в файле, заменяют характеристики и теги целиком.
+
+Строки проверяются по одной при чтении файла; справочники (категории, бренды,
+характеристики, значения, группы тегов, теги) загружаются в словари один раз,
+недостающие бренды, характеристики и теги создаются. Товары пишутся пачками
+по IMPORT_BATCH_SIZE: bulk_create / UPDATE через executemany, одна очистка и один
+bulk_create на каждую связь, производные данные обновляются явно (api/bulk.py).
+Пачка пишется в одной транзакции вместе с созданием справочников и резервом
+номеров SkuCounter: при ошибке пачки не остается ни новых брендов и тегов,
+ни израсходованных артикулов. Ошибки копятся по номерам строк файла.
+
+    python manage.py import_catalog prices.xlsx --dry-run
+"""
+import copy
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+import tablib
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import bulk
+from .export import restore
+from .models import (
+    Brand, Category, Feature, FeatureValue, Product, ProductFeature, ProductTagGroup, SkuCounter, Tag, TagName
+)
+from .search import fold
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_FORMATS = ('csv', 'xlsx')
+MAX_REPORTED_ERRORS = 500
+
+KEY_COLUMNS = ('internal_sku', 'slug', 'name')
+TRUE_VALUES = {'1', 'true', 'yes', 'да', '+'}
+FALSE_VALUES = {'0', 'false', 'no', 'нет', '-'}
+MAX_LENGTHS = {'name': 200, 'slug': 200, 'internal_sku': 100, 'manufacturer_sku': 100}
+
+# поля товара, которые обновляются, если колонка есть в файле
+UPDATE_FIELDS = ('name', 'description', 'category', 'brand', 'price', 'is_available', 'manufacturer_sku')
+
+# строка пачки, готовая к записи; features и tag_groups - None, если колонки нет в файле
+PreparedRow = namedtuple('PreparedRow', 'line data previous_category_id product features tag_groups')
+
+
+class CatalogImportError(ValueError):
+    """Файл нельзя прочитать как таблицу товаров"""
+
+
+def load_dataset(content, file_format):
+    """bytes файла -> tablib.Dataset с заголовками в нижнем регистре"""
+    if file_format not in IMPORT_FORMATS:
+        raise CatalogImportError(f'Неподдерживаемый формат: {file_format}')
+    if file_format == 'csv':
+        content = content.decode('utf-8-sig')
+    try:
+        dataset = tablib.Dataset().load(content, format=file_format)
+    except Exception as exc:  # tablib пробрасывает ошибки парсеров как есть
+        raise CatalogImportError(f'Не удалось прочитать файл: {exc}') from exc
+    dataset.headers = [str(header or '').strip().lower() for header in dataset.headers or []]
+    if not any(column in dataset.headers for column in KEY_COLUMNS):
+        raise CatalogImportError('Нужна хотя бы одна из колонок: ' + ', '.join(KEY_COLUMNS))
+    return dataset
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return restore(str(value).strip())
+
+
+def _key(text):
+    return text.casefold()
+
+
+def _slug(name):
+    # slugify отбрасывает кириллицу: "Новый товар 1" -> "1", поэтому сначала транслитерация
+    return slugify(fold(name))
+
+
+def parse_pairs(text, require_value):
+    """"А: 1; Б: 2, 3" -> [('А', '1'), ('Б', '2, 3')]; часть без ':' - (None, часть)"""
+    pairs = []
+    for part in text.split(';'):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, value = part.partition(':')
+        if not sep:
+            if require_value:
+                raise ValueError(f'"{part}": ожидается "название: значение"')
+            pairs.append((None, part))
+            continue
+        name, value = name.strip(), value.strip()
+        if not name or not value:
+            raise ValueError(f'"{part}": пустое название или значение')
+        pairs.append((name, value))
+    return pairs
+
+
+def parse_row(row, columns):
+    """Проверка строки без обращения к БД: (данные, ошибки)"""
+    data, errors = {}, []
+    for column in ('internal_sku', 'slug', 'name', 'category', 'brand', 'manufacturer_sku', 'description'):
+        if column in columns:
+            value = _text(row.get(column))
+            if column in MAX_LENGTHS and len(value) > MAX_LENGTHS[column]:
+                errors.append(f'{column}: длиннее {MAX_LENGTHS[column]} символов')
+            if value:
+                data[column] = value
+
+    price = _text(row.get('price')).replace(' ', '').replace('\xa0', '').replace(',', '.')
+    if price:
+        try:
+            data['price'] = Decimal(price).quantize(Decimal('0.01'))
+            if data['price'] < 0:
+                errors.append('price: отрицательная цена')
+        except InvalidOperation:
+            errors.append(f'price: "{price}" не число')
+
+    available = _text(row.get('is_available')).lower()
+    if available:
+        if available in TRUE_VALUES:
+            data['is_available'] = True
+        elif available in FALSE_VALUES:
+            data['is_available'] = False
+        else:
+            errors.append(f'is_available: "{available}" не да/нет')
+
+    for column, require_value in (('features', True), ('tags', False)):
+        if column in columns:
+            try:
+                pairs = parse_pairs(_text(row.get(column)), require_value)
+            except ValueError as exc:
+                errors.append(f'{column}: {exc}')
+                continue
+            if column == 'tags':
+                pairs = [(group, [tag.strip() for tag in tags.split(',') if tag.strip()]) for group, tags in pairs]
+            data[column] = pairs
+    return data, errors
+
+
+class Lookups:
+    """Справочники каталога в памяти; недостающие записи создаются по первому обращению"""
+
+    # то, что пополняется при создании записей и откатывается вместе с пачкой
+    MUTABLE = ('brands', 'brand_slugs', 'features', 'values', 'feature_values', 'tag_names', 'tags', 'tag_slugs')
+
+    def __init__(self):
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.category_slugs = {pk: slug for slug, pk in self.categories.items()}
+        self.brands = {_key(name): pk for pk, name in Brand.objects.values_list('id', 'name')}
+        self.brand_slugs = set(Brand.objects.values_list('slug', flat=True))
+        self.features = {
+            (category_id, _key(name)): pk
+            for pk, category_id, name in Feature.objects.values_list('id', 'category_id', 'name')
+        }
+        self.values = {
+            (category_id, _key(value)): pk
+            for pk, category_id, value in FeatureValue.objects.values_list('id', 'category_id', 'value')
+        }
+        self.feature_values = set(Feature.values.through.objects.values_list('feature_id', 'featurevalue_id'))
+        self.tag_names = {_key(name): pk for pk, name in TagName.objects.values_list('id', 'name')}
+        self.tags = {
+            (tag_name_id, _key(name)): pk
+            for pk, tag_name_id, name in Tag.objects.values_list('id', 'tag_name_id', 'name')
+        }
+        self.tag_slugs = set(Tag.objects.values_list('slug', flat=True))
+
+    def snapshot(self):
+        return {name: copy.copy(getattr(self, name)) for name in self.MUTABLE}
+
+    def restore(self, snapshot):
+        """Забыть записи, созданные в откаченной транзакции"""
+        self.__dict__.update(snapshot)
+
+    @staticmethod
+    def _unique_slug(name, taken, max_length):
+        base = (_slug(name) or 'item')[:max_length - 8]
+        slug, number = base, 1
+        while slug in taken:
+            number += 1
+            slug = f'{base}-{number}'
+        taken.add(slug)
+        return slug
+
+    def brand(self, name):
+        key = _key(name)
+        if key not in self.brands:
+            slug = self._unique_slug(name, self.brand_slugs, 160)
+            self.brands[key] = Brand.objects.create(name=name, slug=slug).pk
+        return self.brands[key]
+
+    def feature_value(self, category_id, name, value):
+        feature_key = (category_id, _key(name))
+        if feature_key not in self.features:
+            self.features[feature_key] = Feature.objects.create(category_id=category_id, name=name).pk
+        value_key = (category_id, _key(value))
+        if value_key not in self.values:
+            self.values[value_key] = FeatureValue.objects.create(category_id=category_id, value=value).pk
+        link = (self.features[feature_key], self.values[value_key])
+        if link not in self.feature_values:
+            Feature.values.through.objects.create(feature_id=link[0], featurevalue_id=link[1])
+            self.feature_values.add(link)
+        return link
+
+    def tag_group(self, category_id, group, tags):
+        tag_name_id = None
+        if group:
+            if _key(group) not in self.tag_names:
+                self.tag_names[_key(group)] = TagName.objects.create(name=group, category_id=category_id).pk
+            tag_name_id = self.tag_names[_key(group)]
+        tag_ids = []
+        for name in tags:
+            tag_key = (tag_name_id, _key(name))
+            if tag_key not in self.tags:
+                slug = self._unique_slug(name, self.tag_slugs, 120)
+                self.tags[tag_key] = Tag.objects.create(
+                    name=name, slug=slug, tag_name_id=tag_name_id, category_id=category_id
+                ).pk
+            tag_ids.append(self.tags[tag_key])
+        return tag_name_id, tag_ids
+
+
+class CatalogImport:
+    """Один прогон импорта: run(dataset) -> отчет"""
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.lookups = Lookups()
+        self.seen = {}
+        self.slugs = set()
+        self.category_ids = set()
+        self.counts_changed = False
+        self.report = {'rows': 0, 'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+
+    def error(self, line, messages):
+        self.report['failed'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'row': line, 'errors': messages})
+
+    def run(self, dataset):
+        columns = set(dataset.headers)
+        batch = []
+        # строка 1 - заголовок
+        for line, row in enumerate(dataset.dict, start=2):
+            self.report['rows'] += 1
+            data, errors = parse_row(row, columns)
+            key = ('sku', data['internal_sku']) if 'internal_sku' in data else ('slug', data.get('slug'))
+            if key[1] is None and 'name' not in data:
+                errors.append('нужен internal_sku, slug или name')
+            elif key[1] is not None:
+                if key in self.seen:
+                    errors.append(f'{key[0]} "{key[1]}" уже был в строке {self.seen[key]}')
+                self.seen.setdefault(key, line)
+            if errors:
+                self.error(line, errors)
+                continue
+            batch.append((line, data))
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+        # фасеты и счетчики категорий - один раз за импорт, а не на каждую пачку
+        bulk.categories_changed(self.category_ids, counts_changed=self.counts_changed, rebuild_documents=False)
+        self.report['errors'].sort(key=lambda item: item['row'])
+        return self.report
+
+    def existing_products(self, batch):
+        skus = [data['internal_sku'] for _, data in batch if 'internal_sku' in data]
+        slugs = [data['slug'] for _, data in batch if 'slug' in data]
+        by_sku = {p.internal_sku: p for p in Product.objects.filter(internal_sku__in=skus)}
+        by_slug = {p.slug: p for p in Product.objects.filter(slug__in=slugs)}
+        return by_sku, by_slug
+
+    def prepare(self, line, data, product, by_slug):
+        """Применить строку к товару и разрешить связи; ValueError - ошибка строки"""
+        previous_category_id = product.category_id if product else None
+        if product is None:
+            if 'slug' in data and data['slug'] in by_slug:
+                raise ValueError(f'slug "{data["slug"]}" занят другим товаром')
+            if 'name' not in data or 'category' not in data:
+                raise ValueError('для нового товара нужны name и category')
+            product = Product(description='', is_available=True, internal_sku=data.get('internal_sku'),
+                              slug=data.get('slug', ''))
+
+        if 'category' in data:
+            if data['category'] not in self.lookups.categories:
+                raise ValueError(f'category: категория "{data["category"]}" не найдена')
+            product.category_id = self.lookups.categories[data['category']]
+        for field in ('name', 'description', 'price', 'is_available', 'manufacturer_sku'):
+            if field in data:
+                setattr(product, field, data[field])
+        if 'brand' in data:
+            product.brand_id = self.lookups.brand(data['brand'])
+
+        features = tag_groups = None
+        if 'features' in data:
+            features = [self.lookups.feature_value(product.category_id, name, value)
+                        for name, value in data['features']]
+        if 'tags' in data:
+            tag_groups = [self.lookups.tag_group(product.category_id, group, tags) for group, tags in data['tags']]
+        return PreparedRow(line, data, previous_category_id, product, features, tag_groups)
+
+    def assign_keys(self, products):
+        """internal_sku и slug для новых товаров; slug-дубликаты получают суффикс из SKU"""
+        SkuCounter.reserve(product.internal_sku for product in products if product.internal_sku)
+        by_prefix = {}
+        for product in products:
+            if not product.internal_sku:
+                prefix = Product.sku_prefix(self.lookups.category_slugs.get(product.category_id, ''), product.name)
+                by_prefix.setdefault(prefix, []).append(product)
+        # один блок номеров на префикс за пачку
+        for prefix, group in by_prefix.items():
+            for product, sku in zip(group, SkuCounter.allocate(prefix, len(group))):
+                product.internal_sku = sku
+        for product in products:
+            if not product.slug:
+                product.slug = _slug(product.name)[:150] or 'product'
+        candidates = [product.slug for product in products]
+        taken = set(Product.objects.filter(slug__in=candidates).values_list('slug', flat=True)) | self.slugs
+        for product in products:
+            if product.slug in taken:
+                product.slug = f'{product.slug[:150]}-{slugify(product.internal_sku)}'
+            taken.add(product.slug)
+            self.slugs.add(product.slug)
+
+    def flush(self, batch):
+        snapshot, slugs = self.lookups.snapshot(), set(self.slugs)
+        rows, row_errors = [], []
+        try:
+            with transaction.atomic():
+                by_sku, by_slug = self.existing_products(batch)
+                for line, data in batch:
+                    if 'internal_sku' in data:
+                        product = by_sku.get(data['internal_sku'])
+                    else:
+                        product = by_slug.get(data.get('slug'))
+                    try:
+                        rows.append(self.prepare(line, data, product, by_slug))
+                    except ValueError as exc:
+                        row_errors.append((line, [str(exc)]))
+                new = [row.product for row in rows if row.product.pk is None]
+                if rows:
+                    self.assign_keys(new)
+                    self.write(rows, new)
+        except DatabaseError as exc:
+            self.lookups.restore(snapshot)
+            self.slugs = slugs
+            failed = {line for line, _ in row_errors}
+            row_errors += [(line, [f'пачка не записана: {exc}']) for line, _ in batch if line not in failed]
+            rows = []
+        for line, messages in row_errors:
+            self.error(line, messages)
+        if not rows:
+            return
+
+        moved = {row.previous_category_id for row in rows
+                 if row.previous_category_id and row.previous_category_id != row.product.category_id}
+        self.category_ids |= {row.product.category_id for row in rows} | moved
+        self.counts_changed = self.counts_changed or bool(new or moved)
+        self.report['created'] += len(new)
+        self.report['updated'] += len(rows) - len(new)
+
+    def write(self, rows, new):
+        existing = [row for row in rows if row.product.pk is not None]
+        Product.objects.bulk_create(new, batch_size=500)
+        if existing:
+            now = timezone.now()
+            columns = set().union(*(row.data for row in existing))
+            fields = [field for field in UPDATE_FIELDS if field in columns] + ['updated_at']
+            for row in existing:
+                row.product.updated_at = now
+            bulk.update_rows([row.product for row in existing], fields)
+
+        features = {row.product.pk: row.features for row in rows if row.features is not None}
+        if features:
+            bulk.raw_delete(ProductFeature.objects.filter(product_id__in=features))
+            ProductFeature.objects.bulk_create([
+                ProductFeature(product_id=product_id, feature_id=feature_id, value_id=value_id)
+                for product_id, pairs in features.items()
+                for feature_id, value_id in pairs
+            ], batch_size=500)
+
+        tag_groups = {row.product.pk: row.tag_groups for row in rows if row.tag_groups is not None}
+        if tag_groups:
+            through = ProductTagGroup.tags.through
+            bulk.raw_delete(through.objects.filter(producttaggroup__product_id__in=tag_groups))
+            bulk.raw_delete(ProductTagGroup.objects.filter(product_id__in=tag_groups))
+            groups = [
+                (ProductTagGroup(product_id=product_id, group_name_id=tag_name_id), tag_ids)
+                for product_id, product_groups in tag_groups.items()
+                for tag_name_id, tag_ids in product_groups
+            ]
+            ProductTagGroup.objects.bulk_create([group for group, _ in groups], batch_size=500)
+            through.objects.bulk_create([
+                through(producttaggroup_id=group.pk, tag_id=tag_id)
+                for group, tag_ids in groups
+                for tag_id in dict.fromkeys(tag_ids)
+            ], batch_size=500)
+
+        # документы всех товаров импорта не пересобираются разом: карточка соберется
+        # при первом обращении (или product_documents rebuild --all)
+        bulk.products_changed([row.product.pk for row in rows], rebuild_documents=False)
+
+
+def import_catalog(content, file_format, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+    """Импорт файла (bytes). С dry_run все изменения откатываются, отчет - как при записи."""
+    dataset = load_dataset(content, file_format)
+    if not dry_run:
+        return CatalogImport(batch_size).run(dataset)
+    with transaction.atomic():
+        report = CatalogImport(batch_size).run(dataset)
+        transaction.set_rollback(True)
+    return report
@@ -0,0 +1,123 @@
+# api/db_routing.py
+"""
+Чтение каталога с реплики.
+
+Если в DATABASES есть алиас 'replica' (SQLITE_REPLICA_PATH), публичные
+GET-запросы каталога читают через него, а записи и админка всегда идут в
+основную БД. Режим включается на время обработки запроса (contextvar),
+поэтому остальной код про реплику ничего не знает. Внутри транзакции
+основной БД чтения тоже идут в нее: транзакция должна видеть свои записи
+и читать согласованный снимок.
+
+После записи клиент получает cookie PRIMARY_COOKIE (PrimaryStickinessMiddleware)
+и на REPLICA_STICKY_SECONDS читает из основной БД - свои изменения видны сразу,
+даже если реплика еще не синхронизирована.
+"""
+import contextvars
+import functools
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA_ALIAS = 'replica'
+PRIMARY_COOKIE = 'db_primary'
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def use_replica():
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def should_read_replica(request):
+    return (
+        request.method in SAFE_METHODS
+        and replica_configured()
+        and PRIMARY_COOKIE not in request.COOKIES
+    )
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_configured() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
+
+
+class ReplicaReadMixin:
+    """Для viewset'ов каталога: безопасные методы читают с реплики"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if should_read_replica(request):
+            with use_replica():
+                return super().dispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+
+
+def replica_read(view_func):
+    """То же для функций-представлений (ставится под @api_view), в том числе async"""
+    if iscoroutinefunction(view_func):
+        @functools.wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            if should_read_replica(request):
+                with use_replica():
+                    return await view_func(request, *args, **kwargs)
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if should_read_replica(request):
+            with use_replica():
+                return view_func(request, *args, **kwargs)
+        return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+class PrimaryStickinessMiddleware:
+    """После успешной записи клиент на короткое время читает из основной БД"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def process(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replica_configured():
+            response.set_cookie(
+                PRIMARY_COOKIE, '1',
+                max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 10),
+                httponly=True, samesite='Lax', secure=not settings.DEBUG,
+            )
+        return response
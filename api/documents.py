@@ -0,0 +1,163 @@
+# api/documents.py
+"""
+Хранилище предсобранных документов карточек товаров.
+
+Документ - это вывод ProductDetailSerializer без request в контексте,
+то есть с относительными URL медиафайлов. При отдаче клиенту к ним
+подставляется только схема и хост (absolutize_urls).
+
+Изменения товара и связанных объектов помечают документы устаревшими
+(mark_stale), а пересборка выполняется после коммита транзакции в фоновом
+потоке (или синхронно, если PRODUCT_DOCUMENTS_ASYNC = False).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Product, ProductDocument, Category
+
+logger = logging.getLogger(__name__)
+
+REBUILD_CHUNK_SIZE = 200
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='product-documents')
+_pending_ids = set()
+_pending_lock = threading.Lock()
+
+
+def build_document(product):
+    """Сериализовать товар в документ (без request -> относительные URL)"""
+    from .serializers import ProductDetailSerializer
+    return ProductDetailSerializer(product, context={}).data
+
+
+def absolutize_urls(data, request):
+    """Подставить схему и хост к относительным URL изображений в документе"""
+    if isinstance(data, dict):
+        return {
+            key: (request.build_absolute_uri(value)
+                  if key == 'image' and isinstance(value, str) and value.startswith('/')
+                  else absolutize_urls(value, request))
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [absolutize_urls(item, request) for item in data]
+    return data
+
+
+def rebuild_documents(product_ids=None, chunk_size=REBUILD_CHUNK_SIZE):
+    """Пересобрать документы указанных товаров (или всех). Возвращает число документов."""
+    from .serializers import ProductDetailSerializer
+
+    queryset = Product.objects.order_by('pk')
+    if product_ids is not None:
+        queryset = queryset.filter(pk__in=list(product_ids))
+    ids = list(queryset.values_list('pk', flat=True))
+
+    built = 0
+    for start in range(0, len(ids), chunk_size):
+        chunk_ids = ids[start:start + chunk_size]
+        started = timezone.now()
+        products = ProductDetailSerializer.setup_eager_loading(
+            Product.objects.filter(pk__in=chunk_ids)
+        )
+        documents = [
+            ProductDocument(product=product, data=build_document(product),
+                            is_stale=False, built_at=started)
+            for product in products
+        ]
+        with transaction.atomic():
+            ProductDocument.objects.bulk_create(
+                documents,
+                update_conflicts=True,
+                unique_fields=['product'],
+                update_fields=['data', 'is_stale', 'built_at'],
+            )
+            # Товар мог измениться, пока документ собирался - оставляем его устаревшим
+            ProductDocument.objects.filter(
+                product_id__in=chunk_ids, stale_since__gt=started
+            ).update(is_stale=True)
+        built += len(documents)
+    return built
+
+
+def mark_stale(product_ids, rebuild=True):
+    """Пометить документы товаров устаревшими и запланировать пересборку.
+
+    rebuild=False - только пометить (массовый импорт): документ пересоберется
+    при первом обращении к карточке или командой product_documents rebuild.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    now = timezone.now()
+    ProductDocument.objects.filter(product_id__in=product_ids).update(is_stale=True, stale_since=now)
+    if rebuild:
+        schedule_rebuild(product_ids)
+
+
+def mark_category_stale(category, rebuild=True):
+    """Документ содержит поддерево категории и products_count, поэтому изменение категории
+    затрагивает товары самой категории и всех ее предков"""
+    category_ids = category.ancestor_ids + [category.pk] if category.path else [category.pk]
+    mark_stale(Product.objects.filter(category_id__in=category_ids).values_list('pk', flat=True), rebuild)
+
+
+def mark_category_id_stale(category_id, rebuild=True):
+    category = Category.objects.filter(pk=category_id).only('pk', 'path').first()
+    if category:
+        mark_category_stale(category, rebuild)
+
+
+def schedule_rebuild(product_ids):
+    with _pending_lock:
+        _pending_ids.update(product_ids)
+    transaction.on_commit(_submit)
+
+
+def _submit():
+    if getattr(settings, 'PRODUCT_DOCUMENTS_ASYNC', True):
+        _executor.submit(_run_pending)
+    else:
+        _run_pending(close_connection=False)
+
+
+def _run_pending(close_connection=True):
+    with _pending_lock:
+        ids = set(_pending_ids)
+        _pending_ids.clear()
+    if not ids:
+        return
+    try:
+        rebuild_documents(ids)
+    except Exception:
+        logger.exception('Product documents rebuild failed')
+        with _pending_lock:
+            _pending_ids.update(ids)
+    finally:
+        if close_connection:
+            connection.close()
+
+
+def get_document(slug):
+    """Свежий документ товара по slug или None (нет документа или он устарел)"""
+    row = ProductDocument.objects.filter(product__slug=slug).values('data', 'is_stale').first()
+    if row is None or row['is_stale']:
+        return None
+    return row['data']
+
+
+def staleness_report():
+    total = Product.objects.count()
+    documents = ProductDocument.objects.count()
+    stale = ProductDocument.objects.filter(is_stale=True).count()
+    return {
+        'products': total,
+        'documents': documents,
+        'missing': total - documents,
+        'stale': stale,
+    }
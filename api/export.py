@@ -0,0 +1,182 @@
+# api/export.py
+"""
+Потоковая выгрузка каталога (CSV, JSONL, XLSX) для партнеров и интеграций.
+
+Товары читаются через .iterator(chunk_size=...): на каждую пачку выполняется
+фиксированный набор запросов (товары с категорией и брендом, характеристики,
+группы тегов с тегами, изображения), поэтому число запросов растет с числом
+пачек, а память не зависит от размера каталога.
+
+CSV и JSONL отдаются построчно по мере чтения. XLSX - zip-архив, его нельзя
+отдавать до закрытия книги: xlsxwriter в режиме constant_memory пишет строки
+на диск, и готовый файл отдается кусками из временного файла.
+
+Под ASGI синхронный итератор StreamingHttpResponse Django сначала целиком
+собирает в список, поэтому там выгрузка отдается через athreaded - асинхронный
+итератор, который читает следующие строки в потоке запроса.
+
+    python manage.py export_catalog --format csv --output catalog.csv
+"""
+import csv
+import itertools
+import json
+import tempfile
+
+import xlsxwriter
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .models import Image, Product, ProductFeature, ProductTagGroup
+
+EXPORT_CHUNK_SIZE = 500
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+COLUMNS = [
+    'id', 'internal_sku', 'manufacturer_sku', 'name', 'slug', 'category', 'brand',
+    'price', 'is_available', 'description', 'features', 'tags', 'images',
+    'created_at', 'updated_at',
+]
+
+# Текст с таким началом Excel и LibreOffice выполняют как формулу при открытии CSV (формульная инъекция)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def export_queryset(queryset=None):
+    """Товары с пачечной подгрузкой связей; порядок по id стабилен между выгрузками"""
+    queryset = Product.objects.all() if queryset is None else queryset
+    return queryset.select_related('category', 'brand').prefetch_related(
+        Prefetch('features', queryset=ProductFeature.objects.select_related('feature', 'value').order_by('id')),
+        Prefetch('tag_groups', queryset=ProductTagGroup.objects.select_related('group_name')
+                 .prefetch_related('tags').order_by('id')),
+        Prefetch('images', queryset=Image.objects.order_by('order', 'id')),
+    ).order_by('id')
+
+
+def product_record(product, base_url=''):
+    """Строка выгрузки: связи в виде списков (для JSONL)"""
+    return {
+        'id': product.id,
+        'internal_sku': product.internal_sku,
+        'manufacturer_sku': product.manufacturer_sku or '',
+        'name': product.name,
+        'slug': product.slug,
+        'category': product.category.slug,
+        'brand': product.brand.name if product.brand else '',
+        'price': product.price,
+        'is_available': product.is_available,
+        'description': product.description,
+        'features': [
+            {'feature': pf.feature.name, 'value': pf.value.value}
+            for pf in product.features.all() if pf.feature and pf.value
+        ],
+        'tags': [
+            {'group': group.group_name.name if group.group_name else '',
+             'tags': [tag.name for tag in group.tags.all()]}
+            for group in product.tag_groups.all()
+        ],
+        'images': [
+            {'url': base_url + image.image.url, 'is_main': image.is_main}
+            for image in product.images.all() if image.image
+        ],
+        'created_at': product.created_at,
+        'updated_at': product.updated_at,
+    }
+
+
+def neutralize(value):
+    """Текст, похожий на формулу, экранируется апострофом (см. restore для импорта).
+
+    Только для CSV: в XLSX (strings_to_formulas=False) такой текст и так пишется
+    строковой ячейкой, а апостроф был бы виден в Excel как часть значения.
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def restore(text):
+    """Обратное к neutralize: файл выгрузки читается обратно без апострофов"""
+    if text.startswith("'") and text[1:].startswith(FORMULA_PREFIXES):
+        return text[1:]
+    return text
+
+
+def flatten(record):
+    """Строка таблицы: связи склеиваются в одну ячейку ("Цвет: Черный; Память: 8 ГБ")"""
+    row = dict(record)
+    row['features'] = '; '.join(f"{item['feature']}: {item['value']}" for item in record['features'])
+    row['tags'] = '; '.join(
+        f"{item['group']}: {', '.join(item['tags'])}" if item['group'] else ', '.join(item['tags'])
+        for item in record['tags']
+    )
+    row['images'] = ' '.join(item['url'] for item in record['images'])
+    row['price'] = '' if record['price'] is None else str(record['price'])
+    row['created_at'] = record['created_at'].isoformat()
+    row['updated_at'] = record['updated_at'].isoformat()
+    return [row[column] for column in COLUMNS]
+
+
+def iter_records(queryset=None, base_url='', chunk_size=EXPORT_CHUNK_SIZE):
+    for product in export_queryset(queryset).iterator(chunk_size=chunk_size):
+        yield product_record(product, base_url)
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: writerow возвращает готовую строку"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(records):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for record in records:
+        yield writer.writerow([neutralize(value) for value in flatten(record)])
+
+
+def iter_jsonl(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+
+
+def write_xlsx(records, output):
+    """Записать книгу в файл или файловый объект; строки сразу сбрасываются на диск"""
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True, 'strings_to_urls': False, 'strings_to_formulas': False,
+    })
+    sheet = workbook.add_worksheet('products')
+    sheet.write_row(0, 0, COLUMNS, workbook.add_format({'bold': True}))
+    for row_number, record in enumerate(records, start=1):
+        sheet.write_row(row_number, 0, flatten(record))
+    workbook.close()
+
+
+def xlsx_file(records):
+    """Временный файл с готовой книгой, позиция - в начале"""
+    output = tempfile.TemporaryFile()
+    write_xlsx(records, output)
+    output.seek(0)
+    return output
+
+
+def file_chunks(output, chunk_size=64 * 1024):
+    """Готовый файл кусками; файл закрывается после отдачи"""
+    with output:
+        while chunk := output.read(chunk_size):
+            yield chunk
+
+
+async def athreaded(iterable, batch=100):
+    """Синхронный итератор выгрузки как асинхронный: по batch элементов за переход
+    в поток (thread_sensitive - то же соединение с БД, что и у представления)"""
+    iterator = iter(iterable)
+    take = sync_to_async(lambda: list(itertools.islice(iterator, batch)))
+    while items := await take():
+        for item in items:
+            yield item
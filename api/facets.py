@@ -0,0 +1,334 @@
+# api/facets.py
+"""
+Фасеты каталога: счетчики тегов, характеристик и брендов, границы и гистограмма цен.
+
+Функции принимают готовые queryset'ы товаров и ничего не знают о запросе;
+CategorySelection разрешает поддерево и фильтры один раз, и страница
+категории (CategoryViewSet.page) считает все разделы от общей базы.
+
+Счетчик значения фасета считается при всех остальных активных фильтрах,
+но без выбора в его собственной группе: выбор "Красный" не обнуляет
+"Синий" в той же группе цветов (внутри группы теги объединяются по ИЛИ).
+
+Для характеристик список значений и счетчики без фильтров берутся из
+предрасчитанной таблицы CategoryFeatureFacet (по категориям, без
+подкатегорий); она пересчитывается после коммита изменений товаров.
+"""
+import functools
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, IntegerField, Max, Min, Q, Sum, Value
+from django.db.models.functions import Floor, Least
+
+from .models import Brand, CategoryFeatureFacet, Product, ProductFeature, ProductTagGroup, Tag
+
+NO_TAG_GROUP = '__none__'
+
+PRICE_HISTOGRAM_BUCKETS = 20
+PRICE_HISTOGRAM_MAX_BUCKETS = 100
+
+# параметры apply_product_filters, сужающие выборку (кроме тегов, характеристик и категории)
+FILTER_PARAMS = ('price_min', 'price_max', 'brand', 'is_available', 'search')
+
+
+def has_filters(params):
+    return (
+        any(params.get(name) for name in FILTER_PARAMS)
+        or any(key.startswith('taggroup_') and value for key, value in params.items())
+    )
+
+
+def selected_tag_groups(tag_param):
+    """?tag=a,b,c -> {id группы (Tag.tag_name_id): [slug, ...]}"""
+    slugs = [s.strip() for s in (tag_param or '').split(',') if s.strip()]
+    if not slugs:
+        return {}
+    groups = {}
+    for tag in Tag.objects.filter(slug__in=slugs).values('slug', 'tag_name_id'):
+        gid = tag['tag_name_id'] if tag['tag_name_id'] is not None else NO_TAG_GROUP
+        groups.setdefault(gid, []).append(tag['slug'])
+    return groups
+
+
+def filter_by_tag_groups(queryset, groups, exclude_group=None):
+    """И между группами, ИЛИ внутри группы"""
+    for gid, slugs in groups.items():
+        if gid != exclude_group:
+            queryset = queryset.filter(tag_groups__tags__slug__in=slugs)
+    return queryset
+
+
+def selected_features(params):
+    """feature_<id>=<id значения> -> {id характеристики: id значения}"""
+    selected = {}
+    for key, value in params.items():
+        if key.startswith('feature_') and value:
+            try:
+                selected[int(key.split('_', 1)[1])] = int(value)
+            except ValueError:
+                continue
+    return selected
+
+
+def filter_by_features(queryset, selected, exclude_feature=None):
+    for feature_id, value_id in selected.items():
+        if feature_id != exclude_feature:
+            queryset = queryset.filter(features__feature_id=feature_id, features__value_id=value_id)
+    return queryset
+
+
+def _tag_counts(products, tag_filter=None):
+    queryset = Tag.objects.filter(producttaggroup_tags__product__in=products)
+    if tag_filter is not None:
+        queryset = queryset.filter(tag_filter)
+    rows = queryset.annotate(
+        product_count=Count('producttaggroup_tags__product', distinct=True)
+    ).values('id', 'product_count')
+    return {row['id']: row['product_count'] for row in rows}
+
+
+def tag_facets(base, filtered, groups):
+    """Группы тегов товаров base со счетчиками.
+
+    filtered - base со всеми фильтрами, кроме тегов; groups - выбранные теги
+    (selected_tag_groups). Один запрос на список тегов, один на счетчики
+    невыбранных групп и по одному на каждую группу с выбором.
+    """
+    counts = _tag_counts(filter_by_tag_groups(filtered, groups))
+    own_counts = {}
+    for gid in groups:
+        group_filter = Q(tag_name__isnull=True) if gid == NO_TAG_GROUP else Q(tag_name_id=gid)
+        own_counts[gid] = _tag_counts(filter_by_tag_groups(filtered, groups, exclude_group=gid), group_filter)
+
+    rows = ProductTagGroup.tags.through.objects.filter(
+        producttaggroup__product__in=base,
+        producttaggroup__group_name__isnull=False,
+    ).values(
+        'producttaggroup__group_name_id', 'producttaggroup__group_name__name',
+        'tag_id', 'tag__name', 'tag__slug', 'tag__tag_name_id',
+    ).order_by('producttaggroup__group_name__name').distinct()
+
+    grouped = {}
+    for row in rows:
+        group = grouped.setdefault(row['producttaggroup__group_name_id'], {
+            'id': row['producttaggroup__group_name_id'],
+            'group_name': row['producttaggroup__group_name__name'],
+            'tags': {},
+        })
+        gid = row['tag__tag_name_id'] if row['tag__tag_name_id'] is not None else NO_TAG_GROUP
+        source = own_counts.get(gid, counts)
+        group['tags'][row['tag_id']] = {
+            'id': row['tag_id'],
+            'name': row['tag__name'],
+            'slug': row['tag__slug'],
+            'product_count': source.get(row['tag_id'], 0),
+            'selected': row['tag__slug'] in groups.get(gid, ()),
+        }
+
+    return [
+        {**group, 'tags': sorted(group['tags'].values(), key=lambda t: t['name'])}
+        for group in grouped.values()
+    ]
+
+
+def brand_facets(base, filtered):
+    """Бренды товаров base; products_count - при всех фильтрах, кроме бренда"""
+    return Brand.objects.filter(products__in=base).annotate(
+        products_count=Count('products', filter=Q(products__in=filtered), distinct=True)
+    ).order_by('name')
+
+
+def price_range(base):
+    agg = base.exclude(price__isnull=True).aggregate(min_price=Min('price'), max_price=Max('price'))
+    return {
+        'min_price': None if agg['min_price'] is None else float(agg['min_price']),
+        'max_price': None if agg['max_price'] is None else float(agg['max_price']),
+    }
+
+
+def histogram_buckets(params):
+    try:
+        buckets = int(params.get('buckets', PRICE_HISTOGRAM_BUCKETS))
+    except ValueError:
+        return PRICE_HISTOGRAM_BUCKETS
+    return max(1, min(buckets, PRICE_HISTOGRAM_MAX_BUCKETS))
+
+
+def price_histogram(products, buckets=PRICE_HISTOGRAM_BUCKETS):
+    """Распределение цен products по buckets равным интервалам.
+
+    Два запроса: границы цен и один GROUP BY по номеру интервала, без
+    отдельного подсчета на каждый интервал. Пустые интервалы тоже в ответе.
+    """
+    products = Product.objects.filter(pk__in=products.values('pk'), price__isnull=False)
+    bounds = products.aggregate(min_price=Min('price'), max_price=Max('price'), count=Count('pk'))
+    low, high = bounds['min_price'], bounds['max_price']
+    if low is None:
+        return {'min_price': None, 'max_price': None, 'buckets': []}
+    if low == high:
+        buckets = 1
+
+    width = (high - low) / buckets
+    counts = [0] * buckets
+    if buckets == 1:
+        counts[0] = bounds['count']
+    else:
+        decimal = DecimalField(max_digits=20, decimal_places=6)
+        bucket = Least(
+            Floor((F('price') - Value(low, output_field=decimal)) / Value(width, output_field=decimal)),
+            Value(buckets - 1),
+            output_field=IntegerField(),
+        )
+        rows = products.annotate(bucket=bucket).values('bucket').annotate(count=Count('pk')).order_by()
+        for row in rows:
+            counts[int(row['bucket'])] += row['count']
+
+    return {
+        'min_price': float(low),
+        'max_price': float(high),
+        'buckets': [
+            {
+                'min_price': round(float(low + width * index), 2),
+                'max_price': round(float(high if index == buckets - 1 else low + width * (index + 1)), 2),
+                'count': count,
+            }
+            for index, count in enumerate(counts)
+        ],
+    }
+
+
+def _feature_counts(products, feature_id=None):
+    queryset = ProductFeature.objects.filter(product__in=products, value__isnull=False)
+    if feature_id is None:
+        queryset = queryset.filter(feature__isnull=False)
+    else:
+        queryset = queryset.filter(feature_id=feature_id)
+    rows = queryset.values('feature_id', 'value_id').annotate(
+        product_count=Count('product_id', distinct=True)
+    ).order_by()
+    return {(row['feature_id'], row['value_id']): row['product_count'] for row in rows}
+
+
+def feature_facets(subtree, filtered, selected, filtered_by_others):
+    """Характеристики товаров поддерева со счетчиками значений.
+
+    subtree - подзапрос id категорий, filtered - товары со всеми фильтрами,
+    кроме характеристик, selected - selected_features(), filtered_by_others -
+    активен ли какой-то фильтр кроме характеристик. Без фильтров счетчики
+    берутся из CategoryFeatureFacet, живой подсчет - только для сужённых выборок.
+    """
+    rows = list(CategoryFeatureFacet.objects.filter(category_id__in=subtree).values(
+        'feature_id', 'feature__name', 'value_id', 'value__value'
+    ).annotate(product_count=Sum('product_count')).order_by('feature__name', 'feature_id', 'value__value'))
+    precomputed = {(row['feature_id'], row['value_id']): row['product_count'] for row in rows}
+
+    counts = precomputed
+    if filtered_by_others or selected:
+        counts = _feature_counts(filter_by_features(filtered, selected))
+    own_counts = {}
+    for feature_id in selected:
+        if filtered_by_others or len(selected) > 1:
+            own_counts[feature_id] = _feature_counts(
+                filter_by_features(filtered, selected, exclude_feature=feature_id), feature_id
+            )
+        else:
+            own_counts[feature_id] = precomputed
+
+    grouped = {}
+    for row in rows:
+        feature_id = row['feature_id']
+        feature = grouped.setdefault(feature_id, {
+            'id': feature_id,
+            'name': row['feature__name'],
+            'values': [],
+        })
+        key = (feature_id, row['value_id'])
+        feature['values'].append({
+            'id': row['value_id'],
+            'value': row['value__value'],
+            'product_count': own_counts.get(feature_id, counts).get(key, 0),
+            'selected': selected.get(feature_id) == row['value_id'],
+        })
+    return list(grouped.values())
+
+
+def rebuild_feature_facets(category_ids=None):
+    """Пересчитать CategoryFeatureFacet для категорий (или всех). Возвращает число строк."""
+    product_features = ProductFeature.objects.filter(feature__isnull=False, value__isnull=False)
+    stored = CategoryFeatureFacet.objects.all()
+    if category_ids is not None:
+        category_ids = list(category_ids)
+        product_features = product_features.filter(product__category_id__in=category_ids)
+        stored = stored.filter(category_id__in=category_ids)
+
+    with transaction.atomic():
+        rows = product_features.values('product__category_id', 'feature_id', 'value_id').annotate(
+            product_count=Count('product_id', distinct=True)
+        ).order_by()
+        facets = [
+            CategoryFeatureFacet(category_id=row['product__category_id'], feature_id=row['feature_id'],
+                                 value_id=row['value_id'], product_count=row['product_count'])
+            for row in rows
+        ]
+        stored.delete()
+        CategoryFeatureFacet.objects.bulk_create(facets, batch_size=500)
+    return len(facets)
+
+
+def refresh_feature_facets(category_ids):
+    """Пересчитать фасеты характеристик категорий после коммита текущей транзакции"""
+    category_ids = {pk for pk in category_ids if pk}
+    if category_ids:
+        transaction.on_commit(functools.partial(rebuild_feature_facets, category_ids))
+
+
+class CategorySelection:
+    """Поддерево категории и выбранные фильтры, разобранные один раз.
+
+    apply_filters(queryset, params) - фильтры каталога (views.apply_product_filters).
+    Теги и характеристики из params выделяются и применяются отдельно, чтобы
+    фасет мог не учитывать выбор в собственной группе.
+    """
+
+    def __init__(self, category, params, apply_filters):
+        params = params.copy()
+        params.pop('category', None)
+        self.tag_groups = selected_tag_groups(params.pop('tag', [''])[-1])
+        self.features = selected_features(params)
+        for key in [key for key in params if key.startswith('feature_')]:
+            params.pop(key)
+        self.params = params
+        self.apply_filters = apply_filters
+        self.subtree = category.subtree_ids()
+        self.base = Product.objects.filter(category_id__in=self.subtree)
+        self.rest = apply_filters(self.base, params)  # без тегов и характеристик
+
+    def products(self):
+        return filter_by_tag_groups(filter_by_features(self.rest, self.features), self.tag_groups)
+
+    def tag_facets(self):
+        return tag_facets(self.base, filter_by_features(self.rest, self.features), self.tag_groups)
+
+    def feature_facets(self):
+        return feature_facets(
+            self.subtree, filter_by_tag_groups(self.rest, self.tag_groups), self.features,
+            filtered_by_others=bool(self.tag_groups) or has_filters(self.params),
+        )
+
+    def _filtered_without(self, *names):
+        """Товары со всеми фильтрами, кроме параметров names"""
+        params = self.params.copy()
+        for name in names:
+            params.pop(name, None)
+        others = filter_by_features(self.apply_filters(self.base, params), self.features)
+        return filter_by_tag_groups(others, self.tag_groups)
+
+    def brand_facets(self):
+        return brand_facets(self.base, self._filtered_without('brand'))
+
+    def price_range(self):
+        return price_range(self.base)
+
+    def price_histogram(self):
+        # собственный диапазон цен не учитывается, иначе ползунок нельзя расширить
+        return price_histogram(self._filtered_without('price_min', 'price_max'), histogram_buckets(self.params))
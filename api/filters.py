@@ -1,5 +1,6 @@
 # filters.py
 import django_filters
+from django.db import models
 from django.db.models import Q
 from rest_framework import filters
 from .models import Product, Brand
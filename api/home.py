@@ -0,0 +1,160 @@
+# api/home.py
+"""
+Данные главной страницы одним ответом (/api/home/).
+
+Ответ собирается из независимо кэшируемых фрагментов: баннеры, категории,
+новости, контакты, "о нас" и новые товары. У каждого раздела свой номер
+версии в кэше; сигналы (api/signals.py) меняют версию только своего раздела,
+поэтому правка баннера не сбрасывает категории и товары.
+
+Кэш локальный для процесса, поэтому изменения, сделанные через другой воркер,
+становятся видны не позже HOME_FRAGMENT_TIMEOUT.
+"""
+import hashlib
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .cards import serialize_product_cards, with_card_stamp
+from .models import AboutContent, Banner, Category, ContactInfo, NewsItem, Product
+from .serializers import (
+    AboutContentSerializer, BannerSerializer, CategorySerializer,
+    ContactInfoSerializer, NewsItemSerializer
+)
+
+HOME_CACHE_PREFIX = 'home'
+
+
+def build_banners(request, limit=None):
+    banners = Banner.objects.filter(is_active=True).order_by('order')
+    return BannerSerializer(banners, many=True, context={'request': request}).data
+
+
+def build_categories(request, limit=None):
+    categories = Category.objects.filter(parent=None).order_by('order', 'name').annotate(
+        direct_products_count=Count('products', distinct=True)
+    )
+    return CategorySerializer(categories, many=True, context={'request': request}).data
+
+
+def build_news(request, limit):
+    news = NewsItem.objects.filter(is_published=True).order_by('-pub_date')[:limit]
+    return NewsItemSerializer(news, many=True, context={'request': request}).data
+
+
+def build_contact(request, limit=None):
+    obj = ContactInfo.objects.first() or ContactInfo(phone='', email='', address='Информация отсутствует')
+    return ContactInfoSerializer(obj, context={'request': request}).data
+
+
+def build_about(request, limit=None):
+    obj = AboutContent.objects.first() or AboutContent(title='О нас', content='Информация временно отсутствует')
+    return AboutContentSerializer(obj, context={'request': request}).data
+
+
+def build_products(request, limit):
+    products = with_card_stamp(Product.objects.filter(is_available=True).order_by('-created_at'))[:limit]
+    return serialize_product_cards(products, {'request': request})
+
+
+# раздел -> (сборщик, (лимит по умолчанию, максимум) или None для разделов без ?<раздел>_limit=)
+SECTIONS = {
+    'banners': (build_banners, None),
+    'categories': (build_categories, None),
+    'news': (build_news, (3, 12)),
+    'contact': (build_contact, None),
+    'about': (build_about, None),
+    'products': (build_products, (8, 24)),
+}
+
+
+def section_limits(request):
+    limits = {}
+    for name, (_, bounds) in SECTIONS.items():
+        if bounds is None:
+            limits[name] = None
+            continue
+        default, maximum = bounds
+        try:
+            limits[name] = max(1, min(int(request.GET.get(f'{name}_limit', default)), maximum))
+        except ValueError:
+            limits[name] = default
+    return limits
+
+
+def version_key(section):
+    return f'{HOME_CACHE_PREFIX}:version:{section}'
+
+
+def invalidate(*sections):
+    """Новая версия раздела: старые фрагменты больше не читаются и вытесняются по TTL"""
+    cache.set_many({version_key(section): uuid.uuid4().hex[:12] for section in sections}, None)
+
+
+def missing_versions(versions):
+    """Версии для разделов, которых нет в кэше (первый запуск или вытеснение)"""
+    return {
+        version_key(section): uuid.uuid4().hex[:12]
+        for section in SECTIONS if version_key(section) not in versions
+    }
+
+
+def fragment_keys(request, versions, limits):
+    host = hashlib.md5(request.build_absolute_uri('/').encode('utf-8')).hexdigest()[:8]
+    return {
+        section: f'{HOME_CACHE_PREFIX}:{section}:{versions[version_key(section)]}:{host}:{limits[section]}'
+        for section in SECTIONS
+    }
+
+
+def build_fragments(request, sections, limits):
+    return {section: SECTIONS[section][0](request, limits[section]) for section in sections}
+
+
+def fragment_timeout():
+    return getattr(settings, 'HOME_FRAGMENT_TIMEOUT', 60 * 5)
+
+
+def get_home(request):
+    """Все разделы главной: два обращения к кэшу плюс сборка отсутствующих фрагментов"""
+    limits = section_limits(request)
+    versions = cache.get_many([version_key(section) for section in SECTIONS])
+    new_versions = missing_versions(versions)
+    if new_versions:
+        cache.set_many(new_versions, None)
+        versions.update(new_versions)
+
+    keys = fragment_keys(request, versions, limits)
+    cached = cache.get_many(list(keys.values()))
+    data = {section: cached[key] for section, key in keys.items() if key in cached}
+
+    missing = [section for section in SECTIONS if section not in data]
+    if missing:
+        fresh = build_fragments(request, missing, limits)
+        cache.set_many({keys[section]: fresh[section] for section in missing}, fragment_timeout())
+        data.update(fresh)
+    return {section: data[section] for section in SECTIONS}
+
+
+async def aget_home(request):
+    """Асинхронный вариант get_home: кэш через async API, сборка фрагментов в потоке"""
+    limits = section_limits(request)
+    versions = await cache.aget_many([version_key(section) for section in SECTIONS])
+    new_versions = missing_versions(versions)
+    if new_versions:
+        await cache.aset_many(new_versions, None)
+        versions.update(new_versions)
+
+    keys = fragment_keys(request, versions, limits)
+    cached = await cache.aget_many(list(keys.values()))
+    data = {section: cached[key] for section, key in keys.items() if key in cached}
+
+    missing = [section for section in SECTIONS if section not in data]
+    if missing:
+        fresh = await sync_to_async(build_fragments)(request, missing, limits)
+        await cache.aset_many({keys[section]: fresh[section] for section in missing}, fragment_timeout())
+        data.update(fresh)
+    return {section: data[section] for section in SECTIONS}
@@ -0,0 +1,146 @@
+# api/management/commands/_dataset.py
+"""
+Генерация синтетического каталога для бенчмарков и нагрузочных тестов.
+
+Данные создаются через bulk_create и детерминированы параметром seed,
+поэтому два прогона с одинаковыми настройками дают одинаковую базу.
+"""
+import random
+from decimal import Decimal
+
+from django.db import transaction
+
+from api.models import (
+    Category, Brand, Product, Image, Feature, FeatureValue, ProductFeature,
+    Tag, TagName, ProductTagGroup, Banner, NewsItem, ContactInfo, AboutContent
+)
+
+WORDS = [
+    'Smart', 'Pro', 'Max', 'Ultra', 'Lite', 'Air', 'Mini', 'Plus', 'Neo', 'Prime',
+    'Nova', 'Edge', 'Core', 'Flex', 'Zoom', 'Volt', 'Sonic', 'Wave', 'Pixel', 'Bolt',
+]
+
+
+def generate_catalog(products=2000, roots=4, children=4, leaves=3, brands=40,
+                     tag_groups=3, tags_per_group=5, features=4, values_per_feature=6,
+                     images_per_product=2, seed=42):
+    """Создает каталог: дерево категорий, бренды, теги, характеристики и товары.
+
+    Возвращает словарь с размерами набора данных.
+    """
+    rnd = random.Random(seed)
+
+    with transaction.atomic():
+        # --- дерево категорий: roots -> children -> leaves ---
+        leaf_categories = []
+        for r in range(roots):
+            root = Category.objects.create(name=f'Раздел {r}', slug=f'root-{r}', order=r)
+            for c in range(children):
+                child = Category.objects.create(
+                    name=f'Категория {r}.{c}', slug=f'cat-{r}-{c}', parent=root, order=c
+                )
+                for leaf in range(leaves):
+                    leaf_categories.append(Category.objects.create(
+                        name=f'Подкатегория {r}.{c}.{leaf}', slug=f'cat-{r}-{c}-{leaf}',
+                        parent=child, order=leaf
+                    ))
+
+        brand_objs = Brand.objects.bulk_create([
+            Brand(name=f'Brand {b}', slug=f'brand-{b}', description=f'Бренд номер {b}')
+            for b in range(brands)
+        ])
+
+        # --- теги и характеристики по листовым категориям ---
+        cat_tags = {}
+        cat_features = {}
+        for cat in leaf_categories:
+            groups = []
+            for g in range(tag_groups):
+                tag_name = TagName.objects.create(name=f'Группа {g} ({cat.slug})', category=cat)
+                tags = Tag.objects.bulk_create([
+                    Tag(name=f'Тег {g}.{t}', slug=f'{cat.slug}-tag-{g}-{t}',
+                        category=cat, tag_name=tag_name)
+                    for t in range(tags_per_group)
+                ])
+                groups.append((tag_name, tags))
+            cat_tags[cat.id] = groups
+
+            feats = []
+            for f in range(features):
+                feature = Feature.objects.create(name=f'Характеристика {f}', category=cat)
+                values = FeatureValue.objects.bulk_create([
+                    FeatureValue(category=cat, value=f'Значение {f}.{v}')
+                    for v in range(values_per_feature)
+                ])
+                feature.values.set(values)
+                feats.append((feature, values))
+            cat_features[cat.id] = feats
+
+        # --- товары ---
+        product_objs = []
+        for n in range(products):
+            cat = leaf_categories[n % len(leaf_categories)]
+            name = f'{rnd.choice(WORDS)} {rnd.choice(WORDS)} {n}'
+            product_objs.append(Product(
+                name=name,
+                slug=f'product-{n}',
+                description=f'Описание товара {name}. ' * 5,
+                category=cat,
+                brand=rnd.choice(brand_objs),
+                price=Decimal(rnd.randint(500, 500000)) / 100,
+                is_available=rnd.random() > 0.15,
+                manufacturer_sku=f'MFR-{n:06d}',
+                internal_sku=f'BNC-{n:06d}',
+            ))
+        product_objs = Product.objects.bulk_create(product_objs, batch_size=500)
+
+        images = []
+        product_features = []
+        tag_group_objs = []
+        tag_group_tags = []
+        for product in product_objs:
+            for i in range(images_per_product):
+                images.append(Image(
+                    product=product, image=f'products/bench-{product.id}-{i}.jpg',
+                    is_main=(i == 0), order=i
+                ))
+            for feature, values in cat_features[product.category_id]:
+                product_features.append(ProductFeature(
+                    product=product, feature=feature, value=rnd.choice(values)
+                ))
+            for tag_name, tags in cat_tags[product.category_id]:
+                tag_group_objs.append(ProductTagGroup(product=product, group_name=tag_name))
+                tag_group_tags.append(rnd.sample(tags, k=rnd.randint(1, 2)))
+
+        Image.objects.bulk_create(images, batch_size=1000)
+        ProductFeature.objects.bulk_create(product_features, batch_size=1000)
+        tag_group_objs = ProductTagGroup.objects.bulk_create(tag_group_objs, batch_size=1000)
+        through = ProductTagGroup.tags.through
+        through.objects.bulk_create([
+            through(producttaggroup_id=group.id, tag_id=tag.id)
+            for group, tags in zip(tag_group_objs, tag_group_tags)
+            for tag in tags
+        ], batch_size=1000)
+
+        # --- контент главной страницы ---
+        Banner.objects.bulk_create([
+            Banner(title=f'Баннер {b}', link=f'/promo/{b}', order=b) for b in range(5)
+        ])
+        NewsItem.objects.bulk_create([
+            NewsItem(title=f'Новость {n}', slug=f'news-{n}', content='Текст новости. ' * 20,
+                     preview='Краткое описание новости')
+            for n in range(20)
+        ])
+        ContactInfo.objects.create(phone='+000 00 000 00 00', email='info@example.com', address='Адрес')
+        AboutContent.objects.create(title='О нас', content='Информация о компании')
+
+    return {
+        'categories': Category.objects.count(),
+        'brands': len(brand_objs),
+        'products': len(product_objs),
+        'images': len(images),
+        'product_features': len(product_features),
+        'tag_groups': len(tag_group_objs),
+        'tags': Tag.objects.count(),
+        'seed': seed,
+    }
@@ -0,0 +1,233 @@
+# api/management/commands/benchmark_api.py
+"""
+Воспроизводимый бенчмарк публичных endpoint'ов каталога.
+
+Создает временную тестовую БД, наполняет ее синтетическим каталогом
+(см. _dataset.py), прогоняет набор сценариев через django.test.Client
+и замеряет латентность, пропускную способность и количество SQL-запросов.
+
+Примеры:
+    python manage.py benchmark_api --output bench.json
+    python manage.py benchmark_api --compare bench.json --threshold 0.2
+"""
+import json
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from ._dataset import generate_catalog
+
+
+def percentile(values, pct):
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def build_scenarios():
+    """Сценарии строятся по уже сгенерированным данным (slug'и, id тегов и характеристик)"""
+    from api.models import Category, Brand, Product, Tag, ProductFeature
+
+    # CategoryViewSet отдает только корневые категории, поэтому его actions - по корню
+    root = Category.objects.filter(parent=None).order_by('order').first()
+    leaf = Category.objects.filter(children__isnull=True).order_by('id').first()
+    brand = Brand.objects.order_by('id').first()
+    product = Product.objects.filter(category=leaf).order_by('id').first()
+    tags = list(Tag.objects.filter(category=leaf).order_by('tag_name_id', 'id'))
+    tag_a, tag_b = tags[0].slug, tags[-1].slug  # разные группы -> AND между группами
+    pf = ProductFeature.objects.filter(product__category=leaf).order_by('id').first()
+    feature_param = f'feature_{pf.feature_id}={pf.value_id}'
+
+    order_payload = {
+        'customer_name': 'Benchmark',
+        'customer_phone': '+000000000',
+        'items': [
+            {'product': product.id, 'product_name': product.name,
+             'product_sku': product.internal_sku, 'price': str(product.price), 'quantity': 2},
+        ],
+    }
+
+    cart_products = list(Product.objects.filter(is_available=True, price__isnull=False).order_by('id')[:5])
+    cart_payload = {'items': [{'product': p.id, 'quantity': 1} for p in cart_products]}
+    checkout_payload = {'customer_name': 'Benchmark', 'customer_phone': '+000000000', **cart_payload}
+    batch_ids = ','.join(str(p.id) for p in cart_products)
+
+    return [
+        ('products.list', 'get', '/api/products/', None),
+        ('products.list.category', 'get', f'/api/products/?category={root.slug}', None),
+        ('products.list.tags', 'get', f'/api/products/?category={leaf.slug}&tag={tag_a},{tag_b}', None),
+        ('products.list.price_brand', 'get',
+         f'/api/products/?price_min=100&price_max=3000&brand={brand.slug}&ordering=price', None),
+        ('products.list.search', 'get', '/api/products/?search=Pro&is_available=true', None),
+        ('products.list.feature', 'get', f'/api/products/?category={leaf.slug}&{feature_param}', None),
+        ('products.retrieve', 'get', f'/api/products/{product.slug}/', None),
+        ('products.retrieve.lean', 'get', f'/api/products/{product.slug}/?detail=lean', None),
+        ('products.price_range', 'get', f'/api/products/price-range/?category={root.slug}', None),
+        ('products.price_histogram', 'get',
+         f'/api/products/price-histogram/?category={root.slug}&price_min=100&buckets=20', None),
+        ('categories.products', 'get', f'/api/categories/{root.slug}/products/', None),
+        ('categories.products.filtered', 'get',
+         f'/api/categories/{root.slug}/products/?tag={tag_a}&price_min=50', None),
+        ('categories.brands', 'get', f'/api/categories/{root.slug}/brands/', None),
+        ('categories.tags', 'get', f'/api/categories/{root.slug}/tags/?selected_tags={tag_a}', None),
+        ('categories.page', 'get', f'/api/categories/{root.slug}/page/?tag={tag_a}&price_min=50', None),
+        ('categories.features', 'get', f'/api/categories/{root.slug}/features/?{feature_param}', None),
+        ('brands.products', 'get', f'/api/brands/{brand.slug}/products/', None),
+        ('brands.tags', 'get', f'/api/brands/{brand.slug}/tags/', None),
+        ('features_tags_by_category', 'get', f'/api/features-tags-by-category/?category={leaf.id}', None),
+        ('similar_products', 'get', f'/api/products/{product.slug}/similar/', None),
+        ('search.suggest', 'get', '/api/search/suggest/?q=pro', None),
+        ('products.batch', 'get', f'/api/products/batch/?ids={batch_ids}', None),
+        ('cart.quote', 'post', '/api/cart/quote/', cart_payload),
+        ('orders.create', 'post', '/api/orders/', order_payload),
+        ('orders.checkout', 'post', '/api/orders/checkout/', checkout_payload),
+    ]
+
+
+def compare_results(current, baseline, threshold, min_delta_ms):
+    """Сравнение с сохраненным baseline. Возвращает список регрессий.
+
+    Рост p50 считается регрессией, только если он больше threshold
+    и одновременно больше min_delta_ms (шум на быстрых запросах).
+    """
+    regressions = []
+    for name, cur in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        delta = cur['p50_ms'] - base['p50_ms']
+        if delta > base['p50_ms'] * threshold and delta > min_delta_ms:
+            regressions.append(
+                f"{name}: p50 {base['p50_ms']:.2f}ms -> {cur['p50_ms']:.2f}ms"
+            )
+        if cur['queries'] > base['queries']:
+            regressions.append(
+                f"{name}: queries {base['queries']} -> {cur['queries']}"
+            )
+    return regressions
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк публичных API каталога на сгенерированном наборе данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кэш перед каждым запросом (без cache_page)')
+        parser.add_argument('--only', default='', help='Запускать только сценарии с этой подстрокой')
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+        parser.add_argument('--compare', help='JSON с baseline для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Допустимый относительный рост p50 (0.25 = 25%%)')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help='Минимальный абсолютный рост p50, считающийся регрессией')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            cache.clear()
+            dataset = generate_catalog(products=options['products'], seed=options['seed'])
+            results = self.run(dataset, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.print_report(results)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                json.dump(results, fh, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты сохранены в {options['output']}")
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as fh:
+                baseline = json.load(fh)
+            regressions = compare_results(results, baseline, options['threshold'], options['min_delta_ms'])
+            if regressions:
+                for line in regressions:
+                    self.stdout.write(self.style.ERROR(f'  REGRESSION {line}'))
+                raise CommandError(f'Найдено регрессий: {len(regressions)}')
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно baseline не найдено'))
+
+    def run(self, dataset, options):
+        client = Client()
+        scenarios = []
+        request_no = 0
+        for name, method, path, payload in build_scenarios():
+            if options['only'] and options['only'] not in name:
+                continue
+            latencies = []
+            queries = []
+            statuses = set()
+            total = options['warmup'] + options['iterations']
+            for i in range(total):
+                if options['cold']:
+                    cache.clear()
+                request_no += 1
+                # Каждый запрос с отдельного адреса, чтобы AnonRateThrottle не искажал замеры
+                headers = {'X-Forwarded-For': f'10.{request_no // 65536 % 256}.{request_no // 256 % 256}.{request_no % 256}'}
+                with CaptureQueriesContext(connection) as ctx:
+                    started = time.perf_counter()
+                    if method == 'post':
+                        response = client.post(path, data=payload, content_type='application/json', headers=headers)
+                    else:
+                        response = client.get(path, headers=headers)
+                    elapsed = (time.perf_counter() - started) * 1000
+                if i < options['warmup']:
+                    continue
+                latencies.append(elapsed)
+                queries.append(len(ctx.captured_queries))
+                statuses.add(response.status_code)
+            total_s = sum(latencies) / 1000
+            scenarios.append((name, {
+                'path': path,
+                'method': method.upper(),
+                'iterations': len(latencies),
+                'mean_ms': statistics.mean(latencies),
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'min_ms': min(latencies),
+                'max_ms': max(latencies),
+                'rps': len(latencies) / total_s if total_s else None,
+                'queries': int(statistics.median(queries)),
+                'statuses': sorted(statuses),
+            }))
+
+        return {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'cold_cache': options['cold'],
+                'dataset': dataset,
+            },
+            'scenarios': dict(scenarios),
+        }
+
+    def print_report(self, results):
+        header = f"{'scenario':<32} {'p50 ms':>9} {'p95 ms':>9} {'rps':>9} {'queries':>8} status"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, row in results['scenarios'].items():
+            self.stdout.write(
+                f"{name:<32} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+                f"{row['rps'] or 0:>9.1f} {row['queries']:>8} {','.join(map(str, row['statuses']))}"
+            )
@@ -0,0 +1,29 @@
+# api/management/commands/build_similarity.py
+"""
+Пересчет индекса похожих товаров (ProductSimilarity), см. api/similarity.py.
+Запускается периодически (cron); новые товары до пересчета получают
+похожие из своей категории.
+
+    python manage.py build_similarity
+    python manage.py build_similarity --top-k 24
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import similarity
+
+
+class Command(BaseCommand):
+    help = 'Пересчет индекса похожих товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=similarity.SIMILAR_TOP_K,
+                            help='Соседей на товар')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = similarity.build_similarity(top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Записано пар: {rows} за {time.monotonic() - started:.1f} с'
+        ))
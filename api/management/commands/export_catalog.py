@@ -0,0 +1,58 @@
+# api/management/commands/export_catalog.py
+"""
+Выгрузка каталога товаров в CSV, JSONL или XLSX (ночная выгрузка партнерам).
+
+Читает товары пачками (api/export.py), память не зависит от размера каталога.
+Без --output CSV и JSONL пишутся в stdout; XLSX требует файл.
+
+    python manage.py export_catalog --format csv --output catalog.csv
+    python manage.py export_catalog --format jsonl --base-url https://shop.example.com > catalog.jsonl
+    python manage.py export_catalog --format xlsx --output catalog.xlsx --chunk-size 1000
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import export
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка каталога товаров в CSV, JSONL или XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='file_format', choices=sorted(export.EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help='Путь к файлу (по умолчанию stdout для csv и jsonl)')
+        parser.add_argument('--base-url', default='', help='Префикс для URL изображений, например https://shop.example.com')
+        parser.add_argument('--chunk-size', type=int, default=export.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        file_format = options['file_format']
+        output = options['output']
+        if file_format == 'xlsx' and not output:
+            raise CommandError('Для XLSX укажите --output')
+
+        started = time.monotonic()
+        exported = 0
+
+        def records():
+            nonlocal exported
+            for record in export.iter_records(base_url=options['base_url'].rstrip('/'),
+                                              chunk_size=options['chunk_size']):
+                exported += 1
+                yield record
+
+        if file_format == 'xlsx':
+            export.write_xlsx(records(), output)
+        else:
+            rows = export.iter_csv(records()) if file_format == 'csv' else export.iter_jsonl(records())
+            if output:
+                with open(output, 'w', encoding='utf-8', newline='') as stream:
+                    stream.writelines(rows)
+            else:
+                for row in rows:
+                    self.stdout.write(row, ending='')
+
+        if output:
+            self.stdout.write(self.style.SUCCESS(
+                f'Выгружено товаров: {exported} в {output} за {time.monotonic() - started:.1f} с'
+            ))
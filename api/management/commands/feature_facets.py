@@ -0,0 +1,25 @@
+# api/management/commands/feature_facets.py
+"""
+Пересчет предрасчитанных фасетов характеристик (CategoryFeatureFacet).
+
+Обычно таблица обновляется сигналами после изменения товаров; команда нужна
+после массовых операций в обход ORM-сигналов и для проверки расхождений.
+
+    python manage.py feature_facets                 # все категории
+    python manage.py feature_facets --category 12   # одна категория (без подкатегорий)
+"""
+from django.core.management.base import BaseCommand
+
+from api import facets
+
+
+class Command(BaseCommand):
+    help = 'Пересчет фасетов характеристик по категориям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, action='append',
+                            help='id категории (можно указать несколько раз)')
+
+    def handle(self, *args, **options):
+        rows = facets.rebuild_feature_facets(options['category'])
+        self.stdout.write(self.style.SUCCESS(f'Строк фасетов: {rows}'))
@@ -0,0 +1,55 @@
+# api/management/commands/import_catalog.py
+"""
+Массовый импорт товаров из CSV или XLSX (формат - как у export_catalog).
+
+Товары ищутся по internal_sku (без него - по slug) и обновляются, остальные
+создаются. С --dry-run файл проверяется полностью, но изменения откатываются.
+
+    python manage.py import_catalog prices.csv --dry-run
+    python manage.py import_catalog prices.xlsx --batch-size 2000
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import catalog_import
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт товаров из CSV или XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='file_format', choices=catalog_import.IMPORT_FORMATS,
+                            help='По умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=catalog_import.IMPORT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Только проверка, без записи')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        try:
+            with open(path, 'rb') as stream:
+                content = stream.read()
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        started = time.monotonic()
+        try:
+            report = catalog_import.import_catalog(content, file_format, options['batch_size'],
+                                                   dry_run=options['dry_run'])
+        except catalog_import.CatalogImportError as exc:
+            raise CommandError(str(exc))
+
+        for item in report['errors']:
+            self.stderr.write(f"строка {item['row']}: {'; '.join(item['errors'])}")
+        if report['failed'] > len(report['errors']):
+            self.stderr.write(f"... и еще {report['failed'] - len(report['errors'])} строк с ошибками")
+        summary = (
+            f"Строк: {report['rows']}, создано: {report['created']}, обновлено: {report['updated']}, "
+            f"с ошибками: {report['failed']} за {time.monotonic() - started:.1f} с"
+        )
+        if options['dry_run']:
+            summary += ' (проверка, изменения не записаны)'
+        self.stdout.write(self.style.SUCCESS(summary) if not report['failed'] else self.style.WARNING(summary))
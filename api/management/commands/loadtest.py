@@ -0,0 +1,437 @@
+# api/management/commands/loadtest.py
+"""
+Генератор нагрузки для config.wsgi.application и config.asgi.application.
+
+Виртуальные пользователи - потоки. Каждый проходит сценарий покупателя
+(дерево категорий -> товары категории -> фасеты тегов -> фильтр по тегу ->
+карточка товара -> похожие товары -> заказ) или воспроизводит записанный
+трафик из JSONL-файла. Запросы идут либо прямо в WSGI-приложение в этом
+процессе, либо через локально запущенный gunicorn (WSGI) или uvicorn (ASGI).
+
+Работает с той БД, на которую указывают настройки, поэтому для нагрузочных
+прогонов удобно использовать отдельный файл:
+    SQLITE_PATH=/tmp/load.sqlite3 python manage.py migrate
+    SQLITE_PATH=/tmp/load.sqlite3 python manage.py loadtest --seed-products 2000 \\
+        --mode gunicorn --workers 4 --users 16 --duration 30
+
+Сравнение синхронного WSGI-пути с асинхронным ASGI-путем каталога:
+    ... loadtest --mode gunicorn --workers 4 --scenario catalog --api-prefix /api/
+    ... loadtest --mode uvicorn --workers 4 --scenario catalog --api-prefix /api/async/
+
+Сравнение профилей SQLite (см. SQLITE_PROFILES в настройках):
+    ... loadtest --mode gunicorn --workers 4 --db-profile basic --output basic.json
+    ... loadtest --mode gunicorn --workers 4 --db-profile production --output production.json
+
+Формат файла для --replay: одна JSON-строка на запрос
+    {"method": "GET", "path": "/api/products/?page=2"}
+    {"method": "POST", "path": "/api/orders/", "body": {...}}
+"""
+import copy
+import http.client
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import connections
+
+from .benchmark_api import percentile
+
+LOCKED_MARKER = 'database is locked'
+
+
+class Stats:
+    """Потокобезопасный сборщик результатов"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = Counter()
+        self.errors = Counter()
+
+    def record(self, label, status, elapsed_ms, locked=False, error=None):
+        with self.lock:
+            self.latencies[label].append(elapsed_ms)
+            self.statuses[status] += 1
+            if locked:
+                self.errors['database_locked'] += 1
+            if error:
+                self.errors[error] += 1
+
+    def add_error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+
+class InProcessTransport:
+    """Вызывает WSGI-приложение напрямую, без сети"""
+
+    def __init__(self, stats):
+        from config.wsgi import application
+        self.application = application
+        self.stats = stats
+        got_request_exception.connect(self._on_exception, weak=False)
+
+    def _on_exception(self, sender, request=None, **kwargs):
+        exc = sys.exc_info()[1]
+        if exc is not None and LOCKED_MARKER in str(exc):
+            self.stats.add_error('database_locked_exception')
+
+    def request(self, method, path, body, client_ip):
+        path_info, _, query = path.partition('?')
+        payload = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path_info,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_HOST': 'localhost',
+            'HTTP_X_FORWARDED_FOR': client_ip,
+            'HTTP_X_FORWARDED_PROTO': 'https',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(payload)),
+            'wsgi.input': io.BytesIO(payload),
+            'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status_holder = {}
+
+        def start_response(status, headers, exc_info=None):
+            status_holder['status'] = int(status.split(' ', 1)[0])
+
+        result = self.application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return status_holder['status'], content
+
+    def close(self):
+        got_request_exception.disconnect(self._on_exception)
+        connections.close_all()
+
+
+class HTTPTransport:
+    """Ходит в локальный сервер по HTTP; новое соединение на запрос (sync-воркеры gunicorn)"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def request(self, method, path, body, client_ip):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            payload = json.dumps(body) if body is not None else None
+            conn.request(method, path, body=payload, headers={
+                'Content-Type': 'application/json',
+                'X-Forwarded-For': client_ip,
+                'X-Forwarded-Proto': 'https',
+            })
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+
+def load_catalog_snapshot():
+    """Slug'и и id, по которым строятся синтетические сценарии"""
+    from api.models import Category, Product, Tag
+
+    categories = list(Category.objects.values('id', 'slug', 'parent_id'))
+    children = defaultdict(list)
+    for cat in categories:
+        children[cat['parent_id']].append(cat['id'])
+
+    snapshot = []
+    for root in (c for c in categories if c['parent_id'] is None):
+        ids, stack = [], [root['id']]
+        while stack:
+            cid = stack.pop()
+            ids.append(cid)
+            stack.extend(children[cid])
+        products = list(Product.objects.filter(category_id__in=ids, is_available=True).values(
+            'id', 'slug', 'name', 'price', 'internal_sku')[:200])
+        tags = list(Tag.objects.filter(category_id__in=ids).values_list('slug', flat=True)[:50])
+        if products:
+            snapshot.append({'slug': root['slug'], 'products': products, 'tags': tags})
+    return snapshot
+
+
+def synthetic_journey(rnd, snapshot, order_ratio):
+    """Один проход покупателя: список (label, method, path, body)"""
+    root = rnd.choice(snapshot)
+    product = rnd.choice(root['products'])
+    steps = [
+        ('category_tree', 'GET', '/api/categories/', None),
+        ('category_products', 'GET', f"/api/categories/{root['slug']}/products/", None),
+        ('category_tags', 'GET', f"/api/categories/{root['slug']}/tags/", None),
+    ]
+    if root['tags']:
+        tag = rnd.choice(root['tags'])
+        steps.append(('category_products_tag', 'GET',
+                      f"/api/categories/{root['slug']}/products/?tag={tag}", None))
+    steps += [
+        ('product_detail', 'GET', f"/api/products/{product['slug']}/", None),
+        ('similar_products', 'GET', f"/api/products/{product['slug']}/similar/", None),
+    ]
+    if rnd.random() < order_ratio:
+        steps.append(('order_create', 'POST', '/api/orders/', {
+            'customer_name': 'Load test',
+            'customer_phone': '+000000000',
+            'items': [{
+                'product': product['id'],
+                'product_name': product['name'],
+                'product_sku': product['internal_sku'] or '',
+                'price': str(product['price']) if product['price'] is not None else None,
+                'quantity': rnd.randint(1, 3),
+            }],
+        }))
+    return steps
+
+
+def catalog_journey(rnd, snapshot, prefix):
+    """Только горячие чтения каталога; prefix='/api/async/' - асинхронные версии"""
+    root = rnd.choice(snapshot)
+    product = rnd.choice(root['products'])
+    return [
+        ('banners', 'GET', f'{prefix}banners/', None),
+        ('category_tree', 'GET', f'{prefix}categories/', None),
+        ('product_list', 'GET', f"{prefix}products/?category={root['slug']}&page={rnd.randint(1, 3)}", None),
+        ('brands', 'GET', f'{prefix}brands/', None),
+        ('product_detail', 'GET', f"{prefix}products/{product['slug']}/", None),
+    ]
+
+
+def load_replay(path):
+    requests = []
+    with open(path, encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            method = item.get('method', 'GET').upper()
+            label = item.get('label') or f"{method} {item['path'].split('?', 1)[0]}"
+            requests.append((label, method, item['path'], item.get('body')))
+    if not requests:
+        raise CommandError(f'Файл {path} не содержит запросов')
+    return requests
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест приложения (WSGI/ASGI) виртуальными пользователями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=8, help='Число виртуальных пользователей (потоков)')
+        parser.add_argument('--duration', type=float, default=20, help='Длительность прогона, секунд')
+        parser.add_argument('--mode', choices=['inprocess', 'gunicorn', 'uvicorn'], default='inprocess',
+                            help='uvicorn - ASGI (config.asgi), остальные - WSGI')
+        parser.add_argument('--workers', type=int, default=2, help='Воркеры gunicorn/uvicorn')
+        parser.add_argument('--bind', default='127.0.0.1:8765', help='Адрес для gunicorn/uvicorn')
+        parser.add_argument('--scenario', choices=['journey', 'catalog'], default='journey',
+                            help='catalog - только горячие чтения каталога (см. --api-prefix)')
+        parser.add_argument('--api-prefix', default='/api/',
+                            help='Префикс для сценария catalog, например /api/async/')
+        parser.add_argument('--replay', help='JSONL-файл с записанными запросами')
+        parser.add_argument('--order-ratio', type=float, default=0.3,
+                            help='Доля сценариев, заканчивающихся заказом')
+        parser.add_argument('--think-ms', type=float, default=0, help='Пауза между запросами пользователя')
+        parser.add_argument('--seed-products', type=int, default=0,
+                            help='Сгенерировать синтетический каталог, если в БД нет товаров')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Сохранить отчет в JSON')
+        parser.add_argument('--db-profile', choices=sorted(settings.SQLITE_PROFILES),
+                            help='Профиль SQLite для прогона (по умолчанию - из SQLITE_PROFILE)')
+
+    def handle(self, *args, **options):
+        from api.models import Product
+
+        if options['seed_products'] and not Product.objects.exists():
+            from ._dataset import generate_catalog
+            self.stdout.write('Генерация каталога...')
+            generate_catalog(products=options['seed_products'], seed=options['seed'])
+
+        replay = load_replay(options['replay']) if options['replay'] else None
+        snapshot = None if replay else load_catalog_snapshot()
+        if not replay and not snapshot:
+            raise CommandError('В БД нет товаров: используйте --seed-products или --replay')
+        # соединение основного потока не должно держать БД во время прогона
+        connections.close_all()
+        if options['db_profile']:
+            self.apply_db_profile(options['db_profile'])
+
+        stats = Stats()
+        server = None
+        if options['mode'] in ('gunicorn', 'uvicorn'):
+            host, port = options['bind'].rsplit(':', 1)
+            server = self.start_server(options, host, int(port))
+            transport = HTTPTransport(host, int(port))
+        else:
+            transport = InProcessTransport(stats)
+
+        deadline = time.monotonic() + options['duration']
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=self.virtual_user, daemon=True, args=(
+                n, transport, stats, deadline, snapshot, replay, options))
+            for n in range(options['users'])
+        ]
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            elapsed = time.monotonic() - started
+            transport.close()
+            if server:
+                server.terminate()
+                server.wait(timeout=10)
+
+        report = self.build_report(stats, elapsed, options)
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                json.dump(report, fh, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Отчет сохранен в {options['output']}")
+
+    def apply_db_profile(self, name):
+        """Профиль для соединений этого процесса (inprocess) и для gunicorn (через env)"""
+        os.environ['SQLITE_PROFILE'] = name
+        profile = copy.deepcopy(settings.SQLITE_PROFILES[name])
+        # это тот же словарь, что settings.DATABASES['default']: из него потоки создают соединения
+        connections['default'].settings_dict.update(profile)
+        connections.close_all()
+        # режим журнала хранится в файле БД: переключаем его до старта нагрузки
+        with connections['default'].cursor():
+            pass
+        connections.close_all()
+
+    def start_server(self, options, host, port):
+        if options['mode'] == 'uvicorn':
+            cmd = [
+                sys.executable, '-m', 'uvicorn', 'config.asgi:application',
+                '--workers', str(options['workers']),
+                '--host', host, '--port', str(port),
+                '--log-level', 'warning', '--no-access-log',
+            ]
+        else:
+            cmd = [
+                sys.executable, '-m', 'gunicorn', 'config.wsgi:application',
+                '--workers', str(options['workers']),
+                '--bind', f'{host}:{port}',
+                '--log-level', 'warning',
+            ]
+        server = subprocess.Popen(cmd, env=os.environ.copy())
+        for _ in range(100):
+            if server.poll() is not None:
+                raise CommandError(f"{options['mode']} завершился при старте")
+            try:
+                socket.create_connection((host, port), timeout=0.2).close()
+                return server
+            except OSError:
+                time.sleep(0.1)
+        server.terminate()
+        raise CommandError(f"{options['mode']} не начал принимать соединения")
+
+    def virtual_user(self, n, transport, stats, deadline, snapshot, replay, options):
+        rnd = random.Random(options['seed'] + n)
+        client_ip = f'10.1.{n // 256 % 256}.{n % 256}'
+        offset = n * 7
+        try:
+            while time.monotonic() < deadline:
+                if replay:
+                    steps = [replay[offset % len(replay)]]
+                    offset += 1
+                elif options['scenario'] == 'catalog':
+                    steps = catalog_journey(rnd, snapshot, options['api_prefix'])
+                else:
+                    steps = synthetic_journey(rnd, snapshot, options['order_ratio'])
+                for label, method, path, body in steps:
+                    if time.monotonic() >= deadline:
+                        break
+                    started = time.perf_counter()
+                    try:
+                        status, content = transport.request(method, path, body, client_ip)
+                    except (OSError, http.client.HTTPException) as exc:
+                        stats.record(label, 'connection_error', (time.perf_counter() - started) * 1000,
+                                     error=type(exc).__name__)
+                        continue
+                    elapsed = (time.perf_counter() - started) * 1000
+                    locked = status >= 500 and LOCKED_MARKER.encode() in content
+                    stats.record(label, status, elapsed, locked=locked)
+                    if options['think_ms']:
+                        time.sleep(options['think_ms'] / 1000)
+        finally:
+            connections.close_all()
+
+    def build_report(self, stats, elapsed, options):
+        all_latencies = [v for values in stats.latencies.values() for v in values]
+        total = len(all_latencies)
+        failed = sum(count for status, count in stats.statuses.items()
+                     if not isinstance(status, int) or status >= 500)
+
+        def summary(values):
+            return {
+                'requests': len(values),
+                'p50_ms': percentile(values, 50),
+                'p90_ms': percentile(values, 90),
+                'p99_ms': percentile(values, 99),
+                'max_ms': max(values) if values else None,
+            }
+
+        return {
+            'mode': options['mode'],
+            'scenario': options['scenario'] if not options['replay'] else 'replay',
+            'api_prefix': options['api_prefix'],
+            'db_profile': options['db_profile'] or settings.SQLITE_PROFILE,
+            'workers': options['workers'] if options['mode'] != 'inprocess' else None,
+            'users': options['users'],
+            'duration_s': elapsed,
+            'requests': total,
+            'throughput_rps': total / elapsed if elapsed else 0,
+            'error_rate': failed / total if total else 0,
+            'statuses': {str(k): v for k, v in sorted(stats.statuses.items(), key=str)},
+            'errors': dict(stats.errors),
+            'latency': summary(all_latencies),
+            'endpoints': {label: summary(values) for label, values in sorted(stats.latencies.items())},
+        }
+
+    def print_report(self, report):
+        lat = report['latency']
+        self.stdout.write(
+            f"mode={report['mode']} scenario={report['scenario']} prefix={report['api_prefix']} "
+            f"db_profile={report['db_profile']} users={report['users']} "
+            f"requests={report['requests']} duration={report['duration_s']:.1f}s"
+        )
+        self.stdout.write(f"throughput: {report['throughput_rps']:.1f} req/s, "
+                          f"error rate: {report['error_rate'] * 100:.2f}%")
+        if lat['requests']:
+            self.stdout.write(f"latency: p50={lat['p50_ms']:.1f}ms p90={lat['p90_ms']:.1f}ms "
+                              f"p99={lat['p99_ms']:.1f}ms max={lat['max_ms']:.1f}ms")
+        self.stdout.write(f"statuses: {report['statuses']}")
+        if report['errors']:
+            self.stdout.write(self.style.WARNING(f"errors: {report['errors']}"))
+        self.stdout.write(f"{'endpoint':<28} {'requests':>9} {'p50 ms':>9} {'p99 ms':>9}")
+        for label, row in report['endpoints'].items():
+            self.stdout.write(f"{label:<28} {row['requests']:>9} {row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f}")
@@ -0,0 +1,59 @@
+# api/management/commands/product_documents.py
+"""
+Управление предсобранными документами карточек товаров.
+
+    python manage.py product_documents rebuild          # отсутствующие и устаревшие
+    python manage.py product_documents rebuild --all    # все товары
+    python manage.py product_documents check            # статистика устаревания
+    python manage.py product_documents check --verify 200  # сверить выборку с живой сериализацией
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from api import documents
+from api.models import Product, ProductDocument
+from api.serializers import ProductDetailSerializer
+
+
+class Command(BaseCommand):
+    help = 'Пересборка и проверка документов карточек товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['rebuild', 'check'])
+        parser.add_argument('--all', action='store_true', help='Пересобрать документы всех товаров')
+        parser.add_argument('--verify', type=int, default=0,
+                            help='Сверить N актуальных документов с текущей сериализацией')
+        parser.add_argument('--chunk-size', type=int, default=documents.REBUILD_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['action'] == 'rebuild':
+            if options['all']:
+                ids = None
+            else:
+                ids = Product.objects.filter(
+                    Q(document__isnull=True) | Q(document__is_stale=True)
+                ).values_list('pk', flat=True)
+            built = documents.rebuild_documents(ids, chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f'Пересобрано документов: {built}'))
+            return
+
+        report = documents.staleness_report()
+        for key, value in report.items():
+            self.stdout.write(f'{key}: {value}')
+
+        mismatched = []
+        if options['verify']:
+            fresh = ProductDocument.objects.filter(is_stale=False).order_by('?')[:options['verify']]
+            stored = {doc.product_id: doc.data for doc in fresh}
+            products = ProductDetailSerializer.setup_eager_loading(Product.objects.filter(pk__in=stored))
+            for product in products:
+                if documents.build_document(product) != stored[product.pk]:
+                    mismatched.append(product.pk)
+            self.stdout.write(f'verified: {len(stored)}, mismatched: {len(mismatched)}')
+
+        if report['missing'] or report['stale'] or mismatched:
+            if mismatched:
+                ProductDocument.objects.filter(product_id__in=mismatched).update(is_stale=True)
+            raise CommandError('Есть отсутствующие или устаревшие документы: выполните '
+                               '"product_documents rebuild"')
+        self.stdout.write(self.style.SUCCESS('Все документы актуальны'))
@@ -0,0 +1,25 @@
+# api/management/commands/search_index.py
+"""
+Пересборка поискового индекса товаров (ProductSearchText, ProductSearchTrigram).
+
+Обычно индекс обновляется сигналами; команда нужна после массовых операций
+в обход сигналов и после изменения правил нормализации в api/search.py.
+
+    python manage.py search_index
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = 'Пересборка поискового индекса товаров'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        indexed = search.index_products()
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано товаров: {indexed} за {time.monotonic() - started:.1f} с'
+        ))
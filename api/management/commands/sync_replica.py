@@ -0,0 +1,49 @@
+# api/management/commands/sync_replica.py
+"""
+Копирование основной БД в файл реплики (SQLITE_REPLICA_PATH) через
+online backup API SQLite: копия согласованная, основная БД во время
+копирования остается доступной на запись.
+
+    SQLITE_REPLICA_PATH=/var/lib/ncb/replica.sqlite3 python manage.py sync_replica
+    SQLITE_REPLICA_PATH=... python manage.py sync_replica --interval 5   # в цикле
+"""
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.db_routing import REPLICA_ALIAS
+
+
+class Command(BaseCommand):
+    help = 'Синхронизация файла реплики SQLite с основной БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд (0 - один раз)')
+        parser.add_argument('--pages', type=int, default=1024,
+                            help='Страниц за шаг backup (между шагами читатели не блокируются)')
+
+    def handle(self, *args, **options):
+        if REPLICA_ALIAS not in settings.DATABASES:
+            raise CommandError('Реплика не настроена: задайте SQLITE_REPLICA_PATH')
+        source_path = str(settings.DATABASES['default']['NAME'])
+        replica_path = settings.SQLITE_REPLICA_PATH
+
+        while True:
+            started = time.monotonic()
+            self.sync(source_path, replica_path, options['pages'])
+            self.stdout.write(f'Реплика обновлена за {(time.monotonic() - started) * 1000:.0f} мс')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def sync(self, source_path, replica_path, pages):
+        source = sqlite3.connect(source_path, timeout=20)
+        target = sqlite3.connect(replica_path, timeout=20)
+        try:
+            source.backup(target, pages=pages)
+        finally:
+            target.close()
+            source.close()
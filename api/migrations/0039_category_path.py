@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def fill_category_paths(apps, schema_editor):
+    """Заполняем материализованный путь для существующих категорий"""
+    Category = apps.get_model('api', 'Category')
+    children = {}
+    for pk, parent_id in Category.objects.values_list('id', 'parent_id'):
+        children.setdefault(parent_id, []).append(pk)
+
+    stack = [(pk, '') for pk in children.get(None, [])]
+    while stack:
+        pk, parent_path = stack.pop()
+        path = f'{parent_path}{pk}/'
+        Category.objects.filter(pk=pk).update(path=path)
+        stack.extend((child, path) for child in children.get(pk, []))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_contactinfo_working_hours_alter_aboutcontent_image_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255, verbose_name='Путь'),
+        ),
+        migrations.RunPython(fill_category_paths, reverse_code=migrations.RunPython.noop),
+    ]
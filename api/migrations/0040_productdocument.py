@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_category_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='api.product', verbose_name='Товар')),
+                ('data', models.JSONField(default=dict, verbose_name='Документ')),
+                ('is_stale', models.BooleanField(db_index=True, default=True, verbose_name='Требует пересборки')),
+                ('stale_since', models.DateTimeField(blank=True, null=True, verbose_name='Устарел с')),
+                ('built_at', models.DateTimeField(blank=True, null=True, verbose_name='Собран')),
+            ],
+            options={
+                'verbose_name': 'Документ товара',
+                'verbose_name_plural': 'Документы товаров',
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_feature_facets(apps, schema_editor):
+    """Первичный расчет фасетов характеристик по существующим товарам"""
+    ProductFeature = apps.get_model('api', 'ProductFeature')
+    CategoryFeatureFacet = apps.get_model('api', 'CategoryFeatureFacet')
+    rows = ProductFeature.objects.filter(
+        feature__isnull=False, value__isnull=False
+    ).values('product__category_id', 'feature_id', 'value_id').annotate(
+        product_count=Count('product_id', distinct=True)
+    ).order_by()
+    CategoryFeatureFacet.objects.bulk_create([
+        CategoryFeatureFacet(category_id=row['product__category_id'], feature_id=row['feature_id'],
+                             value_id=row['value_id'], product_count=row['product_count'])
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0041_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryFeatureFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_count', models.PositiveIntegerField(default=0, verbose_name='Товаров')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feature_facets', to='api.category', verbose_name='Категория')),
+                ('feature', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='api.feature', verbose_name='Характеристика')),
+                ('value', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='api.featurevalue', verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Фасет характеристики',
+                'verbose_name_plural': 'Фасеты характеристик',
+                'unique_together': {('category', 'feature', 'value')},
+            },
+        ),
+        migrations.RunPython(fill_feature_facets, reverse_code=migrations.RunPython.noop),
+    ]
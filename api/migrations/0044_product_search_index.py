@@ -0,0 +1,91 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:08
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Копия нормализации api/search.py на момент миграции: история не должна
+# зависеть от того, как потом изменится живой код
+
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya', 'ў': 'o', 'қ': 'q', 'ғ': 'g', 'ҳ': 'h',
+})
+
+_separators = re.compile(r'[^\w]+')
+
+
+def fold(text):
+    return _separators.sub(' ', (text or '').lower().replace('ё', 'е')).strip().translate(TRANSLIT)
+
+
+def compact(text):
+    return fold(text).replace(' ', '')
+
+
+def word_trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def index_entry(row):
+    parts = [fold(row['name']), fold(row['brand__name'])]
+    parts += [compact(row['manufacturer_sku']), compact(row['internal_sku'])]
+    text = ' '.join(part for part in parts if part)
+    trigrams = set()
+    for word in text.split():
+        trigrams |= word_trigrams(word)
+    return text, trigrams
+
+
+def fill_search_index(apps, schema_editor):
+    """Первичная индексация существующих товаров"""
+    Product = apps.get_model('api', 'Product')
+    ProductSearchText = apps.get_model('api', 'ProductSearchText')
+    ProductSearchTrigram = apps.get_model('api', 'ProductSearchTrigram')
+    texts, trigrams = [], []
+    for row in Product.objects.values('id', 'name', 'brand__name', 'manufacturer_sku', 'internal_sku'):
+        text, row_trigrams = index_entry(row)
+        texts.append(ProductSearchText(product_id=row['id'], text=text))
+        trigrams.extend(ProductSearchTrigram(product_id=row['id'], trigram=t) for t in row_trigrams)
+    ProductSearchText.objects.bulk_create(texts, batch_size=1000)
+    ProductSearchTrigram.objects.bulk_create(trigrams, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0043_product_similarity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchText',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_text', serialize=False, to='api.product', verbose_name='Товар')),
+                ('text', models.TextField(verbose_name='Текст')),
+            ],
+            options={
+                'verbose_name': 'Поисковый текст товара',
+                'verbose_name_plural': 'Поисковые тексты товаров',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSearchTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3, verbose_name='Триграмма')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_trigrams', to='api.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Триграмма товара',
+                'verbose_name_plural': 'Триграммы товаров',
+                'unique_together': {('trigram', 'product')},
+            },
+        ),
+        migrations.RunPython(fill_search_index, reverse_code=migrations.RunPython.noop),
+    ]
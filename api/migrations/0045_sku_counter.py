@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:31
+
+import re
+
+from django.db import migrations, models
+
+# копия api.models.SKU_PATTERN / parse_sku на момент миграции
+SKU_PATTERN = re.compile(r'^([A-Z0-9]{1,20})-(\d{1,18})$')
+
+
+def parse_sku(sku):
+    match = SKU_PATTERN.match(sku or '')
+    return (match.group(1), int(match.group(2))) if match else None
+
+
+def seed_counters(apps, schema_editor):
+    """Счетчики с наибольшими номерами существующих internal_sku"""
+    Product = apps.get_model('api', 'Product')
+    SkuCounter = apps.get_model('api', 'SkuCounter')
+    top = {}
+    for sku in Product.objects.exclude(internal_sku=None).values_list('internal_sku', flat=True).iterator():
+        parsed = parse_sku(sku)
+        if parsed:
+            top[parsed[0]] = max(top.get(parsed[0], 0), parsed[1])
+    SkuCounter.objects.bulk_create(
+        [SkuCounter(prefix=prefix, last_number=number) for prefix, number in top.items()], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0044_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SkuCounter',
+            fields=[
+                ('prefix', models.CharField(max_length=20, primary_key=True, serialize=False, verbose_name='Префикс')),
+                ('last_number', models.PositiveBigIntegerField(default=0, verbose_name='Последний номер')),
+            ],
+            options={
+                'verbose_name': 'Счетчик SKU',
+                'verbose_name_plural': 'Счетчики SKU',
+            },
+        ),
+        migrations.RunPython(seed_counters, reverse_code=migrations.RunPython.noop),
+    ]
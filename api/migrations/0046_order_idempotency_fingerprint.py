@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0045_sku_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='idempotency_fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Отпечаток запроса'),
+        ),
+    ]
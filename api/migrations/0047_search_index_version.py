@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0046_order_idempotency_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия поискового индекса',
+                'verbose_name_plural': 'Версия поискового индекса',
+            },
+        ),
+    ]
@@ -1,8 +1,11 @@
 #models.py
+import re
+
 from django.db import models
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.utils.text import slugify
 from django.core.validators import URLValidator
-import random
 from django.db import transaction, IntegrityError
 
 
@@ -12,6 +15,8 @@ class Category(models.Model):
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True,related_name='children',verbose_name='Родительская категория')
     image = models.ImageField(upload_to='categories/', blank=True, null=True, verbose_name='Изображение')
     order = models.IntegerField(default=0, verbose_name='Порядок сортировки')
+    # Материализованный путь из id предков, включая саму категорию: "1/5/12/"
+    path = models.CharField(max_length=255, blank=True, default='', editable=False, db_index=True, verbose_name='Путь')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -24,19 +29,53 @@ class Category(models.Model):
         if not self.slug:
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
+        self._update_path()
+
+    def _update_path(self):
+        """Пересчитать path категории и заменить префикс у всех потомков"""
+        parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+        new_path = f'{parent_path}{self.pk}/'
+        old_path = self.path
+        if new_path == old_path:
+            return
+        Category.objects.filter(pk=self.pk).update(path=new_path)
+        if old_path:
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1))
+            )
+        self.path = new_path
+
+    @property
+    def ancestor_ids(self):
+        """id предков от корня, без самой категории"""
+        return [int(pk) for pk in self.path.split('/') if pk][:-1]
+
+    def get_breadcrumbs(self):
+        """Цепочка предков от корня (id/name/slug) одним запросом по path"""
+        ids = self.ancestor_ids
+        if not ids:
+            return []
+        rows = {row['id']: row for row in Category.objects.filter(id__in=ids).values('id', 'name', 'slug')}
+        return [rows[pk] for pk in ids if pk in rows]
 
     def __str__(self):
         return self.name
 
+    def subtree_ids(self):
+        """Подзапрос id категории и всех ее потомков (по path, без обхода дерева).
+
+        Префикс всегда сравнивается с завершающим "/", чтобы 1/2 не захватывала 1/23.
+        Без path (категория из bulk_create/update в обход save) - только сама категория,
+        а не весь каталог.
+        """
+        prefix = self.path.rstrip('/')
+        if not prefix:
+            return Category.objects.filter(pk=self.pk).values('id')
+        return Category.objects.filter(Q(pk=self.pk) | Q(path__startswith=f'{prefix}/')).values('id')
+
     def get_all_products(self):
         """Получить все товары категории включая подкатегории (оптимизировано)"""
-        categories = [self]
-        children = list(self.children.all())
-        while children:
-            child = children.pop()
-            categories.append(child)
-            children.extend(list(child.children.all()))
-        return Product.objects.filter(category__in=categories).select_related(
+        return Product.objects.filter(category_id__in=self.subtree_ids()).select_related(
             'category', 'brand'
         ).prefetch_related('images')
 
@@ -71,30 +110,182 @@ class Product(models.Model):
         verbose_name_plural = 'Товары'
         ordering = ['-created_at']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # номер из БД уже учтен счетчиком (None, если поле отложено через only/defer)
+        instance._loaded_internal_sku = instance.__dict__.get('internal_sku')
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
         if not self.internal_sku:
-            # префикс: три буквы из slug категории или из названия
-            raw_prefix = (self.category.slug if self.category and self.category.slug else self.name[:3])
-            prefix = ''.join(ch for ch in raw_prefix.upper() if ch.isalnum())[:3] or 'PRD'
-
-            attempts = 0
-            while attempts < 10:
-                number = str(random.randint(0, 10**4 - 1)).zfill(4)
-                candidate = f"{prefix}-{number}"
-                if not Product.objects.filter(internal_sku=candidate).exists():
-                    self.internal_sku = candidate
-                    break
-                attempts += 1
-            else:
-                raise IntegrityError("Не удалось сгенерировать уникальный internal_sku")
-        # если internal_sku уже есть — обычное сохранение
+            prefix = self.sku_prefix(self.category.slug if self.category else '', self.name)
+            self.internal_sku = SkuCounter.allocate(prefix)[0]
+        elif self._state.adding or self.internal_sku != getattr(self, '_loaded_internal_sku', None):
+            # номер, заданный вручную, не должен потом выдаваться счетчиком
+            SkuCounter.reserve([self.internal_sku])
         super().save(*args, **kwargs)
+        self._loaded_internal_sku = self.internal_sku
+
+    @staticmethod
+    def sku_prefix(category_slug, name):
+        """Префикс internal_sku: три буквы из slug категории или из названия"""
+        raw_prefix = category_slug or name[:3]
+        return ''.join(ch for ch in raw_prefix.upper() if ch.isalnum())[:3] or 'PRD'
 
     def __str__(self):
         return self.name
 
+
+SKU_PATTERN = re.compile(r'^([A-Z0-9]{1,20})-(\d{1,18})$')
+
+
+def parse_sku(sku):
+    """'CAT-0042' -> ('CAT', 42); SKU другого вида -> None"""
+    match = SKU_PATTERN.match(sku or '')
+    return (match.group(1), int(match.group(2))) if match else None
+
+
+class SkuCounter(models.Model):
+    """Последний выданный номер internal_sku для префикса (CAT-0001, CAT-0002, ...)"""
+    prefix = models.CharField(max_length=20, primary_key=True, verbose_name='Префикс')
+    last_number = models.PositiveBigIntegerField(default=0, verbose_name='Последний номер')
+
+    class Meta:
+        verbose_name = 'Счетчик SKU'
+        verbose_name_plural = 'Счетчики SKU'
+
+    def __str__(self):
+        return f'{self.prefix}: {self.last_number}'
+
+    @staticmethod
+    def format(prefix, number):
+        return f'{prefix}-{number:04d}'
+
+    @staticmethod
+    def used_number(prefix):
+        """Наибольший номер префикса среди товаров (для счетчика, которого еще нет)"""
+        skus = Product.objects.filter(internal_sku__startswith=f'{prefix}-').values_list('internal_sku', flat=True)
+        return max((parsed[1] for parsed in map(parse_sku, skus) if parsed and parsed[0] == prefix), default=0)
+
+    @classmethod
+    def allocate(cls, prefix, count=1):
+        """Выдать count следующих internal_sku префикса (блок для массового создания).
+
+        UPDATE счетчика берет блокировку записи до конца транзакции, поэтому
+        параллельные вызовы получают непересекающиеся номера.
+        """
+        with transaction.atomic():
+            if not cls.objects.filter(prefix=prefix).update(last_number=F('last_number') + count):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(prefix=prefix, last_number=cls.used_number(prefix) + count)
+                except IntegrityError:
+                    # счетчик успел создать другой процесс
+                    cls.objects.filter(prefix=prefix).update(last_number=F('last_number') + count)
+            last = cls.objects.filter(prefix=prefix).values_list('last_number', flat=True).get()
+        return [cls.format(prefix, number) for number in range(last - count + 1, last + 1)]
+
+    @classmethod
+    def reserve(cls, skus):
+        """Сдвинуть счетчики за номера из skus, заданные вручную"""
+        top = {}
+        for parsed in map(parse_sku, skus):
+            if parsed:
+                top[parsed[0]] = max(top.get(parsed[0], 0), parsed[1])
+        for prefix, number in top.items():
+            if cls.objects.filter(prefix=prefix, last_number__lt=number).update(last_number=number):
+                continue
+            if not cls.objects.filter(prefix=prefix).exists():
+                cls.objects.get_or_create(
+                    prefix=prefix, defaults={'last_number': max(number, cls.used_number(prefix))}
+                )
+
+
+class ProductDocument(models.Model):
+    """Предсобранный JSON карточки товара (вывод ProductDetailSerializer с относительными URL)"""
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True,
+        related_name='document', verbose_name='Товар'
+    )
+    data = models.JSONField(default=dict, verbose_name='Документ')
+    is_stale = models.BooleanField(default=True, db_index=True, verbose_name='Требует пересборки')
+    stale_since = models.DateTimeField(null=True, blank=True, verbose_name='Устарел с')
+    built_at = models.DateTimeField(null=True, blank=True, verbose_name='Собран')
+
+    class Meta:
+        verbose_name = 'Документ товара'
+        verbose_name_plural = 'Документы товаров'
+
+    def __str__(self):
+        return f'Документ товара #{self.product_id}'
+
+class ProductSimilarity(models.Model):
+    """Предрасчитанный похожий товар (строится командой build_similarity, см. api/similarity.py)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similarities',
+                                verbose_name='Товар')
+    similar = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_to',
+                                verbose_name='Похожий товар')
+    score = models.FloatField(verbose_name='Оценка')
+    rank = models.PositiveSmallIntegerField(verbose_name='Позиция')
+
+    class Meta:
+        verbose_name = 'Похожий товар'
+        verbose_name_plural = 'Похожие товары'
+        unique_together = [['product', 'similar']]
+        indexes = [models.Index(fields=['product', 'rank'])]
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.similar_id} ({self.score:.3f})'
+
+
+class ProductSearchText(models.Model):
+    """Нормализованный текст товара для поиска: название, бренд и артикулы латиницей
+    (кириллица транслитерируется), см. api/search.py"""
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True,
+        related_name='search_text', verbose_name='Товар'
+    )
+    text = models.TextField(verbose_name='Текст')
+
+    class Meta:
+        verbose_name = 'Поисковый текст товара'
+        verbose_name_plural = 'Поисковые тексты товаров'
+
+    def __str__(self):
+        return self.text
+
+
+class ProductSearchTrigram(models.Model):
+    """Триграмма поискового текста товара - для поиска с опечатками"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_trigrams',
+                                verbose_name='Товар')
+    trigram = models.CharField(max_length=3, verbose_name='Триграмма')
+
+    class Meta:
+        verbose_name = 'Триграмма товара'
+        verbose_name_plural = 'Триграммы товаров'
+        unique_together = [['trigram', 'product']]
+
+    def __str__(self):
+        return f'{self.trigram!r} -> {self.product_id}'
+
+
+class SearchIndexVersion(models.Model):
+    """Версия поискового индекса - одна строка в БД, общая для всех воркеров:
+    по ней строятся ключи кэша результатов поиска (api/search.py)"""
+    version = models.PositiveBigIntegerField(default=0, verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия поискового индекса'
+        verbose_name_plural = 'Версия поискового индекса'
+
+    def __str__(self):
+        return str(self.version)
+
+
 class FeatureValue(models.Model):
     """Модель для значений характеристик"""
     category = models.ForeignKey(
@@ -168,6 +359,28 @@ class ProductFeature(models.Model):
     def __str__(self):
         return f'{self.feature.name if self.feature else "N/A"}: {self.value if self.value else "N/A"}'
 
+class CategoryFeatureFacet(models.Model):
+    """Число товаров категории (без подкатегорий) с данным значением характеристики.
+
+    Предрасчет для фасетов характеристик; пересчитывается api.facets.rebuild_feature_facets.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='feature_facets',
+                                 verbose_name='Категория')
+    feature = models.ForeignKey(Feature, on_delete=models.CASCADE, related_name='facets',
+                                verbose_name='Характеристика')
+    value = models.ForeignKey(FeatureValue, on_delete=models.CASCADE, related_name='facets',
+                              verbose_name='Значение')
+    product_count = models.PositiveIntegerField(default=0, verbose_name='Товаров')
+
+    class Meta:
+        verbose_name = 'Фасет характеристики'
+        verbose_name_plural = 'Фасеты характеристик'
+        unique_together = [['category', 'feature', 'value']]
+
+    def __str__(self):
+        return f'{self.category_id}: {self.feature_id}={self.value_id} ({self.product_count})'
+
+
 class Tag(models.Model):
     name = models.CharField(max_length=100, verbose_name='Тег')
     slug = models.SlugField(max_length=120, unique=True, blank=True)
@@ -374,6 +587,16 @@ class Order(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True)
+    # Заголовок Idempotency-Key: повтор запроса того же клиента с тем же ключом и телом
+    # возвращает этот заказ. Хранится хэш клиента и ключа (см. OrderViewSet._create_order)
+    idempotency_key = models.CharField(
+        max_length=100, unique=True, null=True, blank=True, editable=False,
+        verbose_name='Ключ идемпотентности'
+    )
+    # хэш проверенных данных запроса: повтор ключа с другим телом отклоняется
+    idempotency_fingerprint = models.CharField(
+        max_length=64, blank=True, editable=False, verbose_name='Отпечаток запроса'
+    )
 
     class Meta:
         verbose_name = 'Заказ'
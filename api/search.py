@@ -0,0 +1,587 @@
+# api/search.py
+"""
+Поиск по каталогу: нормализация и транслитерация текста, индекс с опечатками
+для параметра ?search= и подсказки (/api/search/suggest/).
+
+Текст приводится к единой форме fold(): нижний регистр, разделители -> пробел,
+кириллица -> латиница. Поэтому "самсунг" и "Samsung" дают одно и то же
+"samsung". Для каждого товара эта форма (название, бренд, артикулы) хранится в
+ProductSearchText, а ее триграммы - в ProductSearchTrigram. Точное вхождение
+ищется по полному совпадению триграмм запроса, опечатки - по неполному
+совпадению триграмм слова (search_filter); перебор текста - только для
+запросов из одной-двух букв и с ограничением SEARCH_SHORT_QUERY_LIMIT.
+Индекс обновляется после коммита изменений товара или бренда.
+
+Списки id по запросу кэшируются (cached_matching_ids) под ключом из
+нормализованного запроса и версии индекса; переиндексация меняет версию, и
+фоновый прогрев пересчитывает самые частые запросы процесса (popular_queries).
+Кэш локальный для процесса, поэтому версия хранится в БД (SearchIndexVersion,
+один запрос по первичному ключу на поиск): переиндексация через любой воркер
+сбрасывает результаты во всех.
+Списки длиннее SEARCH_RESULTS_MAX_IDS не кэшируются: широкий запрос
+фильтруется подзапросом к ProductSearchText.
+
+Подсказки строятся по индексу префиксов в памяти процесса.
+
+Индекс - отсортированный список ключей (нормализованный текст, вид, id):
+названия товаров (с каждого слова, чтобы "galaxy" находил "Samsung Galaxy"),
+артикулы, бренды и категории. Поиск - bisect до первого ключа с префиксом
+запроса и просмотр не более SUGGEST_SCAN_LIMIT соседних ключей, без БД.
+
+Изменения каталога в этом процессе (сигналы api/signals.py) применяются к
+индексу точечно при следующем запросе. Изменения через другие воркеры
+становятся видны после полной пересборки раз в SEARCH_INDEX_MAX_AGE секунд.
+Объем ограничен SEARCH_INDEX_MAX_ENTRIES ключами длиной до KEY_LENGTH.
+"""
+import bisect
+import functools
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+
+from .models import Brand, Category, Product, ProductSearchText, ProductSearchTrigram, SearchIndexVersion
+
+logger = logging.getLogger(__name__)
+
+KEY_LENGTH = 48
+SUGGEST_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+SUGGEST_SCAN_LIMIT = 200
+
+# вес вида подсказки: категории и бренды выше отдельных товаров
+KIND_WEIGHTS = {'category': 3.0, 'brand': 2.0, 'product': 1.0}
+
+# слова короче ищутся только точным вхождением
+MIN_FUZZY_LENGTH = 3
+INDEX_CHUNK_SIZE = 500
+
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya', 'ў': 'o', 'қ': 'q', 'ғ': 'g', 'ҳ': 'h',
+})
+
+_separators = re.compile(r'[^\w]+')
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е, любые разделители -> один пробел"""
+    return _separators.sub(' ', (text or '').lower().replace('ё', 'е')).strip()
+
+
+def fold(text):
+    """normalize() плюс транслитерация кириллицы: "Самсунг" -> "samsung" """
+    return normalize(text).translate(TRANSLIT)
+
+
+def compact(text):
+    """Артикул без разделителей: "AB-12 3" -> "ab123" """
+    return fold(text).replace(' ', '')
+
+
+def word_keys(text):
+    """Ключи с начала каждого слова: "samsung galaxy s21" -> [..., "galaxy s21", "s21"]"""
+    words = fold(text).split()
+    return [' '.join(words[i:])[:KEY_LENGTH] for i in range(len(words))]
+
+
+def word_trigrams(word):
+    """Триграммы слова с отступами, как в pg_trgm: "sam" -> {"  s", " sa", "sam", "am "}"""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def allowed_typos(word):
+    """Две опечатки в длинных словах, одна - в коротких и в артикулах (есть цифры)"""
+    return 1 if len(word) <= 6 or any(char.isdigit() for char in word) else 2
+
+
+def required_hits(word, trigrams):
+    """Сколько триграмм слова должно совпасть: одна опечатка меняет до трех триграмм,
+    но в любом случае не меньше половины"""
+    return max(len(trigrams) - 3 * allowed_typos(word), math.ceil(len(trigrams) / 2))
+
+
+def within_distance(a, b, limit):
+    """Расстояние Левенштейна между a и b не больше limit"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def word_positions(word, text_words):
+    """Номера слов текста, с которыми совпадает слово запроса: длинное - целиком или
+    началом с допустимыми опечатками, короткое - только как начало слова"""
+    if len(word) < MIN_FUZZY_LENGTH:
+        return {i for i, text_word in enumerate(text_words) if text_word.startswith(word)}
+    limit = allowed_typos(word)
+    return {
+        i for i, text_word in enumerate(text_words)
+        if within_distance(word, text_word, limit) or within_distance(word, text_word[:len(word)], limit)
+    }
+
+
+def word_matches(word, text_words):
+    """Слово запроса совпадает со словом текста или его началом с допустимыми опечатками"""
+    return bool(word_positions(word, text_words))
+
+
+def words_match(words, text_words):
+    """Все слова запроса совпали; короткое слово ("15" в "iphone 15") засчитывается,
+    только если стоит в тексте рядом со словом, соседним с ним в запросе - иначе
+    "b" или "1" находились бы в каждом товаре"""
+    positions = [word_positions(word, text_words) for word in words]
+    if not all(positions):
+        return False
+    for i, word in enumerate(words):
+        if len(word) >= MIN_FUZZY_LENGTH:
+            continue
+        neighbours = set()
+        if i > 0:
+            neighbours |= {p + 1 for p in positions[i - 1]}
+        if i + 1 < len(words):
+            neighbours |= {p - 1 for p in positions[i + 1]}
+        if not positions[i] & neighbours:
+            return False
+    return True
+
+
+def index_entry(row):
+    """Строка товара (name, brand__name, manufacturer_sku, internal_sku) -> (текст, триграммы)"""
+    parts = [fold(row['name']), fold(row['brand__name'])]
+    parts += [compact(row['manufacturer_sku']), compact(row['internal_sku'])]
+    text = ' '.join(part for part in parts if part)
+    trigrams = set()
+    for word in text.split():
+        trigrams |= word_trigrams(word)
+    return text, trigrams
+
+
+def _insert_trigrams(rows):
+    """(product_id, trigram) одним executemany: триграмм в десятки раз больше, чем
+    товаров, и создание объектов модели для bulk_create заметно дороже самой вставки"""
+    table = connection.ops.quote_name(ProductSearchTrigram._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} (product_id, trigram) VALUES (%s, %s)', rows)
+
+
+def index_products(product_ids=None):
+    """Пересобрать поисковый индекс товаров (или всех). Возвращает число товаров."""
+    if product_ids is None:
+        ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    else:
+        ids = sorted(product_ids)
+
+    for start in range(0, len(ids), INDEX_CHUNK_SIZE):
+        chunk_ids = ids[start:start + INDEX_CHUNK_SIZE]
+        rows = Product.objects.filter(pk__in=chunk_ids).values(
+            'id', 'name', 'brand__name', 'manufacturer_sku', 'internal_sku'
+        )
+        texts, trigrams = [], []
+        for row in rows:
+            text, row_trigrams = index_entry(row)
+            texts.append(ProductSearchText(product_id=row['id'], text=text))
+            trigrams.extend((row['id'], t) for t in row_trigrams)
+        with transaction.atomic():
+            ProductSearchText.objects.filter(product_id__in=chunk_ids).delete()
+            ProductSearchTrigram.objects.filter(product_id__in=chunk_ids).delete()
+            ProductSearchText.objects.bulk_create(texts, batch_size=1000)
+            _insert_trigrams(trigrams)
+    invalidate_results()
+    return len(ids)
+
+
+def refresh_products(product_ids):
+    """Переиндексировать товары после коммита текущей транзакции"""
+    product_ids = {pk for pk in product_ids if pk}
+    if product_ids:
+        transaction.on_commit(functools.partial(index_products, product_ids))
+
+
+def substring_trigrams(folded):
+    """Триграммы, которые обязательно есть в индексе товара, если его текст
+    содержит folded: внутренние триграммы слов, а на границах слов внутри
+    запроса - и триграммы с отступами (слово там начинается или кончается)"""
+    words = folded.split()
+    trigrams = set()
+    for i, word in enumerate(words):
+        padded = ('  ' if i > 0 else '') + word + (' ' if i < len(words) - 1 else '')
+        trigrams |= {padded[j:j + 3] for j in range(len(padded) - 2)}
+    return trigrams
+
+
+def _all_trigrams(trigrams):
+    """id товаров, у которых есть все trigrams (индекс trigram, product)"""
+    return ProductSearchTrigram.objects.filter(trigram__in=trigrams).values('product_id').annotate(
+        hits=Count('trigram')
+    ).filter(hits=len(trigrams)).values('product_id')
+
+
+def _containing(folded):
+    """Подзапрос: товары, текст которых может содержать folded (проверка - в _match).
+    Запрос из одного слова короче трех символов триграмм не дает - тогда вхождение
+    ищется перебором, но не дальше SEARCH_SHORT_QUERY_LIMIT совпадений."""
+    trigrams = substring_trigrams(folded)
+    if trigrams:
+        return _all_trigrams(trigrams)
+    limit = getattr(settings, 'SEARCH_SHORT_QUERY_LIMIT', 1000)
+    return ProductSearchText.objects.filter(text__contains=folded).values('product_id')[:limit]
+
+
+def _trigram_candidates(words):
+    """Товары, у которых для каждого слова совпало достаточно триграмм;
+    короткое слово - начало слова текста (триграммы с отступом: "  1", " 15")"""
+    candidates = Product.objects.all()
+    for word in words:
+        if len(word) < MIN_FUZZY_LENGTH:
+            candidates = candidates.filter(pk__in=_all_trigrams({f'  {word}'[j:j + 3] for j in range(len(word))}))
+            continue
+        trigrams = word_trigrams(word)
+        candidates = candidates.filter(pk__in=ProductSearchTrigram.objects.filter(trigram__in=trigrams).values(
+            'product_id'
+        ).annotate(hits=Count('trigram')).filter(hits__gte=required_hits(word, trigrams)).values('product_id'))
+    return candidates.values('pk')
+
+
+def _exact_candidates(folded, joined):
+    candidates = Q(product_id__in=_containing(folded))
+    if joined != folded:
+        candidates |= Q(product_id__in=_containing(joined))
+    return candidates
+
+
+def _match(folded):
+    """(id, 'exact' | 'fuzzy') - какие совпадения вернулись, см. matching_ids"""
+    words = folded.split()
+    joined = ''.join(words)
+
+    candidates = _exact_candidates(folded, joined)
+    # из одних коротких слов ("b-1") опечатки не ищутся: совпало бы почти все
+    fuzzy_allowed = len(joined) >= MIN_FUZZY_LENGTH and any(len(word) >= MIN_FUZZY_LENGTH for word in words)
+    if fuzzy_allowed:
+        candidates |= _fuzzy_candidates(words, joined)
+
+    exact, fuzzy = [], []
+    for product_id, text in ProductSearchText.objects.filter(candidates).values_list('product_id', 'text'):
+        text_words = text.split()
+        if folded in text or joined in text:
+            exact.append(product_id)
+        elif fuzzy_allowed and (words_match(words, text_words) or word_matches(joined, text_words)):
+            fuzzy.append(product_id)
+    return (exact, 'exact') if exact else (fuzzy, 'fuzzy')
+
+
+def _fuzzy_candidates(words, joined):
+    candidates = Q(product_id__in=_trigram_candidates(words))
+    if len(words) > 1:
+        candidates |= Q(product_id__in=_trigram_candidates([joined]))
+    return candidates
+
+
+def matching_ids(query):
+    """id товаров, подходящих под запрос: при точных совпадениях - только они,
+    иначе совпадения с опечатками.
+
+    Один запрос к БД, и кандидаты в нем выбираются по индексу триграмм: для
+    точного вхождения и начала слова - товары со всеми триграммами запроса
+    (substring_trigrams), для опечаток - с достаточной их долей. Кандидаты затем
+    проверяются вхождением или ограниченным расстоянием Левенштейна - у похожих
+    артикулов триграмм совпадает слишком много. Запрос с разделителями
+    ("BNC-000298") сверяется и как слитный артикул.
+    """
+    folded = fold(query)
+    if not folded:
+        return []
+    return _match(folded)[0]
+
+
+def broad_subquery(folded, kind):
+    """Подзапрос по индексу вместо списка id для слишком широкого запроса: кандидаты
+    по триграммам без проверки в Python - чуть шире, зато без списка из тысяч id"""
+    words = folded.split()
+    joined = ''.join(words)
+    condition = _exact_candidates(folded, joined) if kind == 'exact' else _fuzzy_candidates(words, joined)
+    return ProductSearchText.objects.filter(condition).values('product_id')
+
+
+RESULTS_PREFIX = 'search:ids'
+
+_popular = Counter()
+_popular_decayed_at = time.monotonic()
+_popular_lock = threading.Lock()
+_warm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-warmer')
+_warm_scheduled = threading.Event()
+
+
+def _results_timeout():
+    return getattr(settings, 'SEARCH_RESULTS_CACHE_TIMEOUT', 60 * 10)
+
+
+def results_version():
+    """Версия из БД (SearchIndexVersion): кэш процесса локальный, а переиндексация
+    в одном воркере должна сбрасывать результаты во всех"""
+    return SearchIndexVersion.objects.values_list('version', flat=True).first() or 0
+
+
+def results_key(folded, version):
+    """Ключ кэша по нормализованному запросу: "  Самсунг " и "samsung" дают один ключ"""
+    return f'{RESULTS_PREFIX}:{version}:{hashlib.md5(folded.encode("utf-8")).hexdigest()}'
+
+
+def record_query(folded):
+    """Скользящий счетчик запросов: раз в SEARCH_POPULAR_DECAY секунд счетчики
+    уменьшаются вдвое, редкие запросы вытесняются"""
+    global _popular_decayed_at
+    limit = getattr(settings, 'SEARCH_POPULAR_QUERIES', 200)
+    with _popular_lock:
+        _popular[folded] += 1
+        if time.monotonic() - _popular_decayed_at > getattr(settings, 'SEARCH_POPULAR_DECAY', 60 * 60):
+            for query, count in list(_popular.items()):
+                if count > 1:
+                    _popular[query] = count // 2
+                else:
+                    del _popular[query]
+            _popular_decayed_at = time.monotonic()
+        if len(_popular) > limit * 10:
+            kept = dict(_popular.most_common(limit * 5))
+            _popular.clear()
+            _popular.update(kept)
+
+
+def popular_queries(limit=None):
+    limit = limit or getattr(settings, 'SEARCH_POPULAR_QUERIES', 200)
+    with _popular_lock:
+        return [query for query, _ in _popular.most_common(limit)]
+
+
+def _cached_result(folded):
+    """Значение для кэша: список id или, если совпадений больше SEARCH_RESULTS_MAX_IDS,
+    только вид совпадений ('exact' / 'fuzzy') - фильтр тогда строится подзапросом"""
+    ids, kind = _match(folded)
+    return ids if len(ids) <= getattr(settings, 'SEARCH_RESULTS_MAX_IDS', 2000) else kind
+
+
+def cached_matching_ids(query):
+    """matching_ids с кэшем по нормализованному запросу и версии индекса.
+
+    Для широкого запроса возвращает 'exact' или 'fuzzy' вместо списка (см. _cached_result).
+    """
+    folded = fold(query)
+    if not folded:
+        return []
+    record_query(folded)
+    key = results_key(folded, results_version())
+    ids = cache.get(key)
+    if ids is None:
+        ids = _cached_result(folded)
+        cache.set(key, ids, _results_timeout())
+    return ids
+
+
+def warm_popular():
+    """Пересчитать результаты популярных запросов под текущей версией индекса"""
+    _warm_scheduled.clear()
+    version = results_version()
+    queries = popular_queries()
+    cache.set_many({results_key(query, version): _cached_result(query) for query in queries}, _results_timeout())
+    return len(queries)
+
+
+def _run_warm():
+    try:
+        warm_popular()
+    except Exception:
+        logger.exception('Search cache warm-up failed')
+    finally:
+        connection.close()
+
+
+def invalidate_results():
+    """Новая версия результатов после изменения индекса; популярные запросы
+    пересчитываются в фоне, чтобы первый посетитель не ждал"""
+    if not SearchIndexVersion.objects.update(version=F('version') + 1):
+        SearchIndexVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+    if not popular_queries(1) or _warm_scheduled.is_set():
+        return
+    _warm_scheduled.set()
+    if getattr(settings, 'SEARCH_WARM_ASYNC', True):
+        _warm_executor.submit(_run_warm)
+    else:
+        warm_popular()
+
+
+def search_filter(query):
+    """Q для фильтра ?search= по названию, бренду и артикулам: список id из кэша,
+    а для широкого запроса - подзапрос, а не IN с десятками тысяч параметров"""
+    ids = cached_matching_ids(query)
+    if isinstance(ids, str):
+        return Q(pk__in=broad_subquery(fold(query), ids))
+    return Q(pk__in=ids)
+
+
+class PrefixIndex:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = []   # отсортированные (ключ, вид, id)
+        self.objects = {}   # (вид, id) -> {'label', 'slug', 'weight', 'keys'}
+
+    def _item(self, kind, pk, label, slug, keys, weight):
+        keys = [key for key in dict.fromkeys(keys) if key]
+        self.objects[(kind, pk)] = {'label': label, 'slug': slug, 'weight': weight, 'keys': keys}
+        return [(key, kind, pk) for key in keys]
+
+    def build(self, items):
+        """Полная сборка из (вид, id, подпись, slug, ключи, вес)"""
+        entries = []
+        for item in items:
+            entries.extend(self._item(*item))
+        if len(entries) > self.max_entries:
+            logger.warning('Search index truncated: %s keys, limit %s', len(entries), self.max_entries)
+            # первые ключи объекта (с начала названия) важнее ключей с середины
+            entries.sort(key=lambda entry: self.objects[entry[1:]]['keys'].index(entry[0]))
+            entries = entries[:self.max_entries]
+        entries.sort()
+        self.entries = entries
+
+    def remove(self, kind, pk):
+        item = self.objects.pop((kind, pk), None)
+        if item is None:
+            return
+        for key in item['keys']:
+            position = bisect.bisect_left(self.entries, (key, kind, pk))
+            if position < len(self.entries) and self.entries[position] == (key, kind, pk):
+                del self.entries[position]
+
+    def add(self, kind, pk, label, slug, keys, weight):
+        self.remove(kind, pk)
+        for entry in self._item(kind, pk, label, slug, keys, weight):
+            if len(self.entries) >= self.max_entries:
+                break
+            bisect.insort(self.entries, entry)
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        prefixes = {fold(query)[:KEY_LENGTH], compact(query)[:KEY_LENGTH]} - {''}
+        scores = {}
+        for prefix in prefixes:
+            position = bisect.bisect_left(self.entries, (prefix,))
+            for key, kind, pk in self.entries[position:position + SUGGEST_SCAN_LIMIT]:
+                if not key.startswith(prefix):
+                    break
+                item = self.objects[(kind, pk)]
+                # совпадение с начала названия выше совпадения с середины
+                score = item['weight'] + (1.0 if key == item['keys'][0] else 0.0)
+                if score > scores.get((kind, pk), -1):
+                    scores[(kind, pk)] = score
+
+        ranked = sorted(scores, key=lambda obj: (-scores[obj], len(self.objects[obj]['label']),
+                                                 self.objects[obj]['label']))
+        return [
+            {'type': kind, 'id': pk, 'label': self.objects[(kind, pk)]['label'],
+             'slug': self.objects[(kind, pk)]['slug']}
+            for kind, pk in ranked[:limit]
+        ]
+
+
+def product_item(row):
+    keys = word_keys(row['name'])
+    keys += [compact(row['manufacturer_sku']), compact(row['internal_sku'])]
+    weight = KIND_WEIGHTS['product'] + (0.5 if row['is_available'] else 0.0)
+    return 'product', row['id'], row['name'], row['slug'], keys, weight
+
+
+def brand_item(row):
+    return 'brand', row['id'], row['name'], row['slug'], word_keys(row['name']), KIND_WEIGHTS['brand']
+
+
+def category_item(row):
+    return 'category', row['id'], row['name'], row['slug'], word_keys(row['name']), KIND_WEIGHTS['category']
+
+
+PRODUCT_FIELDS = ('id', 'name', 'slug', 'manufacturer_sku', 'internal_sku', 'is_available')
+SOURCES = {
+    'product': (Product, PRODUCT_FIELDS, product_item),
+    'brand': (Brand, ('id', 'name', 'slug'), brand_item),
+    'category': (Category, ('id', 'name', 'slug'), category_item),
+}
+
+
+def load_items(kind, pks=None):
+    model, fields, make_item = SOURCES[kind]
+    queryset = model.objects.all()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    return [make_item(row) for row in queryset.values(*fields)]
+
+
+_index = None
+_built_at = 0.0
+_pending = set()
+_lock = threading.Lock()
+
+
+def _max_age():
+    return getattr(settings, 'SEARCH_INDEX_MAX_AGE', 60 * 5)
+
+
+def record_change(kind, pk):
+    """Пометить объект для обновления в индексе после коммита (вызывается из сигналов)"""
+    record_changes(kind, [pk])
+
+
+def record_changes(kind, pks):
+    """То же для пачки объектов (массовые операции в обход сигналов)"""
+    changes = {(kind, pk) for pk in pks}
+
+    def remember():
+        with _lock:
+            _pending.update(changes)
+    if changes:
+        transaction.on_commit(remember)
+
+
+def _fresh_index():
+    """Полная сборка при первом обращении и по возрасту, иначе точечные обновления (под _lock)"""
+    global _index, _built_at
+    if _index is None or time.monotonic() - _built_at > _max_age():
+        _pending.clear()
+        index = PrefixIndex(getattr(settings, 'SEARCH_INDEX_MAX_ENTRIES', 200_000))
+        index.build(item for kind in SOURCES for item in load_items(kind))
+        _index, _built_at = index, time.monotonic()
+    elif _pending:
+        changes = {}
+        for kind, pk in _pending:
+            changes.setdefault(kind, set()).add(pk)
+        _pending.clear()
+        for kind, pks in changes.items():
+            for pk in pks:
+                _index.remove(kind, pk)
+            for item in load_items(kind, pks):
+                _index.add(*item)
+    return _index
+
+
+def suggest(query, limit=SUGGEST_LIMIT):
+    if not fold(query):
+        return []
+    with _lock:
+        return _fresh_index().suggest(query, limit)
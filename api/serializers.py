@@ -1,5 +1,10 @@
 # api/serializers.py
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Prefetch
 from rest_framework import serializers
+from .cart import MAX_CART_LINES, MAX_LINE_QUANTITY, quote_cart, order_items_from_quote
 from .models import (
     Category, Product, Image, Feature, ProductFeature, FeatureValue,
     NewsItem, AboutContent, ContactInfo, ContactMessage, Brand,
@@ -8,6 +13,59 @@ from .models import (
 )
 
 
+def parse_field_selection(request):
+    """?fields=a,b и ?omit=c -> (fields | None, omit) или None, если выбор полей не задан"""
+    if request is None:
+        return None
+    params = getattr(request, 'query_params', request.GET)
+    fields = frozenset(f.strip() for f in params.get('fields', '').split(',') if f.strip())
+    omit = frozenset(f.strip() for f in params.get('omit', '').split(',') if f.strip())
+    if not fields and not omit:
+        return None
+    return (fields or None, omit)
+
+
+def apply_field_selection(names, selection):
+    if selection is None:
+        return set(names)
+    fields, omit = selection
+    return {name for name in names if (fields is None or name in fields) and name not in omit}
+
+
+class SparseFieldsMixin:
+    """Выбор полей ответа через ?fields= / ?omit=.
+
+    Применяется только к корневому сериализатору (или дочернему many=True),
+    вложенные сериализаторы отдаются целиком. Выбор можно передать явно через
+    context['field_selection'] - так делают viewset'ы без request в контексте.
+    """
+
+    @property
+    def field_selection(self):
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if parent is not None:
+            return None
+        if 'field_selection' in self.context:
+            return self.context['field_selection']
+        return parse_field_selection(self.context.get('request'))
+
+    @property
+    def _readable_fields(self):
+        selection = self.field_selection
+        if selection is None:
+            yield from super()._readable_fields
+            return
+        allowed = apply_field_selection(self.fields.keys(), selection)
+        for field in super()._readable_fields:
+            if field.field_name in allowed:
+                yield field
+
+    @classmethod
+    def requested_fields(cls, request):
+        """Имена полей, которые попадут в ответ - для отсечения join'ов и prefetch'ей"""
+        return apply_field_selection(cls.Meta.fields, parse_field_selection(request))
+
+
 class BannerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Banner
@@ -73,7 +131,7 @@ class ProductFeatureSerializer(serializers.ModelSerializer):
             return obj.value.value
         return None
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     children = serializers.SerializerMethodField()
     products_count = serializers.SerializerMethodField()
     
@@ -83,7 +141,9 @@ class CategorySerializer(serializers.ModelSerializer):
     
     def get_children(self, obj):
         children = obj.children.all().order_by('order', 'name')
-        return CategorySerializer(children, many=True, context=self.context).data
+        # Дочерние категории отдаются с тем же набором полей, что и родитель
+        context = {**self.context, 'field_selection': self.field_selection}
+        return CategorySerializer(children, many=True, context=context).data
     
     def get_products_count(self, obj):
         # Use annotated value from viewset when available (avoids N+1 query)
@@ -91,7 +151,7 @@ class CategorySerializer(serializers.ModelSerializer):
             return obj.direct_products_count
         return obj.products.count()
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Облегченный сериализатор для списка - минимум данных для быстрой загрузки"""
     images = serializers.SerializerMethodField()
     main_image = serializers.SerializerMethodField()
@@ -106,6 +166,17 @@ class ProductListSerializer(serializers.ModelSerializer):
             'manufacturer_sku', 'internal_sku'
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        """join'ы и prefetch только для запрошенных полей"""
+        fields = set(ProductListSerializer.Meta.fields) if fields is None else fields
+        related = [name for name, field in (('category', 'category_name'), ('brand', 'brand_name'))
+                   if field in fields]
+        queryset = queryset.select_related(None).select_related(*related)
+        if fields & {'images', 'main_image'}:
+            return queryset.prefetch_related('images')
+        return queryset.prefetch_related(None)
+
     def get_images(self, obj):
         """Только первое изображение для списка"""
         images = list(obj.images.all())
@@ -122,7 +193,7 @@ class ProductListSerializer(serializers.ModelSerializer):
         main = next((img for img in images if img.is_main), images[0])
         return ImageSerializer(main, context=self.context).data
 
-class BrandSerializer(serializers.ModelSerializer):
+class BrandSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # expose `image` property (frontend expects `image`) while the model field is `logo`
     image = serializers.SerializerMethodField()
 
@@ -140,7 +211,7 @@ class BrandSerializer(serializers.ModelSerializer):
                 return str(obj.logo)
         return None
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ImageSerializer(many=True, read_only=True)
     features = ProductFeatureSerializer(many=True, required=False)
     category = CategorySerializer(read_only=True)
@@ -154,6 +225,21 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         fields = ['id', 'brand', 'brand_id', 'name', 'slug', 'description', 'price',
             'is_available', 'category', 'category_id', 'images', 'features',
             'manufacturer_sku', 'internal_sku', 'tag_groups', 'created_at', 'updated_at']
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        """Фиксированный план загрузки: images, features и tag_groups (+ теги) - по одному запросу.
+        Если задан fields, загружается только то, что попадет в ответ."""
+        plan = {
+            'images': 'images',
+            'features': Prefetch('features', queryset=ProductFeature.objects.select_related('feature', 'value')),
+            'tag_groups': Prefetch('tag_groups', queryset=ProductTagGroup.objects.prefetch_related('tags')),
+        }
+        if fields is None:
+            return queryset.select_related('category', 'brand').prefetch_related(*plan.values())
+        related = [name for name in ('category', 'brand') if name in fields]
+        queryset = queryset.select_related(None).select_related(*related)
+        return queryset.prefetch_related(None).prefetch_related(*(lookup for name, lookup in plan.items() if name in fields))
     
     def create(self, validated_data):
         features_data = validated_data.pop('features', [])
@@ -183,6 +269,22 @@ class ProductDetailSerializer(serializers.ModelSerializer):
                     value=value
                 )
 
+class ProductLeanDetailSerializer(ProductDetailSerializer):
+    """Облегченная карточка товара: категория без поддерева + хлебные крошки по Category.path"""
+    category = serializers.SerializerMethodField()
+    breadcrumbs = serializers.SerializerMethodField()
+
+    class Meta(ProductDetailSerializer.Meta):
+        fields = ProductDetailSerializer.Meta.fields + ['breadcrumbs']
+
+    def get_category(self, obj):
+        category = obj.category
+        return {'id': category.id, 'name': category.name, 'slug': category.slug}
+
+    def get_breadcrumbs(self, obj):
+        return obj.category.get_breadcrumbs()
+
+
 class NewsItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = NewsItem
@@ -227,19 +329,29 @@ class ProductQuestionSerializer(serializers.ModelSerializer):
 
 # ============ ADMIN SERIALIZERS ============
 
-class CategoryAdminSerializer(serializers.ModelSerializer):
+class CategoryAdminSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     products_count = serializers.SerializerMethodField()
     parent_name = serializers.CharField(source='parent.name', read_only=True)
     
     class Meta:
         model = Category
         fields = ['id', 'name', 'slug', 'parent', 'parent_name', 'image', 'order', 'products_count']
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields):
+        if 'parent_name' in fields:
+            queryset = queryset.select_related('parent')
+        if 'products_count' in fields:
+            queryset = queryset.annotate(annotated_products_count=Count('products', distinct=True))
+        return queryset
     
     def get_products_count(self, obj):
+        if hasattr(obj, 'annotated_products_count'):
+            return obj.annotated_products_count
         return obj.products.count()
 
 
-class ProductAdminSerializer(serializers.ModelSerializer):
+class ProductAdminSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     brand_name = serializers.CharField(source='brand.name', read_only=True)
     images_count = serializers.SerializerMethodField()
@@ -256,14 +368,29 @@ class ProductAdminSerializer(serializers.ModelSerializer):
             'brand', 'brand_name', 'is_available', 'manufacturer_sku', 'internal_sku',
             'created_at', 'images_count', 'main_image', 'images', 'features', 'tag_groups'
         ]
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields):
+        """Загрузить inline-данные одним prefetch на связь, и только для запрошенных полей"""
+        related = [name for name, field in (('category', 'category_name'), ('brand', 'brand_name'))
+                   if field in fields]
+        queryset = queryset.select_related(None).select_related(*related)
+        lookups = []
+        if fields & {'images_count', 'main_image', 'images'}:
+            lookups.append('images')
+        if 'features' in fields:
+            lookups.append(Prefetch('features', queryset=ProductFeature.objects.select_related('feature', 'value')))
+        if 'tag_groups' in fields:
+            lookups.append(Prefetch('tag_groups', queryset=ProductTagGroup.objects.select_related(
+                'group_name').prefetch_related('tags')))
+        return queryset.prefetch_related(*lookups)
     
     def get_images_count(self, obj):
-        return obj.images.count()
+        return len(obj.images.all())
     
     def get_main_image(self, obj):
-        main = obj.images.filter(is_main=True).first()
-        if not main:
-            main = obj.images.first()
+        images = list(obj.images.all())
+        main = next((img for img in images if img.is_main), images[0] if images else None)
         if main and main.image:
             request = self.context.get('request')
             try:
@@ -280,38 +407,47 @@ class ProductAdminSerializer(serializers.ModelSerializer):
             'image': request.build_absolute_uri(img.image.url) if img.image and request else (img.image.url if img.image else None),
             'is_main': img.is_main,
             'order': img.order
-        } for img in obj.images.all().order_by('order')]
+        } for img in obj.images.all()]
     
     def get_features(self, obj):
+        # .all() использует prefetch из setup_eager_loading, если он был
         return [{
             'id': pf.id,
             'feature_id': pf.feature_id,
             'feature_name': pf.feature.name if pf.feature else None,
             'value_id': pf.value_id,
             'value_text': pf.value.value if pf.value else None
-        } for pf in obj.features.all().select_related('feature', 'value')]
+        } for pf in obj.features.all()]
     
     def get_tag_groups(self, obj):
         result = []
-        for tg in obj.tag_groups.all().prefetch_related('tags'):
+        for tg in obj.tag_groups.all():
             result.append({
                 'id': tg.id,
                 'group_name_id': tg.group_name_id,
                 'group_name_text': tg.group_name.name if tg.group_name else None,
-                'tag_ids': list(tg.tags.values_list('id', flat=True))
+                'tag_ids': [tag.id for tag in tg.tags.all()]
             })
         return result
 
 
-class BrandAdminSerializer(serializers.ModelSerializer):
+class BrandAdminSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     products_count = serializers.SerializerMethodField()
     logo_url = serializers.SerializerMethodField()
     
     class Meta:
         model = Brand
         fields = ['id', 'name', 'slug', 'logo', 'logo_url', 'description', 'created_at', 'products_count']
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields):
+        if 'products_count' in fields:
+            queryset = queryset.annotate(annotated_products_count=Count('products', distinct=True))
+        return queryset
     
     def get_products_count(self, obj):
+        if hasattr(obj, 'annotated_products_count'):
+            return obj.annotated_products_count
         return obj.products.count()
     
     def get_logo_url(self, obj):
@@ -522,12 +658,54 @@ class OrderSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        for item_data in items_data:
-            OrderItem.objects.create(order=order, **item_data)
+        with transaction.atomic():
+            order = Order.objects.create(**validated_data)
+            OrderItem.objects.bulk_create([OrderItem(order=order, **item_data) for item_data in items_data])
         return order
 
 
+class CartItemSerializer(serializers.Serializer):
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_LINE_QUANTITY)
+
+
+class CartQuoteSerializer(serializers.Serializer):
+    items = CartItemSerializer(many=True, allow_empty=False, max_length=MAX_CART_LINES)
+
+
+class OrderCheckoutSerializer(serializers.ModelSerializer):
+    """Оформление заказа по корзине: клиент передает только товары и количество,
+    цена, название и артикул фиксируются из каталога"""
+    items = CartItemSerializer(many=True, allow_empty=False, max_length=MAX_CART_LINES)
+
+    class Meta:
+        model = Order
+        fields = ['customer_name', 'customer_phone', 'customer_email', 'comment', 'items']
+
+    def validate(self, attrs):
+        quote = quote_cart(attrs['items'])
+        if not quote['is_valid']:
+            raise serializers.ValidationError({'items': quote['errors']})
+        attrs['quote'] = quote
+        return attrs
+
+    def create(self, validated_data):
+        validated_data.pop('items')
+        quote = validated_data.pop('quote')
+        with transaction.atomic():
+            order = Order.objects.create(**validated_data)
+            OrderItem.objects.bulk_create(order_items_from_quote(order, quote))
+        return order
+
+    def to_representation(self, instance):
+        data = OrderSerializer(instance, context=self.context).data
+        data['total'] = str(sum(
+            (Decimal(item['price']) * item['quantity'] for item in data['items'] if item['price'] is not None),
+            Decimal('0.00'),
+        ))
+        return data
+
+
 class OrderAdminSerializer(OrderSerializer):
     """Сериализатор для администратора - включает статус"""
     class Meta(OrderSerializer.Meta):
@@ -0,0 +1,139 @@
+# api/signals.py
+"""Инвалидация производных данных каталога при изменении моделей"""
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+
+from . import documents, facets, home, search
+from .models import (
+    Product, Image, ProductFeature, ProductTagGroup, Brand, Category,
+    Feature, FeatureValue, Tag, Banner, NewsItem, ContactInfo, AboutContent
+)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance, **kwargs):
+    if instance.pk:
+        instance._previous_category_id = Product.objects.filter(
+            pk=instance.pk
+        ).values_list('category_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    documents.mark_stale([instance.pk])
+    home.invalidate('products')
+    previous_category_id = getattr(instance, '_previous_category_id', None)
+    # products_count категорий меняется только при создании или переносе товара
+    if created or previous_category_id != instance.category_id:
+        home.invalidate('categories')
+        documents.mark_category_id_stale(instance.category_id)
+        if previous_category_id and previous_category_id != instance.category_id:
+            documents.mark_category_id_stale(previous_category_id)
+        if not created:
+            facets.refresh_feature_facets([previous_category_id, instance.category_id])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    documents.mark_category_id_stale(instance.category_id)
+    facets.refresh_feature_facets([instance.category_id])
+    home.invalidate('products', 'categories')
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_delete, sender=ProductFeature)
+@receiver(post_save, sender=ProductTagGroup)
+@receiver(post_delete, sender=ProductTagGroup)
+def product_relation_changed(sender, instance, **kwargs):
+    documents.mark_stale([instance.product_id])
+    if sender is Image:
+        home.invalidate('products')
+    elif sender is ProductFeature:
+        facets.refresh_feature_facets(
+            Product.objects.filter(pk=instance.product_id).values_list('category_id', flat=True)
+        )
+
+
+@receiver(m2m_changed, sender=ProductTagGroup.tags.through)
+def product_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance - Tag, pk_set - id групп тегов
+        groups = ProductTagGroup.objects.filter(pk__in=pk_set or [])
+        documents.mark_stale(groups.values_list('product_id', flat=True))
+    else:
+        documents.mark_stale([instance.product_id])
+
+
+@receiver(post_save, sender=Brand)
+def brand_saved(sender, instance, **kwargs):
+    documents.mark_stale(instance.products.values_list('pk', flat=True))
+    home.invalidate('products')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    # path здесь еще старый: помечаем прежних предков и цепочку нового родителя
+    documents.mark_category_stale(instance)
+    if instance.parent_id:
+        documents.mark_category_id_stale(instance.parent_id)
+    home.invalidate('categories', 'products')
+
+
+@receiver(post_save, sender=Feature)
+def feature_saved(sender, instance, **kwargs):
+    documents.mark_stale(instance.product_features.values_list('product_id', flat=True))
+
+
+@receiver(post_save, sender=FeatureValue)
+def feature_value_saved(sender, instance, **kwargs):
+    documents.mark_stale(instance.product_features.values_list('product_id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, **kwargs):
+    documents.mark_stale(
+        instance.producttaggroup_tags.values_list('product_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def search_object_changed(sender, instance, **kwargs):
+    search.record_change(sender._meta.model_name, instance.pk)
+    if sender is Product and kwargs.get('signal') is post_save:
+        search.refresh_products([instance.pk])
+    elif sender is Brand and kwargs.get('signal') is post_save:
+        search.refresh_products(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def banner_changed(sender, instance, **kwargs):
+    home.invalidate('banners')
+
+
+@receiver(post_save, sender=NewsItem)
+@receiver(post_delete, sender=NewsItem)
+def news_changed(sender, instance, **kwargs):
+    home.invalidate('news')
+
+
+@receiver(post_save, sender=ContactInfo)
+@receiver(post_delete, sender=ContactInfo)
+def contact_info_changed(sender, instance, **kwargs):
+    home.invalidate('contact')
+
+
+@receiver(post_save, sender=AboutContent)
+@receiver(post_delete, sender=AboutContent)
+def about_changed(sender, instance, **kwargs):
+    home.invalidate('about')
@@ -0,0 +1,131 @@
+# api/similarity.py
+"""
+Индекс похожих товаров (ProductSimilarity).
+
+Каждый товар описывается разреженным вектором признаков: теги, значения
+характеристик, бренд и категория. Вес признака - вес его вида, умноженный
+на IDF внутри корневого раздела каталога (редкий общий тег говорит о
+сходстве больше, чем бренд, который есть у половины раздела). Сходство -
+косинус векторов плюс близость цен.
+
+Скалярные произведения считаются по инвертированному индексу: для товара
+обходятся только списки товаров с общими признаками, без перебора всех
+пар раздела. В индекс попадают top-K доступных соседей каждого товара;
+similar_products читает их одним запросом, а для товаров, которых еще нет
+в индексе, возвращает товары той же категории.
+
+    python manage.py build_similarity            # полный пересчет
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Product, ProductFeature, ProductSimilarity, ProductTagGroup
+
+SIMILAR_TOP_K = 12
+
+# веса видов признаков: тег, значение характеристики, бренд, категория
+FEATURE_WEIGHTS = {'tag': 1.0, 'value': 1.5, 'brand': 0.75, 'category': 0.5}
+PRICE_WEIGHT = 0.5
+
+# признаки, встречающиеся чаще, не используются для поиска кандидатов
+MAX_POSTING_SIZE = 5000
+WRITE_CHUNK_SIZE = 500
+
+
+def load_vectors():
+    """{id: строка товара} и {id: множество признаков} тремя запросами"""
+    products = {
+        row['id']: row for row in Product.objects.values(
+            'id', 'category_id', 'category__path', 'brand_id', 'price', 'is_available'
+        )
+    }
+    tokens = defaultdict(set)
+    for product_id, product in products.items():
+        tokens[product_id].add(('category', product['category_id']))
+        if product['brand_id']:
+            tokens[product_id].add(('brand', product['brand_id']))
+    tag_rows = ProductTagGroup.tags.through.objects.values_list('producttaggroup__product_id', 'tag_id')
+    for product_id, tag_id in tag_rows:
+        tokens[product_id].add(('tag', tag_id))
+    value_rows = ProductFeature.objects.filter(value__isnull=False).values_list('product_id', 'value_id')
+    for product_id, value_id in value_rows:
+        tokens[product_id].add(('value', value_id))
+    return products, tokens
+
+
+def price_proximity(a, b):
+    if not a or not b:
+        return 0.0
+    a, b = float(a), float(b)
+    return 1.0 - abs(a - b) / max(a, b)
+
+
+def score_scope(product_ids, products, tokens, top_k):
+    """Соседи товаров одного корневого раздела: {id: [(оценка, id соседа), ...]}"""
+    postings = defaultdict(list)
+    for product_id in product_ids:
+        if products[product_id]['is_available']:
+            for token in tokens[product_id]:
+                postings[token].append(product_id)
+
+    total = len(product_ids)
+    weights = {
+        token: FEATURE_WEIGHTS[token[0]] * math.log(1 + total / len(ids))
+        for token, ids in postings.items()
+    }
+    norms = {
+        product_id: math.sqrt(sum(weights.get(token, 0.0) ** 2 for token in tokens[product_id])) or 1.0
+        for product_id in product_ids
+    }
+
+    neighbors = {}
+    for product_id in product_ids:
+        dots = defaultdict(float)
+        for token in tokens[product_id]:
+            ids = postings.get(token, ())
+            if not ids or len(ids) > MAX_POSTING_SIZE:
+                continue
+            weight = weights[token] ** 2
+            for other_id in ids:
+                dots[other_id] += weight
+        dots.pop(product_id, None)
+
+        price = products[product_id]['price']
+        scored = (
+            (dot / (norms[product_id] * norms[other_id])
+             + PRICE_WEIGHT * price_proximity(price, products[other_id]['price']), other_id)
+            for other_id, dot in dots.items()
+        )
+        neighbors[product_id] = heapq.nlargest(top_k, scored)
+    return neighbors
+
+
+def build_similarity(top_k=SIMILAR_TOP_K):
+    """Пересчитать индекс для всех товаров. Возвращает число записанных строк."""
+    products, tokens = load_vectors()
+    scopes = defaultdict(list)
+    for product_id, product in products.items():
+        scopes[(product['category__path'] or '').split('/')[0]].append(product_id)
+
+    neighbors = {}
+    for product_ids in scopes.values():
+        neighbors.update(score_scope(product_ids, products, tokens, top_k))
+
+    # пачками по товарам: читатели видят либо старый, либо новый список товара целиком
+    ids = sorted(products)
+    written = 0
+    for start in range(0, len(ids), WRITE_CHUNK_SIZE):
+        chunk_ids = ids[start:start + WRITE_CHUNK_SIZE]
+        rows = [
+            ProductSimilarity(product_id=product_id, similar_id=other_id, score=score, rank=rank)
+            for product_id in chunk_ids
+            for rank, (score, other_id) in enumerate(neighbors[product_id])
+        ]
+        with transaction.atomic():
+            ProductSimilarity.objects.filter(product_id__in=chunk_ids).delete()
+            ProductSimilarity.objects.bulk_create(rows, batch_size=1000)
+        written += len(rows)
+    return written
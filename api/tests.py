@@ -1,3 +1,899 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import threading
+import warnings
+
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import openpyxl
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from rest_framework.throttling import AnonRateThrottle
+
+from . import bulk, cards, catalog_import, db_routing, documents, export, facets, search, similarity, writes
+from .models import (
+    Brand, Category, CategoryFeatureFacet, ContactMessage, Feature, FeatureValue, Image, Order, OrderItem,
+    Product, ProductFeature, ProductSimilarity, ProductTagGroup, SearchIndexVersion, SkuCounter, Tag, TagName
+)
+
+
+def create_product(**kwargs):
+    category = Category.objects.create(name='Категория', slug='category')
+    brand = Brand.objects.create(name='Бренд', slug='brand')
+    defaults = {'name': 'Товар', 'slug': 'product', 'category': category, 'brand': brand, 'price': '150.00'}
+    defaults.update(kwargs)
+    return Product.objects.create(**defaults)
+
+
+def order_payload(product):
+    return {
+        'customer_name': 'Покупатель',
+        'customer_phone': '+998900000000',
+        'items': [
+            {'product': product.pk, 'product_name': product.name, 'product_sku': product.internal_sku,
+             'price': '150.00', 'quantity': 2},
+            {'product': product.pk, 'product_name': product.name, 'product_sku': product.internal_sku,
+             'price': '150.00', 'quantity': 1},
+        ],
+    }
+
+
+class OrderIdempotencyTests(TestCase):
+    def setUp(self):
+        self.product = create_product()
+
+    def post(self, key=None, ip='10.0.0.1', payload=None):
+        headers = {'HTTP_X_FORWARDED_FOR': ip}
+        if key:
+            headers['HTTP_IDEMPOTENCY_KEY'] = key
+        return Client().post('/api/orders/', json.dumps(payload or order_payload(self.product)),
+                             content_type='application/json', **headers)
+
+    def test_items_are_created(self):
+        response = self.post()
+        self.assertEqual(response.status_code, 201)
+        # повторы одного товара объединяются в одну позицию (quote_cart)
+        item = OrderItem.objects.get(order_id=response.json()['id'])
+        self.assertEqual(item.quantity, 3)
+
+    def test_repeated_key_returns_original_order(self):
+        first = self.post(key='retry-1')
+        second = self.post(key='retry-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(first.json()['id'], second.json()['id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 1)
+
+    def test_requests_without_key_are_not_deduplicated(self):
+        self.post()
+        self.post()
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_same_key_with_different_body_is_rejected(self):
+        self.post(key='retry-2')
+        payload = order_payload(self.product)
+        payload['customer_name'] = 'Другой покупатель'
+        response = self.post(key='retry-2', payload=payload)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_invalid_body_is_not_replayed(self):
+        self.post(key='retry-3')
+        payload = order_payload(self.product)
+        del payload['customer_phone']
+        self.assertEqual(self.post(key='retry-3', payload=payload).status_code, 400)
+
+    def test_key_is_scoped_to_client(self):
+        first = self.post(key='shared-key', ip='10.0.0.2')
+        second = self.post(key='shared-key', ip='10.0.0.3')
+        self.assertEqual(second.status_code, 201)
+        self.assertNotEqual(first.json()['id'], second.json()['id'])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_expired_key_creates_new_order(self):
+        first = self.post(key='retry-4')
+        Order.objects.filter(pk=first.json()['id']).update(created_at=F('created_at') - timedelta(days=2))
+        with self.settings(IDEMPOTENCY_KEY_TTL=60 * 60):
+            second = self.post(key='retry-4')
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertIsNone(Order.objects.get(pk=first.json()['id']).idempotency_key)
+
+
+
+class OrderPricingTests(TestCase):
+    """Заказ покупателя и расчет корзины - только по ценам каталога"""
+
+    def setUp(self):
+        self.product = create_product(internal_sku='CAT-0042')
+        self.client = Client(HTTP_X_FORWARDED_FOR='10.0.4.1')
+
+    def post(self, url, payload):
+        return self.client.post(url, json.dumps(payload), content_type='application/json')
+
+    def test_tampered_price_is_ignored(self):
+        payload = order_payload(self.product)
+        for item in payload['items']:
+            item.update(price='0.01', product_name='Подделка', product_sku='FAKE')
+        for url in ('/api/orders/', '/api/orders/checkout/'):
+            response = self.post(url, payload)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json()['total'], '450.00')
+            item = OrderItem.objects.get(order_id=response.json()['id'])
+            self.assertEqual((item.price, item.product_name, item.product_sku),
+                             (Decimal('150.00'), 'Товар', 'CAT-0042'))
+
+    def test_quote_uses_current_catalog_price(self):
+        # в корзине клиента осталась старая цена
+        Product.objects.filter(pk=self.product.pk).update(price='175.00')
+        response = self.post('/api/cart/quote/', {'items': [{'product': self.product.pk, 'quantity': 2,
+                                                             'price': '150.00'}]})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['items'][0]['price'], data['total'], data['is_valid']), ('175.00', '350.00', True))
+        order = self.post('/api/orders/checkout/', order_payload(self.product)).json()
+        self.assertEqual(order['total'], '525.00')
+
+    def test_unavailable_product_is_rejected(self):
+        Product.objects.filter(pk=self.product.pk).update(is_available=False)
+        quote = self.post('/api/cart/quote/', {'items': [{'product': self.product.pk, 'quantity': 1}]}).json()
+        self.assertFalse(quote['is_valid'])
+        self.assertEqual(quote['errors'][0]['code'], 'unavailable')
+        for url in ('/api/orders/', '/api/orders/checkout/'):
+            response = self.post(url, order_payload(self.product))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['items'][0]['code'], 'unavailable')
+        self.assertFalse(Order.objects.exists())
+
+
+class AsyncCatalogViewTests(TestCase):
+    """/api/async/... разбирают параметры так же, как синхронные endpoint'ы"""
+
+    def setUp(self):
+        self.product = create_product()
+        Brand.objects.create(name='Пустой', slug='empty')
+
+    def get(self, url, ip='10.0.2.1'):
+        return Client().get(url, HTTP_X_FORWARDED_FOR=ip)
+
+    def test_product_list_fields(self):
+        response = self.get('/api/async/products/?fields=id,name')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [{'id': self.product.pk, 'name': 'Товар'}])
+
+    def test_product_detail_lean_and_fields(self):
+        lean = self.get(f'/api/async/products/{self.product.slug}/?detail=lean').json()
+        self.assertIn('breadcrumbs', lean)
+        self.assertEqual(lean['category'], {'id': self.product.category_id, 'name': 'Категория', 'slug': 'category'})
+        fields = self.get(f'/api/async/products/{self.product.slug}/?fields=id,slug').json()
+        self.assertEqual(fields, {'id': self.product.pk, 'slug': 'product'})
+
+    def test_brand_filters(self):
+        names = [b['name'] for b in self.get('/api/async/brands/').json()['results']]
+        self.assertEqual(names, ['Бренд', 'Пустой'])
+        names = [b['name'] for b in self.get('/api/async/brands/?has_products=1').json()['results']]
+        self.assertEqual(names, ['Бренд'])
+        names = [b['name'] for b in self.get('/api/async/brands/?ordering=-name').json()['results']]
+        self.assertEqual(names, ['Пустой', 'Бренд'])
+
+    def test_category_limit(self):
+        Category.objects.create(name='Вторая', slug='second')
+        data = self.get('/api/async/categories/?limit=1&fields=slug').json()
+        self.assertEqual(data['count'], 1)
+
+    def test_throttled(self):
+        with mock.patch.object(AnonRateThrottle, 'THROTTLE_RATES', {'anon': '1/hour', 'user': None}):
+            self.assertEqual(self.get('/api/async/brands/', ip='10.0.2.2').status_code, 200)
+            response = self.get('/api/async/brands/', ip='10.0.2.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+
+class SearchMatchingTests(TestCase):
+    def setUp(self):
+        create_product(name='Apple iPhone 15 Pro', slug='iphone-15', internal_sku='APL-0001')
+        search.index_products()
+
+    def test_short_word_must_follow_its_neighbour(self):
+        self.assertTrue(search.words_match(['iphone', '15'], 'apple iphone 15 pro'.split()))
+        self.assertFalse(search.words_match(['iphone', '15'], 'apple iphone pro 15'.split()))
+        self.assertFalse(search.words_match(['iphone', 'b'], 'apple iphone 15 pro'.split()))
+
+    def test_short_words_only_match_exactly(self):
+        self.assertEqual(search.matching_ids('b-1'), [])
+        self.assertEqual(len(search.matching_ids('15 pro')), 1)
+
+    def test_typo_with_short_word(self):
+        self.assertEqual(len(search.matching_ids('ipone 15')), 1)
+
+    def test_exact_match_uses_trigram_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(search.matching_ids('iphone 15 p')), 1)
+        self.assertNotIn('LIKE', ' '.join(q['sql'] for q in queries.captured_queries))
+        self.assertEqual(search.matching_ids('phone 15 pr'), search.matching_ids('iphone'))
+        self.assertEqual(search.matching_ids('phone 16'), [])
+
+    @override_settings(SEARCH_SHORT_QUERY_LIMIT=1)
+    def test_one_letter_query_is_bounded(self):
+        Product.objects.create(name='Apple Watch', slug='watch', category=Category.objects.get())
+        search.index_products()
+        self.assertEqual(len(search.matching_ids('a')), 1)
+
+    def test_version_bump_from_another_worker_resets_results(self):
+        self.assertEqual(len(search.cached_matching_ids('watch')), 0)
+        # другой воркер переиндексировал товар: его локальный кэш нам не виден, версия в БД - видна
+        Product.objects.filter(name__startswith='Apple').update(name='Apple Watch')
+        with mock.patch.object(search, 'invalidate_results'):
+            search.index_products()
+        SearchIndexVersion.objects.update(version=F('version') + 1)
+        self.assertEqual(len(search.cached_matching_ids('watch')), 1)
+
+    @override_settings(SEARCH_RESULTS_MAX_IDS=0)
+    def test_broad_query_uses_subquery(self):
+        cache.clear()
+        for query in ('iphone', 'ipone'):
+            condition = search.search_filter(query)
+            self.assertNotIsInstance(condition.children[0][1], list)
+            self.assertEqual(Product.objects.filter(condition).count(), 1)
+
+
+
+def csv_content(*rows):
+    stream = io.StringIO()
+    csv.writer(stream).writerows(rows)
+    return stream.getvalue().encode('utf-8')
+
+
+def export_rows():
+    """Выгрузка CSV без служебных колонок (id, даты), по internal_sku"""
+    lines = list(csv.reader(''.join(export.iter_csv(export.iter_records())).splitlines()))
+    header, rows = lines[0], lines[1:]
+    keep = [i for i, column in enumerate(header) if column not in ('id', 'created_at', 'updated_at')]
+    return sorted([row[i] for i in keep] for row in rows)
+
+
+class CatalogImportParseTests(TestCase):
+    columns = {'internal_sku', 'name', 'price', 'is_available', 'features', 'tags'}
+
+    def test_parse_pairs(self):
+        self.assertEqual(catalog_import.parse_pairs('Цвет: Черный; Память: 8 ГБ;', True),
+                         [('Цвет', 'Черный'), ('Память', '8 ГБ')])
+        self.assertEqual(catalog_import.parse_pairs('новинка; Сезон: лето', False),
+                         [(None, 'новинка'), ('Сезон', 'лето')])
+        with self.assertRaises(ValueError):
+            catalog_import.parse_pairs('Цвет', True)
+        with self.assertRaises(ValueError):
+            catalog_import.parse_pairs('Цвет: ', True)
+
+    def test_parse_row(self):
+        data, errors = catalog_import.parse_row({
+            'internal_sku': ' ABC-0001 ', 'name': 'Товар', 'price': '1 299,5', 'is_available': 'да',
+            'features': 'Цвет: Черный', 'tags': 'Сезон: лето, зима',
+        }, self.columns)
+        self.assertEqual(errors, [])
+        self.assertEqual(data['internal_sku'], 'ABC-0001')
+        self.assertEqual(data['price'], Decimal('1299.50'))
+        self.assertIs(data['is_available'], True)
+        self.assertEqual(data['features'], [('Цвет', 'Черный')])
+        self.assertEqual(data['tags'], [('Сезон', ['лето', 'зима'])])
+
+    def test_parse_row_errors(self):
+        data, errors = catalog_import.parse_row(
+            {'name': 'x' * 201, 'price': '-1', 'is_available': 'может', 'features': 'Цвет'}, self.columns
+        )
+        self.assertEqual(len(errors), 4)
+        self.assertNotIn('features', data)
+
+
+@override_settings(PRODUCT_DOCUMENTS_ASYNC=False, SEARCH_WARM_ASYNC=False)
+class CatalogImportTests(TestCase):
+    header = ('internal_sku', 'name', 'category', 'brand', 'price', 'features', 'tags')
+
+    def setUp(self):
+        Category.objects.create(name='Телефоны', slug='phones')
+
+    def run_import(self, *rows, **kwargs):
+        return catalog_import.import_catalog(csv_content(self.header, *rows), 'csv', **kwargs)
+
+    def test_create_and_update(self):
+        report = self.run_import(('', 'Телефон', 'phones', 'Бренд', '100', 'Цвет: Черный', 'Сезон: лето'))
+        self.assertEqual((report['created'], report['updated'], report['failed']), (1, 0, 0))
+        product = Product.objects.get()
+        self.assertTrue(product.internal_sku)
+        self.assertEqual(product.brand.name, 'Бренд')
+        self.assertEqual(ProductFeature.objects.filter(product=product).count(), 1)
+
+        report = self.run_import((product.internal_sku, '', '', '', '120', '', ''))
+        self.assertEqual((report['created'], report['updated']), (0, 1))
+        product.refresh_from_db()
+        self.assertEqual(product.name, 'Телефон')
+        self.assertEqual(product.price, Decimal('120.00'))
+        self.assertEqual(ProductFeature.objects.filter(product=product).count(), 0)
+
+    def test_errors_are_reported_by_line(self):
+        report = self.run_import(
+            ('', 'Телефон', 'phones', '', '100', '', ''),
+            ('', 'Без категории', 'missing', '', '100', '', ''),
+            ('', 'Телефон 2', 'phones', '', 'дорого', '', ''),
+        )
+        self.assertEqual((report['created'], report['failed']), (1, 2))
+        self.assertEqual([item['row'] for item in report['errors']], [3, 4])
+        self.assertIn('category', report['errors'][0]['errors'][0])
+
+    def test_dry_run_writes_nothing(self):
+        report = self.run_import(('', 'Телефон', 'phones', 'Бренд', '100', '', ''), dry_run=True)
+        self.assertEqual(report['created'], 1)
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Brand.objects.exists())
+
+    def test_failed_batch_leaves_no_reference_rows(self):
+        row = ('', 'Телефон', 'phones', 'Бренд', '100', 'Цвет: Черный', 'Сезон: лето')
+        with mock.patch.object(catalog_import.CatalogImport, 'write', side_effect=DatabaseError('boom')):
+            report = self.run_import(row)
+        self.assertEqual((report['created'], report['failed']), (0, 1))
+        self.assertFalse(Brand.objects.exists())
+        self.assertFalse(Tag.objects.exists())
+        self.assertFalse(SkuCounter.objects.exists())
+
+    def test_export_import_round_trip(self):
+        self.run_import(
+            ('', 'Телефон', 'phones', '+Бренд', '100.00', 'Цвет: Черный; Память: 8 ГБ', 'Сезон: лето, зима'),
+            ('', '=Формула', 'phones', 'Бренд', '', '', 'новинка'),
+        )
+        before = export_rows()
+        content = ''.join(export.iter_csv(export.iter_records())).encode('utf-8')
+        Product.objects.all().delete()
+        report = catalog_import.import_catalog(content, 'csv')
+        self.assertEqual((report['created'], report['failed']), (2, 0))
+        self.assertEqual(export_rows(), before)
+
+    def test_formula_text_escaped_only_in_csv(self):
+        self.run_import(('', '=Формула', 'phones', 'Бренд', '', '', ''))
+        row = dict(zip(*list(csv.reader(''.join(export.iter_csv(export.iter_records())).splitlines()))))
+        self.assertEqual(row['name'], "'=Формула")
+
+        output = io.BytesIO()
+        export.write_xlsx(export.iter_records(), output)
+        sheet = openpyxl.load_workbook(io.BytesIO(output.getvalue())).active
+        name = sheet.cell(row=2, column=export.COLUMNS.index('name') + 1)
+        self.assertEqual((name.value, name.data_type), ('=Формула', 's'))
+
+        Product.objects.all().delete()
+        report = catalog_import.import_catalog(output.getvalue(), 'xlsx')
+        self.assertEqual((report['created'], report['failed']), (1, 0))
+        self.assertEqual(Product.objects.get().name, '=Формула')
+
+
+
+class SkuCounterTests(TestCase):
+    def test_allocate_block(self):
+        self.assertEqual(SkuCounter.allocate('ABC', 3), ['ABC-0001', 'ABC-0002', 'ABC-0003'])
+        self.assertEqual(SkuCounter.allocate('ABC'), ['ABC-0004'])
+        self.assertEqual(SkuCounter.objects.get(prefix='ABC').last_number, 4)
+
+    def test_new_counter_starts_after_existing_products(self):
+        product = create_product(internal_sku='OLD-0041')
+        Product.objects.create(name='Другой', slug='other', category=product.category, internal_sku='OLD-0007')
+        # счетчика еще нет (товары появились до него): номера продолжают наибольший
+        SkuCounter.objects.all().delete()
+        self.assertEqual(SkuCounter.allocate('OLD', 2), ['OLD-0042', 'OLD-0043'])
+
+    def test_manual_sku_above_counter_is_reserved(self):
+        product = create_product()
+        self.assertEqual(product.internal_sku, 'CAT-0001')
+        Product.objects.create(name='Ручной', slug='manual', internal_sku='CAT-0100', category=product.category)
+        self.assertEqual(SkuCounter.allocate('CAT'), ['CAT-0101'])
+        SkuCounter.reserve(['CAT-0050', 'other'])
+        self.assertEqual(SkuCounter.objects.get(prefix='CAT').last_number, 101)
+
+    def test_save_without_sku_change_does_not_reserve(self):
+        product = create_product(internal_sku='KEEP-0001')
+        product = Product.objects.get(pk=product.pk)
+        with mock.patch.object(SkuCounter, 'reserve') as reserve:
+            product.price = '10.00'
+            product.save()
+            reserve.assert_not_called()
+            product.internal_sku = 'KEEP-0005'
+            product.save()
+            reserve.assert_called_once_with(['KEEP-0005'])
+
+
+
+@override_settings(PRODUCT_DOCUMENTS_ASYNC=False, SEARCH_WARM_ASYNC=False)
+class ProductAdminTestCase(TestCase):
+    """Товар с характеристикой, группой тегов и двумя изображениями для /api/admin/products/"""
+
+    def setUp(self):
+        self.product = create_product()
+        category = self.product.category
+        self.color = Feature.objects.create(name='Цвет', category=category)
+        self.red = FeatureValue.objects.create(value='Red', category=category)
+        self.blue = FeatureValue.objects.create(value='Blue', category=category)
+        self.feature = ProductFeature.objects.create(product=self.product, feature=self.color, value=self.red)
+        self.season = TagName.objects.create(name='Сезон', category=category)
+        self.style = TagName.objects.create(name='Стиль', category=category)
+        self.summer = Tag.objects.create(name='Лето', slug='summer', tag_name=self.season)
+        self.winter = Tag.objects.create(name='Зима', slug='winter', tag_name=self.season)
+        self.group = ProductTagGroup.objects.create(product=self.product, group_name=self.season)
+        self.group.tags.set([self.summer, self.winter])
+        self.first = Image.objects.create(product=self.product, image='products/1.jpg', is_main=True, order=0)
+        self.second = Image.objects.create(product=self.product, image='products/2.jpg', order=1)
+        self.client = Client(HTTP_X_FORWARDED_FOR='10.0.3.1')
+        self.client.force_login(User.objects.create_user('admin', password='x', is_staff=True))
+
+    def put(self, **data):
+        return self.client.put(f'/api/admin/products/{self.product.pk}/', json.dumps(data),
+                               content_type='application/json')
+
+
+class ProductAdminResponseTests(ProductAdminTestCase):
+    def test_update_response_shows_written_relations(self):
+        response = self.put(
+            features=[{'feature_id': self.color.pk, 'value_id': self.blue.pk}],
+            tag_groups=[{'group_name_id': self.style.pk, 'tag_ids': [self.winter.pk]}],
+            images=[{'id': self.first.pk, '_delete': True}, {'id': self.second.pk, 'is_main': True}],
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([(f['value_id'], f['value_text']) for f in data['features']], [(self.blue.pk, 'Blue')])
+        self.assertEqual([(g['group_name_id'], g['tag_ids']) for g in data['tag_groups']],
+                         [(self.style.pk, [self.winter.pk])])
+        self.assertEqual([(i['id'], i['is_main']) for i in data['images']], [(self.second.pk, True)])
+        self.assertEqual(data['images_count'], 1)
+
+    def test_create_response_shows_relations(self):
+        response = self.client.post('/api/admin/products/', json.dumps({
+            'name': 'Новый', 'slug': 'new', 'category': self.product.category_id,
+            'features': [{'feature_id': self.color.pk, 'value_id': self.red.pk}],
+            'tag_groups': [{'group_name_id': self.season.pk, 'tag_ids': [self.summer.pk]}],
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([f['value_text'] for f in data['features']], ['Red'])
+        self.assertEqual([g['tag_ids'] for g in data['tag_groups']], [[self.summer.pk]])
+
+
+
+class ProductExportAsgiTests(ProductAdminTestCase):
+    """Под ASGI выгрузка отдается асинхронным итератором, без сборки в память"""
+
+    async def export(self, file_format):
+        client = AsyncClient(HTTP_X_FORWARDED_FOR='10.0.3.2')
+        await client.aforce_login(await User.objects.aget(username='admin'))
+        with warnings.catch_warnings():
+            warnings.filterwarnings('error', message='StreamingHttpResponse must consume')
+            response = await client.get(f'/api/admin/products/export/{file_format}/')
+            self.assertTrue(response.is_async)
+            return response, b''.join([part async for part in response])
+
+    async def test_csv_streams_asynchronously(self):
+        response, content = await self.export('csv')
+        self.assertEqual(response.status_code, 200)
+        lines = content.decode('utf-8').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'internal_sku', 'manufacturer_sku'])
+        self.assertEqual(len(lines), 2)
+
+    async def test_xlsx_streams_asynchronously(self):
+        response, content = await self.export('xlsx')
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertTrue(content.startswith(b'PK'))
+
+
+class ProductAdminSyncTests(ProductAdminTestCase):
+    """Связи товара в update приводятся к присланным по разнице (api/bulk.py)"""
+
+    relation_tables = ('api_productfeature', 'api_producttaggroup', 'api_image')
+
+    def current_payload(self):
+        return {
+            'features': [{'feature_id': self.color.pk, 'value_id': self.red.pk}],
+            'tag_groups': [{'group_name_id': self.season.pk, 'tag_ids': [self.summer.pk, self.winter.pk]}],
+            'images': [{'id': self.first.pk, 'is_main': True, 'order': 0},
+                       {'id': self.second.pk, 'is_main': False, 'order': 1}],
+        }
+
+    def test_changed_value_updates_row(self):
+        self.put(features=[{'feature_id': self.color.pk, 'value_id': self.blue.pk}])
+        self.assertEqual(list(ProductFeature.objects.values_list('id', 'value_id')), [(self.feature.pk, self.blue.pk)])
+
+    def test_removed_tag_and_group_are_deleted(self):
+        self.put(tag_groups=[{'group_name_id': self.season.pk, 'tag_ids': [self.summer.pk]}])
+        self.assertEqual(list(ProductTagGroup.objects.values_list('id', flat=True)), [self.group.pk])
+        self.assertEqual(list(self.group.tags.values_list('pk', flat=True)), [self.summer.pk])
+
+        self.put(tag_groups=[])
+        self.assertFalse(ProductTagGroup.objects.exists())
+        self.assertFalse(ProductTagGroup.tags.through.objects.exists())
+
+    def test_images_reordered_and_deleted(self):
+        self.put(images=[{'id': self.first.pk, 'order': 5, 'is_main': False},
+                         {'id': self.second.pk, 'order': 0, 'is_main': True}])
+        self.assertEqual(list(Image.objects.values_list('id', 'order', 'is_main')),
+                         [(self.second.pk, 0, True), (self.first.pk, 5, False)])
+
+        self.put(images=[{'id': self.first.pk, '_delete': True}])
+        self.assertEqual(list(Image.objects.values_list('id', flat=True)), [self.second.pk])
+
+    def test_unchanged_relations_are_not_written(self):
+        with mock.patch.object(bulk, 'relations_changed') as relations_changed, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.put(**self.current_payload())
+        self.assertEqual(response.status_code, 200)
+        relations_changed.assert_not_called()
+        writes = [q['sql'] for q in queries.captured_queries
+                  if q['sql'].split(None, 1)[0] in ('INSERT', 'UPDATE', 'DELETE')
+                  and any(f'"{table}' in q['sql'] for table in self.relation_tables)]
+        self.assertEqual(writes, [])
+
+
+class ProductBatchTests(TestCase):
+    """GET /api/products/batch/ для корзины и избранного"""
+
+    def setUp(self):
+        self.first = create_product(name='Первый', slug='first', price=Decimal('100.00'))
+        self.second = Product.objects.create(name='Второй', slug='second', price=Decimal('50.00'),
+                                             category=self.first.category, brand=self.first.brand)
+        self.client = Client(HTTP_X_FORWARDED_FOR='10.0.4.1')
+
+    def batch(self, query):
+        response = self.client.get(f'/api/products/batch/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_request_order_and_missing(self):
+        data = self.batch(f'ids={self.second.pk},999999&slugs=first,nope')
+        self.assertEqual([row['slug'] for row in data['results']], ['second', 'first'])
+        self.assertEqual(data['missing'], {'ids': [999999], 'slugs': ['nope']})
+        self.assertEqual(Decimal(str(data['results'][0]['price'])), Decimal('50'))
+
+    def test_product_requested_by_id_and_slug_returned_once(self):
+        data = self.batch(f'ids={self.first.pk},{self.first.pk}&slugs=first,second')
+        self.assertEqual([row['slug'] for row in data['results']], ['first', 'second'])
+
+    def test_price_change_visible_immediately(self):
+        self.batch(f'ids={self.first.pk}')
+        Product.objects.filter(pk=self.first.pk).update(price=Decimal('80.00'), is_available=False)
+        row = self.batch(f'ids={self.first.pk}')['results'][0]
+        self.assertEqual((Decimal(str(row['price'])), row['is_available']), (Decimal('80'), False))
+
+    def test_invalid_requests(self):
+        for query in ('', 'ids=a,b', 'ids=' + ','.join(['1'] * 201)):
+            self.assertEqual(self.client.get(f'/api/products/batch/?{query}').status_code, 400)
+
+
+class CategorySubtreeTests(TestCase):
+    """Category.subtree_ids по материализованному пути"""
+
+    def setUp(self):
+        self.root = Category.objects.create(pk=1, name='Корень', slug='root')
+        self.child = Category.objects.create(pk=2, name='Дочерняя', slug='child', parent=self.root)
+        self.grandchild = Category.objects.create(pk=5, name='Внучатая', slug='grandchild', parent=self.child)
+        self.sibling = Category.objects.create(pk=23, name='Соседняя', slug='sibling', parent=self.root)
+
+    def subtree(self, category):
+        return set(Category.objects.filter(id__in=category.subtree_ids()).values_list('id', flat=True))
+
+    def test_prefix_does_not_capture_similar_ids(self):
+        self.child.refresh_from_db()
+        self.assertEqual(self.child.path, '1/2/')
+        self.assertEqual(self.subtree(self.child), {2, 5})
+        self.assertEqual(self.subtree(self.root), {1, 2, 5, 23})
+
+    def test_empty_path_is_only_the_category(self):
+        Category.objects.filter(pk=self.child.pk).update(path='')
+        self.child.refresh_from_db()
+        self.assertEqual(self.subtree(self.child), {2})
+
+
+@override_settings(PRODUCT_DOCUMENTS_ASYNC=False)
+class FacetTests(TestCase):
+    """Диапазон и гистограмма цен, предрасчитанные фасеты характеристик"""
+
+    def setUp(self):
+        self.free = create_product(name='Бесплатный', slug='free', price=Decimal('0'))
+        self.category, self.brand = self.free.category, self.free.brand
+        for slug, price in (('cheap', '10.00'), ('expensive', '100.00'), ('no-price', None)):
+            Product.objects.create(name=slug, slug=slug, price=price, category=self.category, brand=self.brand)
+        self.color = Feature.objects.create(name='Цвет', category=self.category)
+        self.red = FeatureValue.objects.create(value='Red', category=self.category)
+
+    def test_zero_price_is_a_bound(self):
+        self.assertEqual(facets.price_range(Product.objects.all()), {'min_price': 0.0, 'max_price': 100.0})
+        self.assertEqual(facets.price_range(Product.objects.filter(slug='no-price')),
+                         {'min_price': None, 'max_price': None})
+
+    def test_price_histogram(self):
+        histogram = facets.price_histogram(Product.objects.all(), buckets=2)
+        self.assertEqual([(b['min_price'], b['max_price'], b['count']) for b in histogram['buckets']],
+                         [(0.0, 50.0, 2), (50.0, 100.0, 1)])
+        single = facets.price_histogram(Product.objects.filter(slug='cheap'), buckets=5)
+        self.assertEqual([b['count'] for b in single['buckets']], [1])
+        self.assertEqual(facets.price_histogram(Product.objects.filter(slug='no-price'))['buckets'], [])
+
+    def stored(self):
+        return set(CategoryFeatureFacet.objects.values_list('category_id', 'feature_id', 'value_id', 'product_count'))
+
+    def test_feature_facets_rebuilt_after_commit(self):
+        cheap, expensive = Product.objects.get(slug='cheap'), Product.objects.get(slug='expensive')
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductFeature.objects.create(product=cheap, feature=self.color, value=self.red)
+            ProductFeature.objects.create(product=expensive, feature=self.color, value=self.red)
+        self.assertEqual(self.stored(), {(self.category.pk, self.color.pk, self.red.pk, 2)})
+
+        other = Category.objects.create(name='Другая', slug='other')
+        with self.captureOnCommitCallbacks(execute=True):
+            expensive.category = other
+            expensive.save()
+        self.assertEqual(self.stored(), {(self.category.pk, self.color.pk, self.red.pk, 1),
+                                         (other.pk, self.color.pk, self.red.pk, 1)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductFeature.objects.filter(product=cheap).delete()
+        self.assertEqual(self.stored(), {(other.pk, self.color.pk, self.red.pk, 1)})
+
+    def test_feature_facet_counts_with_filters(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for slug in ('cheap', 'expensive'):
+                ProductFeature.objects.create(product=Product.objects.get(slug=slug),
+                                              feature=self.color, value=self.red)
+        client = Client(HTTP_X_FORWARDED_FOR='10.0.5.1')
+        for query, count in (('', 2), ('?price_min=50', 1)):
+            response = client.get(f'/api/categories/{self.category.slug}/features/{query}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()[0]['values'][0]['product_count'], count)
+
+
+@override_settings(PRODUCT_DOCUMENTS_ASYNC=False)
+class ProductDocumentTests(TestCase):
+    """Предсобранная карточка товара устаревает при правке и пересобирается после коммита"""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = create_product(name='Старое имя')
+        self.client = Client(HTTP_X_FORWARDED_FOR='10.0.6.1')
+
+    def test_edit_invalidates_document(self):
+        self.assertEqual(documents.get_document('product')['name'], 'Старое имя')
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.product.name = 'Новое имя'
+            self.product.save()
+            # до пересборки устаревший документ не отдается
+            self.assertIsNone(documents.get_document('product'))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(documents.get_document('product')['name'], 'Новое имя')
+        self.assertEqual(self.client.get('/api/products/product/').json()['name'], 'Новое имя')
+
+    def test_related_edit_invalidates_document(self):
+        brand = self.product.brand
+        with self.captureOnCommitCallbacks(execute=True):
+            brand.name = 'Другой бренд'
+            brand.save()
+            self.assertIsNone(documents.get_document('product'))
+        self.assertEqual(documents.get_document('product')['brand']['name'], 'Другой бренд')
+        self.assertEqual(self.client.get('/api/products/product/').json()['brand']['name'], 'Другой бренд')
+
+
+@override_settings(PRODUCT_DOCUMENTS_ASYNC=False)
+class ProductCardCacheTests(TestCase):
+    """Ключ кэша карточки меняется вместе с данными карточки"""
+
+    def setUp(self):
+        cache.clear()
+        self.product = create_product(name='Старое имя')
+        self.client = Client(HTTP_X_FORWARDED_FOR='10.0.7.1')
+
+    def key(self):
+        return cards.card_key(cards.with_card_stamp(Product.objects.filter(pk=self.product.pk)).get(), '')
+
+    def test_stamp_changes_on_product_save(self):
+        before = self.key()
+        self.product.price = Decimal('99.00')
+        self.product.save()
+        self.assertNotEqual(self.key(), before)
+
+    def test_stamp_changes_on_related_edits(self):
+        keys = [self.key()]
+        image = Image.objects.create(product=self.product, image='products/1.jpg', is_main=True)
+        keys.append(self.key())
+        image.image = 'products/2.jpg'
+        image.save()
+        keys.append(self.key())
+        Brand.objects.filter(pk=self.product.brand_id).update(name='Другой бренд')
+        keys.append(self.key())
+        self.assertEqual(len(set(keys)), 4)
+
+    def test_list_serves_fresh_card_after_save(self):
+        self.assertEqual(self.client.get('/api/products/').json()['results'][0]['name'], 'Старое имя')
+        self.product.name = 'Новое имя'
+        self.product.save()
+        self.assertEqual(self.client.get('/api/products/').json()['results'][0]['name'], 'Новое имя')
+
+
+class SimilarityTests(TestCase):
+    """Индекс похожих товаров и выдача /api/products/<slug>/similar/"""
+
+    def setUp(self):
+        self.first = create_product(name='Первый', slug='first', price='100.00')
+        category, brand = self.first.category, self.first.brand
+        self.tagged = Product.objects.create(name='С тегом', slug='tagged', price='100.00',
+                                             category=category, brand=brand)
+        self.plain = Product.objects.create(name='Без тега', slug='plain', price='100.00',
+                                            category=category, brand=brand)
+        season = TagName.objects.create(name='Сезон', category=category)
+        summer = Tag.objects.create(name='Лето', slug='summer', tag_name=season)
+        for product in (self.first, self.tagged):
+            ProductTagGroup.objects.create(product=product, group_name=season).tags.set([summer])
+        self.client = Client(HTTP_X_FORWARDED_FOR='10.0.8.1')
+
+    def similar(self, slug):
+        response = self.client.get(f'/api/products/{slug}/similar/')
+        self.assertEqual(response.status_code, 200)
+        return [card['slug'] for card in response.json()]
+
+    def test_shared_tag_ranks_higher(self):
+        self.assertGreater(similarity.build_similarity(), 0)
+        ranked = list(ProductSimilarity.objects.filter(product=self.first).order_by('rank')
+                      .values_list('similar__slug', flat=True))
+        self.assertEqual(ranked, ['tagged', 'plain'])
+        self.assertEqual(self.similar('first'), ['tagged', 'plain'])
+
+    def test_products_outside_index_fall_back_to_category(self):
+        self.assertFalse(ProductSimilarity.objects.exists())
+        self.assertEqual(set(self.similar('first')), {'tagged', 'plain'})
+        self.assertEqual(self.client.get('/api/products/missing/similar/').status_code, 404)
+
+
+# Фоновая пересборка документов не должна писать в БД, пока тест ее очищает
+@override_settings(PRODUCT_DOCUMENTS_ASYNC=False)
+class ConcurrentOrderIdempotencyTests(TransactionTestCase):
+    """Одновременная отправка одного заказа из нескольких потоков (файловая SQLite):
+    клиент повторяет запрос, не дождавшись ответа"""
+
+    threads = 8
+
+    def test_concurrent_submissions_create_one_order(self):
+        product = create_product()
+        payload = json.dumps(order_payload(product))
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+        errors = []
+
+        def submit():
+            try:
+                barrier.wait()
+                response = Client().post('/api/orders/', payload, content_type='application/json',
+                                         HTTP_IDEMPOTENCY_KEY='burst-1', HTTP_X_FORWARDED_FOR='10.0.1.1')
+                statuses.append((response.status_code, response.json().get('id')))
+            except Exception as exc:  # noqa: BLE001 - ошибка потока проверяется ниже
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=submit) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 1)
+        order_id = Order.objects.get().pk
+        self.assertEqual(sorted(code for code, _ in statuses), [200] * (self.threads - 1) + [201])
+        self.assertEqual({pk for _, pk in statuses}, {order_id})
+
+
+@mock.patch.object(writes.time, 'sleep')
+class RunWriteRetryTests(TransactionTestCase):
+    """Повтор записи при 'database is locked' (вне внешней транзакции, как в запросе)"""
+
+    def locked_then(self, failures, result=None):
+        calls = []
+
+        def write(*args):
+            calls.append(args)
+            if len(calls) <= failures:
+                raise OperationalError('database is locked')
+            return result
+        return write, calls
+
+    def test_retries_until_success(self, sleep):
+        write, calls = self.locked_then(2, result='ok')
+        self.assertEqual(writes.run_write(write), 'ok')
+        self.assertEqual((len(calls), sleep.call_count), (3, 2))
+
+    @override_settings(SQLITE_WRITE_RETRY_ATTEMPTS=3)
+    def test_gives_up_after_attempts(self, sleep):
+        write, calls = self.locked_then(10)
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            writes.run_write(write)
+        self.assertEqual(len(calls), 3)
+
+    @override_settings(SQLITE_WRITE_MAX_WAIT=0)
+    def test_gives_up_after_max_wait(self, sleep):
+        write, calls = self.locked_then(10)
+        with self.assertRaises(OperationalError):
+            writes.run_write(write)
+        self.assertEqual((len(calls), sleep.call_count), (1, 0))
+
+    @override_settings(SQLITE_WRITE_MAX_WAIT=0.5)
+    def test_retry_busy_timeout_limited_to_remaining_wait(self, sleep):
+        write, calls = self.locked_then(1)
+        with mock.patch.object(writes, 'backoff_delay', return_value=0), \
+                mock.patch.object(writes, '_set_busy_timeout') as set_busy_timeout:
+            writes.run_write(write)
+        limited, restored = [call.args[0] for call in set_busy_timeout.call_args_list]
+        self.assertLessEqual(limited, 0.5)
+        self.assertEqual(restored, connection.settings_dict['OPTIONS'].get('timeout', 5.0))
+
+    def test_other_errors_and_outer_transaction_not_retried(self, sleep):
+        write, calls = self.locked_then(10)
+        with transaction.atomic(), self.assertRaises(OperationalError):
+            writes.run_write(write)
+        with self.assertRaises(OperationalError):
+            writes.run_write(mock.Mock(side_effect=OperationalError('no such table: x')))
+        self.assertEqual((len(calls), sleep.call_count), (1, 0))
+
+    def test_batched_writer_flush(self, sleep):
+        writer = writes.BatchedWriter(ContactMessage, batch_size=10, flush_interval=60)
+        for number in range(3):
+            writer.append(ContactMessage(name=f'Имя {number}', email='a@example.com', message='Текст'))
+        self.assertEqual((writer.pending(), ContactMessage.objects.count()), (3, 0))
+
+        bulk_create = ContactMessage.objects.bulk_create
+        locked, _ = self.locked_then(10)
+        with override_settings(SQLITE_WRITE_RETRY_ATTEMPTS=2), \
+                mock.patch.object(ContactMessage.objects, 'bulk_create', side_effect=locked), \
+                self.assertRaises(OperationalError):
+            writer.flush()
+        self.assertEqual((writer.pending(), ContactMessage.objects.count()), (3, 0))
+
+        failing_once, calls = self.locked_then(1)
+        with mock.patch.object(ContactMessage.objects, 'bulk_create',
+                               side_effect=lambda batch: failing_once() or bulk_create(batch)):
+            self.assertEqual(writer.flush(), 3)
+        self.assertEqual((writer.pending(), ContactMessage.objects.count(), len(calls)), (0, 3, 2))
+
+
+@mock.patch.object(db_routing, 'replica_configured', return_value=True)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Маршрутизация при настроенной реплике (без транзакции теста вокруг, как в запросе)"""
+
+    def test_reads_go_to_replica_writes_to_primary(self, configured):
+        self.assertEqual(Product.objects.all().db, 'default')
+        with db_routing.use_replica():
+            self.assertEqual(Product.objects.all().db, 'replica')
+            self.assertEqual(Product.objects.filter(pk=1).select_for_update().db, 'default')
+            self.assertEqual(db_routing.ReplicaRouter().db_for_write(Product), 'default')
+
+    def test_transaction_reads_stay_on_primary(self, configured):
+        with db_routing.use_replica(), transaction.atomic():
+            self.assertEqual(Product.objects.all().db, 'default')
+
+    def test_only_safe_requests_without_sticky_cookie_read_replica(self, configured):
+        factory = RequestFactory()
+        self.assertTrue(db_routing.should_read_replica(factory.get('/api/products/')))
+        self.assertFalse(db_routing.should_read_replica(factory.post('/api/orders/')))
+        sticky = factory.get('/api/products/')
+        sticky.COOKIES[db_routing.PRIMARY_COOKIE] = '1'
+        self.assertFalse(db_routing.should_read_replica(sticky))
+
+    def test_write_sets_sticky_cookie(self, configured):
+        middleware = db_routing.PrimaryStickinessMiddleware(lambda request: HttpResponse(status=201))
+        response = middleware(RequestFactory().post('/api/orders/'))
+        self.assertIn(db_routing.PRIMARY_COOKIE, response.cookies)
+        response = middleware(RequestFactory().get('/api/products/'))
+        self.assertNotIn(db_routing.PRIMARY_COOKIE, response.cookies)
 
-# Create your tests here.
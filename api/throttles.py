@@ -9,3 +9,12 @@ class LoginRateThrottle(AnonRateThrottle):
     """
     scope = 'login'
     rate = '5/hour'
+
+
+class SuggestRateThrottle(AnonRateThrottle):
+    """
+    Подсказки поиска запрашиваются на каждое нажатие клавиши,
+    поэтому у них свой лимит вместо общего anon.
+    """
+    scope = 'suggest'
+    rate = '120/minute'
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 from .views import (
     CategoryViewSet,
     ProductViewSet,
@@ -18,6 +18,8 @@ from .views import (
     ProductReviewViewSet,
     ProductQuestionViewSet,
     similar_products,
+    cart_quote,
+    search_suggest,
     # Admin ViewSets
     ProductAdminViewSet,
     CategoryAdminViewSet,
@@ -73,6 +75,7 @@ router.register(r'admin/questions', QuestionAdminViewSet, basename='admin-questi
 urlpatterns = [
     path('', include(router.urls)),
     # Публичные endpoints
+    path('home/', views.home_page, name='home'),
     path('about/', AboutContentView.as_view(), name='about-content'),
     path('contact/', ContactInfoView.as_view(), name='contact-info'),
     path('contact/message/', ContactMessageView.as_view(), name='contact-message'),
@@ -80,8 +83,17 @@ urlpatterns = [
     path('products/<slug:product_slug>/reviews/', ProductReviewViewSet.as_view({'get': 'list', 'post': 'create'}), name='product-reviews'),
     path('products/<slug:product_slug>/questions/', ProductQuestionViewSet.as_view({'get': 'list', 'post': 'create'}), name='product-questions'),
     path('products/<slug:slug>/similar/', similar_products, name='similar-products'),
+    path('cart/quote/', cart_quote, name='cart-quote'),
+    path('search/suggest/', search_suggest, name='search-suggest'),
     path('features-tags-by-category/', features_tags_by_category, name='features_tags_by_category'),
     path('feature-values-by-feature/', feature_values_by_feature, name='feature_values_by_feature'),
+    # Асинхронные чтения каталога (ASGI)
+    path('async/products/', async_views.product_list, name='async-products'),
+    path('async/products/<slug:slug>/', async_views.product_detail, name='async-product-detail'),
+    path('async/categories/', async_views.category_tree, name='async-categories'),
+    path('async/brands/', async_views.brand_list, name='async-brands'),
+    path('async/banners/', async_views.banner_list, name='async-banners'),
+    path('async/home/', async_views.home_page, name='async-home'),
     # Admin endpoints
     path('admin/about/', AboutContentAdminView.as_view(), name='admin-about'),
     path('admin/contact/', ContactInfoAdminView.as_view(), name='admin-contact'),
@@ -1,4 +1,7 @@
 # api/views.py
+import hashlib
+import json
+from datetime import timedelta
 from decimal import Decimal
 from rest_framework import viewsets, generics, status, filters
 from rest_framework.response import Response
@@ -6,12 +9,26 @@ from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django.http import Http404
 from django.http import JsonResponse
-from rest_framework.decorators import api_view, action, permission_classes
-from django.db.models import Q, Min, Max, Count
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
+from rest_framework.decorators import api_view, action, permission_classes, throttle_classes
+from rest_framework.throttling import AnonRateThrottle
+from django.conf import settings
+from django.db import IntegrityError, models
+from django.utils import timezone
+from django.db.models import Q, Count, OuterRef, Subquery
+from django.core.files.storage import default_storage
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
-from .throttles import LoginRateThrottle
+from .throttles import LoginRateThrottle, SuggestRateThrottle
+from . import bulk, catalog_import, documents, export, facets, home, search
+from .cards import prepare_product_list, serialize_product_cards
+from .cart import quote_cart, quote_to_json
+from .similarity import SIMILAR_TOP_K
+from .writes import BatchedWriter, run_write
+from .db_routing import ReplicaReadMixin, replica_read
+from .serializers import parse_field_selection
 from .models import Brand, Product
 from .serializers import BrandSerializer, ProductListSerializer
 from .filters import BrandFilter
@@ -23,10 +40,11 @@ from .models import (
     ProductReview, ProductQuestion
 )
 from .serializers import (
-    CategorySerializer, ProductListSerializer, ProductDetailSerializer,
+    CategorySerializer, ProductListSerializer, ProductDetailSerializer, ProductLeanDetailSerializer,
     NewsItemSerializer, NewsDetailSerializer, AboutContentSerializer,
     ContactInfoSerializer, ContactMessageSerializer, BrandSerializer, TagSerializer,
     ProductTagGroupSerializer, BannerSerializer, OrderSerializer, OrderAdminSerializer,
+    OrderCheckoutSerializer, CartQuoteSerializer,
     ProductReviewSerializer, ProductQuestionSerializer,
     ProductReviewAdminSerializer, ProductQuestionAdminSerializer
 )
@@ -84,6 +102,7 @@ def admin_logout(request):
 
 # ============ EXISTING VIEWS ============
 @api_view(['GET'])
+@replica_read
 def features_tags_by_category(request):
     """Get features, tags, and feature values for a specific category"""
     try:
@@ -152,6 +171,7 @@ def features_tags_by_category(request):
 
 
 @api_view(['GET'])
+@replica_read
 def feature_values_by_feature(request):
     """Получить значения характеристики по её ID"""
     feature_id = request.GET.get('feature_id')
@@ -169,7 +189,7 @@ def feature_values_by_feature(request):
         import logging
         logging.getLogger(__name__).exception("Error in feature_values_by_feature")
         return JsonResponse({'error': 'Internal server error'}, status=500)
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all().order_by('name')
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
@@ -182,32 +202,25 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 @api_view(['GET'])
+@replica_read
 def products_by_feature_value(request):
     value = request.GET.get('value')
     if not value:
         return Response({"error": "value parameter is required"}, status=400)
 
     product_ids = ProductFeature.objects.filter(value__value__icontains=value).values_list('product_id', flat=True)
-    queryset = Product.objects.filter(id__in=product_ids).distinct()
+    queryset = prepare_product_list(Product.objects.filter(id__in=product_ids).distinct(),
+                                    parse_field_selection(request))
 
-    serializer = ProductListSerializer(queryset, many=True, context={'request': request})
-    return Response(serializer.data)
+    return Response(serialize_product_cards(queryset, {'request': request}))
 
 
-def apply_product_filters(request, queryset):
-    params = request.query_params
+def apply_product_filters(request, queryset, params=None):
+    params = request.query_params if params is None else params
     tag_param = params.get('tag')  # comma-separated tag slugs
     if tag_param:
-        tag_slugs = [t.strip() for t in tag_param.split(',') if t.strip()]
-        if tag_slugs:
-            # AND across groups, OR within the same group
-            tag_objs = Tag.objects.filter(slug__in=tag_slugs).values('slug', 'tag_name_id')
-            group_to_slugs: dict = {}
-            for t in tag_objs:
-                gid = t['tag_name_id'] if t['tag_name_id'] is not None else '__none__'
-                group_to_slugs.setdefault(gid, []).append(t['slug'])
-            for slugs_in_group in group_to_slugs.values():
-                queryset = queryset.filter(tag_groups__tags__slug__in=slugs_in_group)
+        # AND across groups, OR within the same group
+        queryset = facets.filter_by_tag_groups(queryset, facets.selected_tag_groups(tag_param))
 
     # --- фильтр по цене ---
     price_min = params.get('price_min')
@@ -240,40 +253,25 @@ def apply_product_filters(request, queryset):
 
 
     # --- фильтр по поиску ---
-    search = params.get('search')
-    if search:
+    # название, бренд и артикулы - по индексу с транслитерацией и опечатками (api/search.py)
+    query = params.get('search')
+    if query:
         queryset = queryset.filter(
-            Q(name__icontains=search) | 
-            Q(description__icontains=search) |
-            Q(manufacturer_sku__icontains=search) |
-            Q(internal_sku__icontains=search)
+            search.search_filter(query) |
+            Q(description__icontains=query)
         )
 
     # --- фильтр по характеристикам ---
-    for k, v in params.items():
-        if k.startswith('feature_') and v:
-            try:
-                fid = int(k.split('_', 1)[1])
-                queryset = queryset.filter(features__feature_id=fid, features__value_id=v)
-            except (ValueError, IndexError):
-                continue
+    queryset = facets.filter_by_features(queryset, facets.selected_features(params))
 
-    # --- фильтр по категории с рекурсией ---
+    # --- фильтр по категории вместе с подкатегориями (Category.path) ---
     category_slug = params.get('category')
     if category_slug:
-        try:
-            category = Category.objects.get(slug=category_slug)
-
-            def collect_category_ids(cat):
-                ids = [cat.id]
-                for child in cat.children.all():
-                    ids.extend(collect_category_ids(child))
-                return ids
-
-            category_ids = collect_category_ids(category)
-            queryset = queryset.filter(category_id__in=category_ids)
-        except Category.DoesNotExist:
+        category = Category.objects.filter(slug=category_slug).only('id', 'path').first()
+        if category is None:
             queryset = queryset.none()
+        else:
+            queryset = queryset.filter(category_id__in=category.subtree_ids())
     # --- фильтр по группам тегов ---
     for key, val in params.items():
         if key.startswith('taggroup_') and val:
@@ -295,7 +293,10 @@ def apply_product_filters(request, queryset):
 
 
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+BATCH_LOOKUP_MAX = 200
+
+
+class ProductViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Product.objects.all()
     lookup_field = 'slug'
     pagination_class = StandardResultsSetPagination
@@ -304,10 +305,36 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         queryset = Product.objects.all()
         queryset = apply_product_filters(self.request, queryset)
+        if self.action == 'retrieve':
+            fields = self.get_serializer_class().requested_fields(self.request)
+            queryset = ProductDetailSerializer.setup_eager_loading(queryset, fields)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        queryset = prepare_product_list(self.filter_queryset(self.get_queryset()),
+                                        parse_field_selection(request))
+        context = self.get_serializer_context()
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serialize_product_cards(page, context))
+        return Response(serialize_product_cards(queryset, context))
+
+    def retrieve(self, request, *args, **kwargs):
+        # Без дополнительных параметров карточка отдается из предсобранного документа
+        if not request.query_params:
+            data = documents.get_document(kwargs[self.lookup_field])
+            if data is not None:
+                return Response(documents.absolutize_urls(data, request))
+            response = super().retrieve(request, *args, **kwargs)
+            documents.schedule_rebuild([response.data['id']])
+            return response
+        return super().retrieve(request, *args, **kwargs)
+
     def get_serializer_class(self):
         if self.action == 'retrieve':
+            # ?detail=lean - категория без поддерева, с хлебными крошками
+            if self.request.query_params.get('detail') == 'lean':
+                return ProductLeanDetailSerializer
             return ProductDetailSerializer
         return ProductListSerializer
 
@@ -324,11 +351,63 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         else:
             qs = Product.objects.exclude(price__isnull=True)
 
-        agg = qs.aggregate(min_price=Min('price'), max_price=Max('price'))
-
+        return Response(facets.price_range(qs))
+
+    @action(detail=False, methods=['get'], url_path='price-histogram')
+    def price_histogram(self, request, *args, **kwargs):
+        """Распределение цен по ?buckets= интервалам при текущих фильтрах (кроме price_min/price_max)"""
+        params = request.query_params.copy()
+        params.pop('price_min', None)
+        params.pop('price_max', None)
+        products = apply_product_filters(request, Product.objects.all(), params)
+        return Response(facets.price_histogram(products, facets.histogram_buckets(params)))
+
+    @action(detail=False, methods=['get'], url_path='batch')
+    def batch(self, request, *args, **kwargs):
+        """Компактные данные (цена, наличие, главное изображение, SKU) для корзины и избранного.
+
+        ?ids=1,2,3 и/или ?slugs=a,b - до BATCH_LOOKUP_MAX товаров одним запросом.
+        Порядок результатов совпадает с порядком в запросе (сначала ids, затем slugs),
+        товар, запрошенный несколько раз (в том числе и по id, и по slug), отдается один раз.
+        Ответ не кэшируется: корзине нужны текущие цена и наличие, а сам запрос -
+        один индексный поиск.
+        """
+        try:
+            ids = [int(v) for v in request.query_params.get('ids', '').split(',') if v.strip()]
+        except ValueError:
+            return Response({'error': 'ids must be comma-separated integers'}, status=400)
+        slugs = [v.strip() for v in request.query_params.get('slugs', '').split(',') if v.strip()]
+        if not ids and not slugs:
+            return Response({'error': 'ids or slugs parameter is required'}, status=400)
+        if len(ids) + len(slugs) > BATCH_LOOKUP_MAX:
+            return Response({'error': f'Maximum {BATCH_LOOKUP_MAX} products per request'}, status=400)
+
+        main_image = Image.objects.filter(product=OuterRef('pk')).order_by(
+            '-is_main', 'order', 'pk'
+        ).values('image')[:1]
+        rows = Product.objects.filter(Q(id__in=ids) | Q(slug__in=slugs)).annotate(
+            main_image_path=Subquery(main_image)
+        ).values('id', 'slug', 'name', 'price', 'is_available',
+                 'manufacturer_sku', 'internal_sku', 'main_image_path')
+
+        by_id, by_slug = {}, {}
+        for row in rows:
+            path = row.pop('main_image_path')
+            row['main_image'] = request.build_absolute_uri(default_storage.url(path)) if path else None
+            by_id[row['id']] = row
+            by_slug[row['slug']] = row
+
+        results, seen = [], set()
+        for row in [by_id[pk] for pk in ids if pk in by_id] + [by_slug[s] for s in slugs if s in by_slug]:
+            if row['id'] not in seen:
+                seen.add(row['id'])
+                results.append(row)
         return Response({
-            'min_price': float(agg['min_price']) if agg['min_price'] else None,
-            'max_price': float(agg['max_price']) if agg['max_price'] else None,
+            'results': results,
+            'missing': {
+                'ids': [pk for pk in ids if pk not in by_id],
+                'slugs': [s for s in slugs if s not in by_slug],
+            },
         })
 
     @action(detail=True, methods=['post'], url_path='upload-image')
@@ -353,7 +432,7 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         return Response({'images': uploaded_images}, status=status.HTTP_201_CREATED)
 
 
-class BrandViewSet(viewsets.ReadOnlyModelViewSet):
+class BrandViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
     lookup_field = "slug"
@@ -385,12 +464,11 @@ class BrandViewSet(viewsets.ReadOnlyModelViewSet):
             # Fallback to a basic queryset if filtering fails for any reason
             products_qs = products_qs.order_by('name')
 
+        products_qs = prepare_product_list(products_qs, parse_field_selection(request))
         page = self.paginate_queryset(products_qs)
         if page is not None:
-            serializer = ProductListSerializer(page, many=True, context={"request": request})
-            return self.get_paginated_response(serializer.data)
-        serializer = ProductListSerializer(products_qs, many=True, context={"request": request})
-        return Response(serializer.data)
+            return self.get_paginated_response(serialize_product_cards(page, {"request": request}))
+        return Response(serialize_product_cards(products_qs, {"request": request}))
         
     @action(detail=True, methods=['get'])
     def categories(self, request, slug=None):
@@ -444,7 +522,7 @@ class BrandViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(result)
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.filter(parent=None).order_by('order', 'name')
     serializer_class = CategorySerializer
     lookup_field = 'slug'
@@ -461,9 +539,9 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
         return super().retrieve(request, *args, **kwargs)
 
     def get_queryset(self):
-        queryset = super().get_queryset().annotate(
-            direct_products_count=Count('products', distinct=True)
-        )
+        queryset = super().get_queryset()
+        if 'products_count' in CategorySerializer.requested_fields(self.request):
+            queryset = queryset.annotate(direct_products_count=Count('products', distinct=True))
         limit = self.request.query_params.get('limit')
         if limit:
             try:
@@ -479,17 +557,17 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
         except Http404:
             return Response({'error': 'Категория не найдена'}, status=404)
 
+        selection = parse_field_selection(request)
         products = category.get_all_products()
-        products = apply_product_filters(request, products)
+        products = prepare_product_list(apply_product_filters(request, products), selection)
+        context = {'field_selection': selection}
 
         paginator = StandardResultsSetPagination()
         page = paginator.paginate_queryset(products, request)
         if page is not None:
-            serializer = ProductListSerializer(page, many=True)
-            return paginator.get_paginated_response(serializer.data)
+            return paginator.get_paginated_response(serialize_product_cards(page, context))
 
-        serializer = ProductListSerializer(products, many=True)
-        return Response(serializer.data)
+        return Response(serialize_product_cards(products, context))
 
     @action(detail=True, methods=['get'])
     def brands(self, request, slug=None):
@@ -590,7 +668,64 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(result)
 
 
-class BannerViewSet(viewsets.ReadOnlyModelViewSet):
+    def _category_selection(self, request, slug):
+        # queryset viewset'а содержит только корни, а фасеты нужны и подкатегориям
+        category = Category.objects.filter(slug=slug).first()
+        if category is None:
+            return None, None
+        selection = facets.CategorySelection(
+            category, request.query_params,
+            lambda queryset, params: apply_product_filters(request, queryset, params),
+        )
+        return category, selection
+
+    @action(detail=True, methods=['get'])
+    def features(self, request, slug=None):
+        """Значения характеристик со счетчиками товаров при текущих фильтрах (как у products)"""
+        category, selection = self._category_selection(request, slug)
+        if category is None:
+            return Response({'error': 'Категория не найдена'}, status=404)
+        return Response(selection.feature_facets())
+
+    @action(detail=True, methods=['get'])
+    def page(self, request, slug=None):
+        """Страница категории одним ответом: товары, фасеты тегов, характеристик и брендов,
+        диапазон и гистограмма цен (?buckets=).
+
+        Принимает те же параметры, что и products. В отличие от остальных
+        action'ов находит и подкатегории, а не только корневые категории.
+        """
+        category, selection = self._category_selection(request, slug)
+        if category is None:
+            return Response({'error': 'Категория не найдена'}, status=404)
+
+        fields = parse_field_selection(request)
+        paginator = StandardResultsSetPagination()
+        page = paginator.paginate_queryset(prepare_product_list(selection.products(), fields), request)
+        response = paginator.get_paginated_response(serialize_product_cards(page, {'field_selection': fields}))
+
+        brands = selection.brand_facets()
+        brand_data = BrandSerializer(brands, many=True, context={'request': request}).data
+        for item, brand in zip(brand_data, brands):
+            item['products_count'] = brand.products_count
+
+        response.data.update({
+            'category': {
+                'id': category.id,
+                'name': category.name,
+                'slug': category.slug,
+                'breadcrumbs': category.get_breadcrumbs(),
+            },
+            'tags': selection.tag_facets(),
+            'features': selection.feature_facets(),
+            'brands': brand_data,
+            'price_range': selection.price_range(),
+            'price_histogram': selection.price_histogram(),
+        })
+        return response
+
+
+class BannerViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """Публичный ViewSet для баннеров"""
     queryset = Banner.objects.filter(is_active=True).order_by('order')
     serializer_class = BannerSerializer
@@ -602,7 +737,7 @@ class BannerViewSet(viewsets.ReadOnlyModelViewSet):
         return super().list(request, *args, **kwargs)
 
 
-class NewsViewSet(viewsets.ReadOnlyModelViewSet):
+class NewsViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = NewsItem.objects.filter(is_published=True).order_by('-pub_date')
     lookup_field = 'slug'
     pagination_class = StandardResultsSetPagination
@@ -624,7 +759,27 @@ class NewsViewSet(viewsets.ReadOnlyModelViewSet):
         return queryset
 
 
-class AboutContentView(generics.RetrieveAPIView):
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([SuggestRateThrottle])
+def search_suggest(request):
+    """Подсказки для строки поиска: товары, артикулы, бренды и категории (?q=, ?limit=)"""
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', search.SUGGEST_LIMIT)), search.SUGGEST_MAX_LIMIT))
+    except ValueError:
+        limit = search.SUGGEST_LIMIT
+    return Response(search.suggest(request.query_params.get('q', ''), limit))
+
+
+@api_view(['GET'])
+@replica_read
+def home_page(request):
+    """Главная одним запросом: banners, categories, news, contact, about, products
+    (?news_limit=, ?products_limit=)"""
+    return Response(home.get_home(request))
+
+
+class AboutContentView(ReplicaReadMixin, generics.RetrieveAPIView):
     serializer_class = AboutContentSerializer
 
     def get_object(self):
@@ -634,7 +789,7 @@ class AboutContentView(generics.RetrieveAPIView):
         return obj
 
 
-class ContactInfoView(generics.RetrieveAPIView):
+class ContactInfoView(ReplicaReadMixin, generics.RetrieveAPIView):
     serializer_class = ContactInfoSerializer
 
     def get_object(self):
@@ -644,6 +799,9 @@ class ContactInfoView(generics.RetrieveAPIView):
         return obj
 
 
+contact_message_writer = BatchedWriter(ContactMessage)
+
+
 class ContactMessageView(generics.CreateAPIView):
     queryset = ContactMessage.objects.all()
     serializer_class = ContactMessageSerializer
@@ -656,6 +814,12 @@ class ContactMessageView(generics.CreateAPIView):
         self.perform_create(serializer)
         return Response({'message': 'Ваше сообщение успешно отправлено!'}, status=status.HTTP_201_CREATED)
 
+    def perform_create(self, serializer):
+        if settings.CONTACT_MESSAGES_BATCHED:
+            contact_message_writer.append(ContactMessage(**serializer.validated_data))
+        else:
+            run_write(serializer.save)
+
 # ============ ADMIN VIEWSETS ============
 from .serializers import (
     CategoryAdminSerializer, ProductAdminSerializer, BrandAdminSerializer, TagAdminSerializer,
@@ -696,7 +860,18 @@ class ProductAdminViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminUser]
     
     def get_queryset(self):
-        queryset = super().get_queryset()
+        return self.eager_queryset(self.filter_products(super().get_queryset()))
+
+    def eager_queryset(self, queryset):
+        fields = ProductAdminSerializer.requested_fields(self.request)
+        return ProductAdminSerializer.setup_eager_loading(queryset, fields)
+
+    def fresh_product(self, pk):
+        """Товар после записи: prefetch-кэш связей, загруженный до нее, устарел"""
+        return self.eager_queryset(Product.objects.filter(pk=pk)).get()
+
+    def filter_products(self, queryset):
+        """Фильтры списка товаров админки (?search=, ?category=, ?brand=, ?is_available=)"""
         search = self.request.query_params.get('search')
         category = self.request.query_params.get('category')
         brand = self.request.query_params.get('brand')
@@ -714,8 +889,48 @@ class ProductAdminViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(brand_id=brand)
         if is_available is not None:
             queryset = queryset.filter(is_available=is_available.lower() in ['true', '1'])
-        
         return queryset
+
+    @action(detail=False, methods=['get'], url_path='export/(?P<file_format>csv|jsonl|xlsx)')
+    def export_products(self, request, file_format=None):
+        """Потоковая выгрузка товаров с характеристиками, тегами и изображениями (с фильтрами списка)"""
+        records = export.iter_records(
+            self.filter_products(Product.objects.all()),
+            base_url=request.build_absolute_uri('/').rstrip('/'),
+        )
+        filename = f'catalog.{file_format}'
+        content_type = export.EXPORT_FORMATS[file_format]
+        asgi = isinstance(request._request, ASGIRequest)
+        if file_format == 'xlsx':
+            output = export.xlsx_file(records)
+            if not asgi:
+                return FileResponse(output, as_attachment=True, filename=filename, content_type=content_type)
+            size = output.seek(0, 2)
+            output.seek(0)
+            content = export.file_chunks(output)
+        else:
+            content = export.iter_csv(records) if file_format == 'csv' else export.iter_jsonl(records)
+        # под ASGI синхронный итератор был бы собран в память целиком
+        response = StreamingHttpResponse(export.athreaded(content) if asgi else content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        if file_format == 'xlsx':
+            response['Content-Length'] = str(size)
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_products(self, request):
+        """Массовый импорт товаров из CSV/XLSX (поле file); ?dry_run=1 - только проверка"""
+        file = request.FILES.get('file')
+        if not file:
+            return Response({'error': 'No file provided'}, status=400)
+        file_format = file.name.rsplit('.', 1)[-1].lower() if '.' in file.name else ''
+        dry_run = str(request.data.get('dry_run', request.query_params.get('dry_run', ''))).lower() in ['true', '1']
+        try:
+            report = catalog_import.import_catalog(file.read(), file_format, dry_run=dry_run)
+        except catalog_import.CatalogImportError as exc:
+            return Response({'error': str(exc)}, status=400)
+        report['dry_run'] = dry_run
+        return Response(report)
     
     def create(self, request, *args, **kwargs):
         """Создание товара с inline данными"""
@@ -739,29 +954,13 @@ class ProductAdminViewSet(viewsets.ModelViewSet):
             product = Product(**product_data)
             product.save()
             
-            # Обработка характеристик (features)
-            features_data = data.get('features', [])
-            for feat in features_data:
-                if feat.get('feature_id') and feat.get('value_id'):
-                    ProductFeature.objects.create(
-                        product=product,
-                        feature_id=feat['feature_id'],
-                        value_id=feat['value_id']
-                    )
-            
-            # Обработка групп тегов (tag_groups)
-            tag_groups_data = data.get('tag_groups', [])
-            for tg in tag_groups_data:
-                if tg.get('group_name_id'):
-                    tag_group = ProductTagGroup.objects.create(
-                        product=product,
-                        group_name_id=tg['group_name_id']
-                    )
-                    tag_ids = tg.get('tag_ids', [])
-                    if tag_ids:
-                        tag_group.tags.set(tag_ids)
+            # Характеристики и группы тегов - пачками (bulk_create)
+            features_changed = bulk.sync_features(product, data.get('features', []))
+            tags_changed = bulk.sync_tag_groups(product, data.get('tag_groups', []))
+            if features_changed or tags_changed:
+                bulk.relations_changed(product, features=features_changed)
         
-        serializer = self.get_serializer(product)
+        serializer = self.get_serializer(self.fresh_product(product.pk))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
     def update(self, request, *args, **kwargs):
@@ -791,48 +990,16 @@ class ProductAdminViewSet(viewsets.ModelViewSet):
                 product.internal_sku = data['internal_sku']
             product.save()
             
-            # Обновляем характеристики
-            if 'features' in data:
-                product.features.all().delete()
-                for feat in data['features']:
-                    if feat.get('feature_id') and feat.get('value_id'):
-                        ProductFeature.objects.create(
-                            product=product,
-                            feature_id=feat['feature_id'],
-                            value_id=feat['value_id']
-                        )
-            
-            # Обновляем группы тегов
-            if 'tag_groups' in data:
-                product.tag_groups.all().delete()
-                for tg in data['tag_groups']:
-                    if tg.get('group_name_id'):
-                        tag_group = ProductTagGroup.objects.create(
-                            product=product,
-                            group_name_id=tg['group_name_id']
-                        )
-                        tag_ids = tg.get('tag_ids', [])
-                        if tag_ids:
-                            tag_group.tags.set(tag_ids)
-            
-            # Обновляем изображения (порядок и is_main)
-            if 'images' in data:
-                for img_data in data['images']:
-                    if img_data.get('id'):
-                        try:
-                            img = Image.objects.get(id=img_data['id'], product=product)
-                            if 'is_main' in img_data:
-                                img.is_main = img_data['is_main']
-                            if 'order' in img_data:
-                                img.order = img_data['order']
-                            if img_data.get('_delete'):
-                                img.delete()
-                            else:
-                                img.save()
-                        except Image.DoesNotExist:
-                            pass
+            # Связи обновляются по разнице с текущими: неизменные строки не трогаются,
+            # изменения - одним bulk_update / bulk_create / DELETE на связь
+            features_changed = 'features' in data and bulk.sync_features(product, data['features'])
+            tags_changed = 'tag_groups' in data and bulk.sync_tag_groups(product, data['tag_groups'])
+            # изображения: порядок, is_main и _delete
+            images_changed = 'images' in data and bulk.sync_images(product, data['images'])
+            if features_changed or tags_changed or images_changed:
+                bulk.relations_changed(product, features=features_changed, images=images_changed)
         
-        serializer = self.get_serializer(product)
+        serializer = self.get_serializer(self.fresh_product(product.pk))
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'], url_path='upload-image')
@@ -888,7 +1055,8 @@ class CategoryAdminViewSet(viewsets.ModelViewSet):
             else:
                 queryset = queryset.filter(parent_id=parent)
         
-        return queryset
+        fields = CategoryAdminSerializer.requested_fields(self.request)
+        return CategoryAdminSerializer.setup_eager_loading(queryset, fields)
     
     @action(detail=True, methods=['post'], url_path='upload-image')
     def upload_image(self, request, pk=None):
@@ -918,7 +1086,8 @@ class BrandAdminViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(
                 Q(name__icontains=search) | Q(description__icontains=search)
             )
-        return queryset
+        fields = BrandAdminSerializer.requested_fields(self.request)
+        return BrandAdminSerializer.setup_eager_loading(queryset, fields)
     
     @action(detail=True, methods=['post'], url_path='upload-logo')
     def upload_logo(self, request, pk=None):
@@ -1287,6 +1456,29 @@ def admin_stats(request):
 
 # ============ ORDERS ============
 
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_MAX_LENGTH = Order._meta.get_field('idempotency_key').max_length
+
+
+def _fingerprint_default(value):
+    return value.pk if isinstance(value, models.Model) else str(value)
+
+
+def idempotency_fingerprint(serializer):
+    """Хэш проверенных полей заказа: товары сравниваются по id, числа - строкой.
+    Вычисленное при проверке (цены корзины в checkout) не учитывается."""
+    data = {name: value for name, value in serializer.validated_data.items() if name in serializer.fields}
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=_fingerprint_default)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def idempotency_scope(request):
+    """Клиент, которому принадлежит ключ: пользователь или адрес, как у троттлинга"""
+    if request.user and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'anon:{AnonRateThrottle().get_ident(request)}'
+
+
 class OrderViewSet(viewsets.ModelViewSet):
     """Публичный endpoint для создания заказов.
     Только POST (create) разрешён анонимным пользователям.
@@ -1295,15 +1487,94 @@ class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.prefetch_related('items').order_by('-created_at')
 
     def get_serializer_class(self):
+        # покупатели (кроме персонала) оформляют заказ только по ценам каталога:
+        # price, product_name и product_sku из запроса игнорируются
+        if self.action in ('create', 'checkout') and not self.request.user.is_staff:
+            return OrderCheckoutSerializer
         if self.request.user and self.request.user.is_authenticated:
             return OrderAdminSerializer
         return OrderSerializer
 
     def get_permissions(self):
-        if self.action == 'create':
+        if self.action in ('create', 'checkout'):
             return [AllowAny()]
         return [IsAdminUser()]
 
+    def create(self, request, *args, **kwargs):
+        return self._create_order(self.get_serializer(data=request.data))
+
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
+        """Создать заказ по корзине с ценами из каталога (см. cart_quote)"""
+        return self._create_order(
+            OrderCheckoutSerializer(data=request.data, context=self.get_serializer_context())
+        )
+
+    def _create_order(self, serializer):
+        """Создание заказа с поддержкой заголовка Idempotency-Key.
+
+        Ключ действует в пределах клиента (idempotency_scope) и IDEMPOTENCY_KEY_TTL:
+        в базе хранится хэш клиента и ключа, так что чужой или угаданный ключ
+        не находит чужой заказ. Повтор с тем же ключом и теми же данными
+        (клиент не дождался ответа и отправил заново) возвращает исходный заказ
+        со статусом 200 и ничего не записывает; тот же ключ с другими данными - 422.
+        Одновременные запросы с одним ключом разводит уникальный индекс:
+        проигравший получает IntegrityError и отдает заказ победителя.
+        """
+        key = self.request.headers.get(IDEMPOTENCY_HEADER, '').strip() or None
+        if key and len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return Response(
+                {'error': f'{IDEMPOTENCY_HEADER} must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer.is_valid(raise_exception=True)
+        if not key:
+            run_write(serializer.save)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        stored_key = hashlib.sha256(f'{idempotency_scope(self.request)}\n{key}'.encode('utf-8')).hexdigest()
+        fingerprint = idempotency_fingerprint(serializer)
+        cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        existing = self._idempotent_order(stored_key, cutoff)
+        if existing:
+            return self._replayed_order(serializer, existing, fingerprint)
+
+        def save():
+            # просроченный ключ освобождается, иначе его не пустит уникальный индекс
+            Order.objects.filter(idempotency_key=stored_key, created_at__lt=cutoff).update(idempotency_key=None)
+            serializer.save(idempotency_key=stored_key, idempotency_fingerprint=fingerprint)
+
+        try:
+            run_write(save)
+        except IntegrityError:
+            existing = self._idempotent_order(stored_key, cutoff)
+            if existing is None:
+                raise
+            return self._replayed_order(serializer, existing, fingerprint)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _idempotent_order(self, stored_key, cutoff):
+        return Order.objects.filter(idempotency_key=stored_key, created_at__gte=cutoff).first()
+
+    def _replayed_order(self, serializer, order, fingerprint):
+        if order.idempotency_fingerprint != fingerprint:
+            return Response(
+                {'error': f'{IDEMPOTENCY_HEADER} was already used with a different request body'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        data = type(serializer)(order, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_200_OK, headers={'Idempotent-Replayed': 'true'})
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def cart_quote(request):
+    """Расчет корзины: актуальные цены, наличие и итог по списку {product, quantity}"""
+    serializer = CartQuoteSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return Response(quote_to_json(quote_cart(serializer.validated_data['items'])))
+
 
 # ============ REVIEWS & QUESTIONS ============
 
@@ -1326,7 +1597,7 @@ class ProductReviewViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         product_slug = self.kwargs.get('product_slug')
         product = Product.objects.get(slug=product_slug)
-        serializer.save(product=product)
+        run_write(serializer.save, product=product)
 
 
 class ProductQuestionViewSet(viewsets.ModelViewSet):
@@ -1348,26 +1619,30 @@ class ProductQuestionViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         product_slug = self.kwargs.get('product_slug')
         product = Product.objects.get(slug=product_slug)
-        serializer.save(product=product)
+        run_write(serializer.save, product=product)
 
 
 @api_view(['GET'])
+@replica_read
 def similar_products(request, slug):
-    """Get similar products from the same category"""
-    try:
-        product = Product.objects.select_related('category').get(slug=slug)
-    except Product.DoesNotExist:
-        return Response({'detail': 'Not found'}, status=404)
-
-    similar = Product.objects.filter(
-        category=product.category,
+    """Похожие товары из индекса ProductSimilarity (build_similarity),
+    для товаров вне индекса - из той же категории"""
+    selection = parse_field_selection(request)
+    similar = list(prepare_product_list(Product.objects.filter(
+        similar_to__product__slug=slug,
         is_available=True
-    ).exclude(id=product.id).select_related(
-        'category', 'brand'
-    ).prefetch_related('images')[:12]
-
-    serializer = ProductListSerializer(similar, many=True, context={'request': request})
-    return Response(serializer.data)
+    ).order_by('similar_to__rank'), selection)[:SIMILAR_TOP_K])
+
+    if not similar:
+        product = Product.objects.filter(slug=slug).only('id', 'category_id').first()
+        if product is None:
+            return Response({'detail': 'Not found'}, status=404)
+        similar = prepare_product_list(Product.objects.filter(
+            category_id=product.category_id,
+            is_available=True
+        ).exclude(id=product.id), selection)[:SIMILAR_TOP_K]
+
+    return Response(serialize_product_cards(similar, {'request': request}))
 
 
 # ============ ADMIN: REVIEWS & QUESTIONS ============
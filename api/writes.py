@@ -0,0 +1,153 @@
+# api/writes.py
+"""
+Публичные записи (заказы, отзывы, вопросы, сообщения) при конкурентной нагрузке.
+
+SQLite допускает одного писателя. Транзакции открываются как BEGIN IMMEDIATE
+(DATABASES OPTIONS transaction_mode), поэтому блокировка берется в начале
+короткой транзакции, а не при первом INSERT посреди нее. Если блокировку
+не удалось получить за busy timeout, запись повторяется с экспоненциальной
+задержкой и случайным разбросом (run_write / retry_on_lock).
+
+Общее ожидание одной записи ограничено SQLITE_WRITE_MAX_WAIT: повтор не
+начинается после этого срока, а busy timeout повторных попыток урезается до
+оставшегося времени. Без этого каждая из попыток могла бы ждать полный busy
+timeout, и запрос висел бы минуты.
+
+Для малоприоритетных записей есть BatchedWriter: объекты копятся в памяти
+процесса и сбрасываются одним bulk_create по размеру пачки или по таймеру.
+"""
+import atexit
+import functools
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+LOCK_ERROR_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_lock_error(exc):
+    return isinstance(exc, OperationalError) and any(msg in str(exc) for msg in LOCK_ERROR_MESSAGES)
+
+
+def backoff_delay(attempt):
+    """Задержка перед повтором: экспонента от SQLITE_WRITE_RETRY_BASE_DELAY с full jitter"""
+    base = _setting('SQLITE_WRITE_RETRY_BASE_DELAY', 0.05)
+    cap = _setting('SQLITE_WRITE_RETRY_MAX_DELAY', 1.0)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _set_busy_timeout(seconds):
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA busy_timeout = {max(int(seconds * 1000), 0)}')
+
+
+def run_write(func, *args, **kwargs):
+    """Выполнить func в отдельной транзакции, повторяя ее при 'database is locked'.
+
+    Внутри внешней транзакции повтор невозможен (ее нельзя перезапустить
+    частично), поэтому там ошибка пробрасывается сразу.
+    """
+    attempts = _setting('SQLITE_WRITE_RETRY_ATTEMPTS', 5)
+    deadline = time.monotonic() + _setting('SQLITE_WRITE_MAX_WAIT', 20.0)
+    busy_timeout = connection.settings_dict['OPTIONS'].get('timeout', 5.0)
+    shortened = False
+    try:
+        for attempt in range(attempts):
+            remaining = deadline - time.monotonic()
+            if attempt and connection.vendor == 'sqlite' and remaining < busy_timeout:
+                _set_busy_timeout(remaining)
+                shortened = True
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError as exc:
+                if not is_lock_error(exc) or connection.in_atomic_block or attempt == attempts - 1:
+                    raise
+                delay = backoff_delay(attempt)
+                if time.monotonic() + delay >= deadline:
+                    logger.warning('Database is locked, giving up after %s attempts', attempt + 1)
+                    raise
+                logger.warning('Database is locked, retrying write in %.3fs (attempt %s/%s)',
+                               delay, attempt + 1, attempts)
+                time.sleep(delay)
+    finally:
+        if shortened:
+            _set_busy_timeout(busy_timeout)
+
+
+def retry_on_lock(func):
+    """Декоратор для run_write"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return run_write(func, *args, **kwargs)
+    return wrapper
+
+
+class BatchedWriter:
+    """Очередь записи одной модели со сбросом пачками.
+
+    append() не ходит в БД: объект попадает в буфер, который сбрасывается
+    bulk_create, когда наберется batch_size объектов или пройдет
+    flush_interval секунд. Буфер живет в памяти процесса, поэтому при
+    аварийном завершении воркера несброшенные объекты теряются - подходит
+    только для данных, потеря которых некритична.
+    """
+
+    def __init__(self, model, batch_size=50, flush_interval=2.0):
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    def append(self, instance):
+        with self._lock:
+            self._buffer.append(instance)
+            full = len(self._buffer) >= self.batch_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not batch:
+            return 0
+        try:
+            run_write(self.model.objects.bulk_create, batch)
+        except Exception:
+            logger.exception('Failed to flush %s %s objects', len(batch), self.model.__name__)
+            with self._lock:
+                self._buffer[:0] = batch
+            raise
+        return len(batch)
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            pass  # уже залогировано, объекты вернулись в буфер до следующего сброса
+        finally:
+            connection.close()
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import copy
 from pathlib import Path
 import os
 
@@ -81,6 +82,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.db_routing.PrimaryStickinessMiddleware',
 ]
 # CORS настройки - только доверенные домены!
 # В production убедитесь что здесь только ваши настоящие домены
@@ -117,8 +119,11 @@ CORS_ALLOW_HEADERS = [
     'cache-control',
     'pragma',
     'expires',
+    'idempotency-key',
 ]
 
+CORS_EXPOSE_HEADERS = ['idempotent-replayed']
+
 CORS_ALLOW_METHODS = [
     'DELETE',
     'GET',
@@ -151,13 +156,74 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Профили SQLite (SQLITE_PROFILE):
+#   production - WAL (читатели не блокируют писателя), synchronous=NORMAL,
+#                mmap и кэш страниц, временные таблицы в памяти, постоянные
+#                соединения с проверкой перед повторным использованием;
+#   basic      - журнал по умолчанию и новое соединение на каждый запрос
+#                (для сравнения: manage.py loadtest --db-profile basic).
+# Блокировка записи берется в начале транзакции (BEGIN IMMEDIATE), а не посреди
+# нее - ожидание по busy timeout вместо мгновенной 'database is locked'.
+SQLITE_PROFILES = {
+    'basic': {
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': False,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            # режим журнала хранится в файле БД, поэтому возвращаем его явно
+            'init_command': 'PRAGMA journal_mode=DELETE;',
+            'timeout': 5,
+        },
+    },
+    'production': {
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=268435456;'  # 256 MB
+                'PRAGMA cache_size=-65536;'    # 64 MB
+                'PRAGMA temp_store=MEMORY;'
+            ),
+            'timeout': 20,  # busy timeout, секунд
+        },
+    },
+}
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # SQLITE_PATH позволяет направить приложение на отдельный файл (нагрузочные тесты)
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        # Тестовая БД - файл, а не память: тесты конкурентных записей открывают
+        # несколько соединений из разных потоков (файл в .gitignore, удаляется после тестов)
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        **copy.deepcopy(SQLITE_PROFILES[SQLITE_PROFILE]),
     }
 }
 
+# Реплика только для чтения (копия основной БД, см. manage.py sync_replica).
+# Публичные GET-запросы каталога читают с нее, записи и админка - с default.
+SQLITE_REPLICA_PATH = os.environ.get('SQLITE_REPLICA_PATH')
+if SQLITE_REPLICA_PATH:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{SQLITE_REPLICA_PATH}?mode=ro',
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': DATABASES['default']['CONN_HEALTH_CHECKS'],
+        'OPTIONS': {
+            'init_command': 'PRAGMA query_only=1;PRAGMA mmap_size=268435456;PRAGMA cache_size=-65536;',
+            'timeout': 20,
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['api.db_routing.ReplicaRouter']
+# Сколько секунд после записи клиент читает из основной БД (read-your-writes)
+REPLICA_STICKY_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -198,6 +264,7 @@ REST_FRAMEWORK = {
         'anon': '1000/hour' if DEBUG else '500/hour',  # Строже в production
         'user': '5000/hour' if DEBUG else '2000/hour',
         'login': '5/hour',  # Защита от брутфорса
+        'suggest': '120/minute',  # подсказки поиска на каждое нажатие клавиши
     },
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
 }  # False для JavaScript доступа (API)
@@ -258,6 +325,43 @@ STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Кэш: карточки товаров, cache_page, троттлинг. MAX_ENTRIES с запасом под карточки каталога
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+PRODUCT_CARD_CACHE_TIMEOUT = 60 * 60
+# Фрагменты главной (/api/home/) - см. api/home.py
+HOME_FRAGMENT_TIMEOUT = 60 * 5
+# Индекс подсказок поиска в памяти процесса - см. api/search.py
+SEARCH_INDEX_MAX_AGE = 60 * 5
+SEARCH_INDEX_MAX_ENTRIES = 200_000
+# Кэш результатов ?search= и прогрев популярных запросов
+SEARCH_RESULTS_CACHE_TIMEOUT = 60 * 10
+# больше совпадений - фильтр подзапросом вместо кэшированного списка id
+SEARCH_RESULTS_MAX_IDS = 2000
+# запрос из одной-двух букв ищется вхождением без индекса, не дальше стольких товаров
+SEARCH_SHORT_QUERY_LIMIT = 1000
+SEARCH_POPULAR_QUERIES = 200
+SEARCH_POPULAR_DECAY = 60 * 60
+SEARCH_WARM_ASYNC = os.environ.get('SEARCH_WARM_ASYNC', 'True') == 'True'
+
+# Документы карточек товаров пересобираются в фоновом потоке после коммита
+PRODUCT_DOCUMENTS_ASYNC = os.environ.get('PRODUCT_DOCUMENTS_ASYNC', 'True') == 'True'
+
+# Повтор публичных записей при 'database is locked' (api/writes.py)
+SQLITE_WRITE_RETRY_ATTEMPTS = 5
+SQLITE_WRITE_RETRY_BASE_DELAY = 0.05
+SQLITE_WRITE_RETRY_MAX_DELAY = 1.0
+# Предел общего ожидания одной записи вместе с повторами, секунд
+SQLITE_WRITE_MAX_WAIT = 20.0
+# Сколько секунд повтор заказа с тем же Idempotency-Key возвращает исходный заказ
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+# Сообщения с формы контактов пишутся пачками через очередь в памяти процесса
+CONTACT_MESSAGES_BATCHED = os.environ.get('CONTACT_MESSAGES_BATCHED', 'False') == 'True'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'